@@ -1,11 +1,15 @@
 import json
 import os
+import sys
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
+from upload_store import DEFAULT_ROOT, UploadStore, logged_upload_path
+
 DEBUG_DIR = 'static/uploads/debug'
 LOG = os.path.join(DEBUG_DIR, 'debug_logs.jsonl')
-TARGET = 'IMG-20251217-WA0007.jpg'
+# uploaded filename or upload hash (first argument overrides)
+TARGET = sys.argv[1] if len(sys.argv) > 1 else 'IMG-20251217-WA0007.jpg'
 OUT = os.path.join(DEBUG_DIR, f'annotated_{TARGET}.png')
 
 # Read last matching log entry
@@ -13,14 +17,15 @@ entry = None
 with open(LOG, 'r', encoding='utf-8') as f:
     for line in f:
         obj = json.loads(line)
-        if obj.get('filename') == TARGET:
+        if TARGET in (obj.get('filename'), obj.get('upload_id')):
             entry = obj
 
 if entry is None:
     print('No log entry found for', TARGET)
     raise SystemExit(1)
 
-img_path = os.path.join(DEBUG_DIR, TARGET)
+# Uploads live in the content-addressed store; older entries only have the debug-folder copy
+img_path = logged_upload_path(entry, UploadStore(DEFAULT_ROOT), DEBUG_DIR)
 if not os.path.exists(img_path):
     print('Image not found:', img_path)
     raise SystemExit(1)
@@ -1,13 +1,33 @@
+import atexit
 import os
-from flask import Flask, request, render_template, jsonify
+from flask import (Flask, Request, Response, g, has_request_context, request, render_template, jsonify,
+                   send_file, stream_with_context, url_for)
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import numpy as np
 from PIL import Image
-import tensorflow as tf
 import logging
 import json
-import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from batcher import MicroBatcher
+from tflite_backend import TFLiteModel
+from inference_server import RemoteModel
+from image_pipeline import ImagePipeline
+from prediction_cache import PredictionCache
+from debug_writer import DebugWriter
+from upload_store import UploadStore, is_digest, upload_digest
+from upload_check import check_image_header, rejection_message
+from perceptual_index import PerceptualIndex, dhash
+from shadow_eval import ShadowEvaluator
+from metrics import Metrics
+from shared_config import SharedConfig
+from leaf_check import fast_leaf_check, green_proportion
+from lesion_localizer import context_box, localize_lesions
+from mask_overlay import green_mask, mask_key, render_mask_overlay, rle_encode, downscale
 
 app = Flask(__name__)
 CORS(app)
@@ -18,6 +38,18 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MODEL_PATH = 'models/tomato_model.h5'
 # Optional leaf-detector model (binary: leaf / not-leaf)
 LEAF_DETECTOR_PATH = 'models/leaf_detector.h5'
+# Inference backend: 'keras' loads the .h5 files through TensorFlow, 'tflite'
+# runs the converted .tflite files (works with tflite_runtime alone)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras').lower()
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', 'models/tomato_model.tflite')
+LEAF_DETECTOR_TFLITE_PATH = os.getenv('LEAF_DETECTOR_TFLITE_PATH', 'models/leaf_detector.tflite')
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', 2))
+TFLITE_POOL_SIZE = int(os.getenv('TFLITE_POOL_SIZE', 2))
+# INFERENCE_BACKEND=remote: models live in inference_server.py, reached over this Unix socket
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET', '/tmp/tomato-inference.sock')
+INFERENCE_TIMEOUT_S = float(os.getenv('INFERENCE_TIMEOUT_S', 30))
+# Load and warm both models at worker boot instead of on the first request
+PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', '0') == '1'
 
 # Configurable HSV thresholds and green proportion via env (defaults tuned)
 GREEN_H_MIN = int(os.getenv('GREEN_H_MIN', 25))
@@ -25,45 +57,134 @@ GREEN_H_MAX = int(os.getenv('GREEN_H_MAX', 100))
 S_MIN = int(os.getenv('S_MIN', 40))
 V_MIN = int(os.getenv('V_MIN', 40))
 GREEN_PROP_THRESH = float(os.getenv('GREEN_PROP_THRESH', 0.03))
+# HSV leaf check: 'exact' scans every pixel of the working image, 'fast' samples a
+# LEAF_CHECK_MAX_SIDE grid and stops as soon as the decision is statistically clear
+LEAF_CHECK_MODE = os.getenv('LEAF_CHECK_MODE', 'exact').lower()
+LEAF_CHECK_MAX_SIDE = int(os.getenv('LEAF_CHECK_MAX_SIDE', 256))
 # Prediction confidence threshold (below this -> mark as 'Uncertain')
 CONF_THRESH = float(os.getenv('CONF_THRESH', 0.6))
-# Persisted config file for admin-tuned thresholds
+# Micro-batching of classifier calls (useful with threaded gunicorn workers)
+BATCH_ENABLED = os.getenv('BATCH_ENABLED', '0') == '1'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 5))
+BATCH_MAX_QUEUE = int(os.getenv('BATCH_MAX_QUEUE', 64))
+# Prediction cache: in-memory LRU per worker, plus an optional directory shared by all workers
+PRED_CACHE_SIZE = int(os.getenv('PRED_CACHE_SIZE', 512))
+PRED_CACHE_DIR = os.getenv('PRED_CACHE_DIR', '')
+# Bulk endpoint: images per batched forward pass, files per request and request body limit
+BATCH_PREDICT_CHUNK = int(os.getenv('BATCH_PREDICT_CHUNK', 16))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 500))
+BATCH_MAX_CONTENT_MB = int(os.getenv('BATCH_MAX_CONTENT_MB', 256))
+# Green-mask overlays: 'lazy' renders on first view, 'background' right after the response,
+# 'eager' before responding. Clients can override per request with the `mask` form field.
+MASK_MODE = os.getenv('MASK_MODE', 'lazy').lower()
+MASK_MAX_SIDE = int(os.getenv('MASK_MAX_SIDE', 512))
+MASK_RLE_MAX_SIDE = int(os.getenv('MASK_RLE_MAX_SIDE', 128))
+# Lesion boxes (lesions=1 on /api/predict) are searched on a copy at most this large
+LESION_MAX_SIDE = int(os.getenv('LESION_MAX_SIDE', 512))
+LESION_MAX_BOXES = int(os.getenv('LESION_MAX_BOXES', 4))
+# Multi-crop inference: classify the full frame plus up to INFERENCE_CROPS lesion crops
+# (each CROP_CONTEXT times the lesion box) in one batch and combine them with CROP_AGGREGATE (mean|max)
+INFERENCE_CROPS = int(os.getenv('INFERENCE_CROPS', 0))
+CROP_CONTEXT = float(os.getenv('CROP_CONTEXT', 2.0))
+CROP_AGGREGATE = os.getenv('CROP_AGGREGATE', 'mean').lower()
+# Content-addressed upload store (uploads are deduplicated by hash and normalized at ingest)
+UPLOAD_STORE_DIR = os.getenv('UPLOAD_STORE_DIR', os.path.join(UPLOAD_FOLDER, 'store'))
+UPLOAD_MAX_SIDE = int(os.getenv('UPLOAD_MAX_SIDE', 1024))
+UPLOAD_JPEG_QUALITY = int(os.getenv('UPLOAD_JPEG_QUALITY', 85))
+# /metrics: with several gunicorn workers, point METRICS_DIR at a directory they all share
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL_MS = float(os.getenv('METRICS_FLUSH_INTERVAL_MS', 1000))
+# Persisted config file for admin-tuned thresholds, shared by all workers through
+# a memory-mapped generation counter next to it (config.json.gen)
 CONFIG_PATH = 'config.json'
+CONFIG_KEYS = ('GREEN_H_MIN', 'GREEN_H_MAX', 'S_MIN', 'V_MIN', 'GREEN_PROP_THRESH')
+shared_config = SharedConfig(CONFIG_PATH, defaults={
+    'GREEN_H_MIN': GREEN_H_MIN,
+    'GREEN_H_MAX': GREEN_H_MAX,
+    'S_MIN': S_MIN,
+    'V_MIN': V_MIN,
+    'GREEN_PROP_THRESH': GREEN_PROP_THRESH,
+})
+
+# Thresholds at start-up (env defaults overridden by config.json); requests use current_config()
+_config = shared_config.current()
+GREEN_H_MIN = _config.values['GREEN_H_MIN']
+GREEN_H_MAX = _config.values['GREEN_H_MAX']
+S_MIN = _config.values['S_MIN']
+V_MIN = _config.values['V_MIN']
+GREEN_PROP_THRESH = _config.values['GREEN_PROP_THRESH']
 
-def load_config():
-    if os.path.exists(CONFIG_PATH):
-        try:
-            import json
-            with open(CONFIG_PATH, 'r') as f:
-                cfg = json.load(f)
-            return cfg
-        except Exception:
-            return {}
-    return {}
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-def save_config(cfg):
-    try:
-        import json
-        with open(CONFIG_PATH, 'w') as f:
-            json.dump(cfg, f)
-    except Exception as e:
-        print(f"Error saving config: {e}")
+# Ingest limits, checked from the image header before anything is decoded or stored
+UPLOAD_MAX_DIMENSION = int(os.getenv('UPLOAD_MAX_DIMENSION', 10000))
+UPLOAD_MAX_PIXELS = int(float(os.getenv('UPLOAD_MAX_MEGAPIXELS', 40)) * 1e6)
+# Uploaded files are buffered in memory up to this size (werkzeug's default spills to disk above 500 KB)
+UPLOAD_SPOOL_MB = float(os.getenv('UPLOAD_SPOOL_MB', 16))
 
-# Load persisted overrides (if any)
-_cfg = load_config()
-GREEN_H_MIN = int(_cfg.get('GREEN_H_MIN', GREEN_H_MIN))
-GREEN_H_MAX = int(_cfg.get('GREEN_H_MAX', GREEN_H_MAX))
-S_MIN = int(_cfg.get('S_MIN', S_MIN))
-V_MIN = int(_cfg.get('V_MIN', V_MIN))
-GREEN_PROP_THRESH = float(_cfg.get('GREEN_PROP_THRESH', GREEN_PROP_THRESH))
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+class UploadRequest(Request):
+    """Request class that lets the bulk endpoint accept bodies larger than MAX_CONTENT_LENGTH
+    and keeps single-file uploads in memory (spilling to a temp file only past UPLOAD_SPOOL_MB).
+    The bulk endpoint keeps werkzeug's default, so hundreds of files are not all held in RAM."""
+
+    @property
+    def max_content_length(self):
+        if self.path == '/api/predict/batch':
+            return BATCH_MAX_CONTENT_MB * 1024 * 1024
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path == '/api/predict/batch':
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return tempfile.SpooledTemporaryFile(max_size=int(UPLOAD_SPOOL_MB * 1024 * 1024), mode='rb+')
+
+
+app.request_class = UploadRequest
 
 # Debug helpers
 DEBUG_DIR = os.path.join(UPLOAD_FOLDER, 'debug')
 DEBUG_LOG = os.path.join(DEBUG_DIR, 'debug_logs.jsonl')
 os.makedirs(DEBUG_DIR, exist_ok=True)
+# Debug log is written off the request path by a background thread
+DEBUG_QUEUE_SIZE = int(os.getenv('DEBUG_QUEUE_SIZE', 1000))
+DEBUG_FLUSH_INTERVAL_MS = float(os.getenv('DEBUG_FLUSH_INTERVAL_MS', 200))
+DEBUG_LOG_MAX_MB = float(os.getenv('DEBUG_LOG_MAX_MB', 50))
+DEBUG_LOG_MAX_AGE_DAYS = float(os.getenv('DEBUG_LOG_MAX_AGE_DAYS', 7))
+# Rotated logs past this count or age are deleted (0 keeps them)
+DEBUG_LOG_KEEP_ROTATED = int(os.getenv('DEBUG_LOG_KEEP_ROTATED', 20))
+DEBUG_LOG_RETENTION_DAYS = float(os.getenv('DEBUG_LOG_RETENTION_DAYS', 30))
+debug_writer = DebugWriter(DEBUG_LOG, DEBUG_DIR,
+                           max_queue=DEBUG_QUEUE_SIZE,
+                           flush_interval=DEBUG_FLUSH_INTERVAL_MS / 1000.0,
+                           max_bytes=int(DEBUG_LOG_MAX_MB * 1024 * 1024),
+                           max_age_s=DEBUG_LOG_MAX_AGE_DAYS * 24 * 3600,
+                           keep_rotated=DEBUG_LOG_KEEP_ROTATED,
+                           retention_s=DEBUG_LOG_RETENTION_DAYS * 24 * 3600,
+                           # uploads referenced only by a pruned log are deleted from the store
+                           on_prune=lambda path: upload_store.release_log(path))
+atexit.register(debug_writer.flush)
+
+# Near-duplicate lookup: reuse a past prediction for an upload whose dHash is within PHASH_MAX_DISTANCE bits
+PHASH_ENABLED = os.getenv('PHASH_ENABLED', '0') == '1'
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 4))
+PHASH_INDEX_PATH = os.getenv('PHASH_INDEX_PATH', os.path.join(DEBUG_DIR, 'phash_index.jsonl'))
+# The index file is compacted to the newest PHASH_MAX_ENTRIES predictions (0 = unbounded)
+PHASH_MAX_ENTRIES = int(os.getenv('PHASH_MAX_ENTRIES', 100000))
+phash_index = PerceptualIndex(PHASH_INDEX_PATH, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_MAX_ENTRIES)
+
+# Shadow evaluation: a candidate classifier scores a sample of live uploads on a throttled background thread
+SHADOW_MODEL_PATH = os.getenv('SHADOW_MODEL_PATH', '')
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', 0.1))
+SHADOW_CPU_SHARE = float(os.getenv('SHADOW_CPU_SHARE', 0.25))
+SHADOW_MAX_QUEUE = int(os.getenv('SHADOW_MAX_QUEUE', 16))
+SHADOW_LOG = os.getenv('SHADOW_LOG', os.path.join(DEBUG_DIR, 'shadow_log.jsonl'))
+
+upload_store = UploadStore(UPLOAD_STORE_DIR, max_side=UPLOAD_MAX_SIDE, quality=UPLOAD_JPEG_QUALITY)
+
+prediction_cache = PredictionCache(max_entries=PRED_CACHE_SIZE, disk_dir=PRED_CACHE_DIR or None)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -76,8 +197,27 @@ class_labels = [
     'Mosaic_virus', 'Healthy'
 ]
 
+shadow_evaluator = None
+if SHADOW_MODEL_PATH and not SHADOW_MODEL_PATH.endswith('.tflite'):
+    # a Keras candidate would run on TensorFlow's process-wide thread pools, competing with the primary
+    print(f"Shadow evaluation disabled: SHADOW_MODEL_PATH must be a .tflite model, got {SHADOW_MODEL_PATH} "
+          f"(convert it with convert_to_tflite.py, or compare it offline with shadow_eval.py --replay)")
+elif SHADOW_MODEL_PATH:
+    shadow_evaluator = ShadowEvaluator(lambda: load_shadow_model(SHADOW_MODEL_PATH),
+                                       lambda rows: aggregate_crops(rows), class_labels, CONF_THRESH,
+                                       log_path=SHADOW_LOG, sample_rate=SHADOW_SAMPLE_RATE,
+                                       cpu_share=SHADOW_CPU_SHARE, max_queue=SHADOW_MAX_QUEUE)
+
 # Load the model (with error handling)
 def load_model():
+    if INFERENCE_BACKEND == 'remote':
+        return load_remote('model')
+    if INFERENCE_BACKEND == 'tflite':
+        try:
+            return load_tflite(TFLITE_MODEL_PATH)
+        except Exception as e:
+            print(f"Error loading TFLite model: {str(e)}")
+            return None
     try:
         # If model is missing but a download URL is provided, try to fetch it
         model_url = os.getenv('MODEL_URL')
@@ -98,12 +238,185 @@ def load_model():
 
         if not os.path.exists(MODEL_PATH):
             return None
+        import tensorflow as tf
         return tf.keras.models.load_model(MODEL_PATH)
     except Exception as e:
         print(f"Error loading model: {str(e)}")
         return None
 
+
+# Raw .tflite bytes read before gunicorn forks (preload_app), shared copy-on-write by the workers
+_tflite_content = {}
+
+
+def preload_tflite_content():
+    """Read the .tflite files into memory once, so forked workers share the pages."""
+    for path in (TFLITE_MODEL_PATH, LEAF_DETECTOR_TFLITE_PATH):
+        if path not in _tflite_content and os.path.exists(path):
+            with open(path, 'rb') as f:
+                _tflite_content[path] = f.read()
+
+
+def load_tflite(path):
+    """Load a .tflite model behind an interpreter pool, or return None if it is missing."""
+    if path in _tflite_content:
+        return TFLiteModel(model_content=_tflite_content[path],
+                           num_threads=TFLITE_NUM_THREADS, pool_size=TFLITE_POOL_SIZE)
+    if not os.path.exists(path):
+        return None
+    return TFLiteModel(model_path=path, num_threads=TFLITE_NUM_THREADS, pool_size=TFLITE_POOL_SIZE)
+
+
+def load_shadow_model(path):
+    """Load a candidate model for shadow evaluation, or None if the file is missing.
+
+    A .tflite model gets its own single-threaded interpreter. Keras models are accepted only for the
+    offline replay: live shadowing requires .tflite, since Keras would share TensorFlow's intra-op pool
+    with the primary model.
+    """
+    if not os.path.exists(path):
+        return None
+    if path.endswith('.tflite'):
+        return TFLiteModel(model_path=path, num_threads=1, pool_size=1)
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+# Models the inference server said it does not hold (e.g. no leaf detector); not asked for again
+_remote_missing = set()
+
+
+def load_remote(name):
+    """Client for a model held by the inference server, or None if the server is down or lacks it."""
+    if name in _remote_missing:
+        return None
+    try:
+        return RemoteModel(INFERENCE_SOCKET, name, timeout=INFERENCE_TIMEOUT_S)
+    except LookupError:
+        _remote_missing.add(name)
+        return None
+    except OSError as e:
+        print(f"Inference server not reachable at {INFERENCE_SOCKET}: {e}")
+        return None
+
 model = None
+batcher = None
+_batcher_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+# Load state and warm-up timings reported by /ready
+MODEL_STATE = {
+    'model': {'loaded': False, 'load_ms': None, 'warmup_ms': None},
+    'leaf_detector': {'loaded': False, 'load_ms': None, 'warmup_ms': None},
+    'warmed_up': False,
+}
+
+
+def collect_runtime_metrics(m):
+    """Refresh the gauges that mirror model state and the worker's queues before each metrics snapshot."""
+    for name in ('model', 'leaf_detector'):
+        state = MODEL_STATE[name]
+        m.set('model_loaded', 1 if state['loaded'] else 0, model=name)
+        if state['load_ms'] is not None:
+            m.set('model_load_seconds', state['load_ms'] / 1000.0, model=name)
+        if state['warmup_ms'] is not None:
+            m.set('model_warmup_seconds', state['warmup_ms'] / 1000.0, model=name)
+    m.set('batcher_queue_depth', batcher.stats()['queue_depth'] if batcher is not None else 0)
+    writer = debug_writer.stats()
+    m.set('debug_queue_depth', writer['queue_depth'])
+    m.set('debug_entries_dropped', writer['dropped'])
+    m.set('prediction_cache_entries', prediction_cache.stats()['entries'])
+
+
+def create_metrics():
+    """The app's metric definitions: per-stage latency histograms, request/rejection/prediction counters and gauges."""
+    m = Metrics(collect_dir=METRICS_DIR or None, flush_interval=METRICS_FLUSH_INTERVAL_MS / 1000.0)
+    m.histogram('stage_seconds', 'Time spent in each stage of handling an upload.')
+    m.histogram('request_seconds', 'Request latency by endpoint.')
+    m.counter('requests_total', 'Requests by endpoint and HTTP status.')
+    m.counter('rejections_total', 'Uploads rejected, by reason.')
+    m.counter('predictions_total', 'Predictions returned, by endpoint and whether the top class was below CONF_THRESH.')
+    m.counter('prediction_cache_total', 'Prediction cache lookups by result.')
+    m.counter('upload_store_total', 'Uploads stored, by whether they were new or deduplicated.')
+    m.counter('near_duplicate_total', 'Perceptual-hash lookups by result.')
+    m.counter('shadow_dropped_total', 'Shadow-evaluation samples dropped because the candidate fell behind.')
+    m.gauge('model_loaded', 'Workers with the model loaded.')
+    m.gauge('model_load_seconds', 'Time to load the model (slowest worker).', aggregate='max')
+    m.gauge('model_warmup_seconds', 'Time of the warm-up prediction (slowest worker).', aggregate='max')
+    m.gauge('batcher_queue_depth', 'Requests waiting for the micro-batcher.')
+    m.gauge('debug_queue_depth', 'Debug log entries waiting to be written.')
+    m.gauge('debug_entries_dropped', 'Debug log entries dropped because the queue was full.')
+    m.gauge('prediction_cache_entries', 'Entries in the in-memory prediction caches.')
+    m.add_collector(collect_runtime_metrics)
+    return m
+
+
+metrics = create_metrics()
+
+
+def _timed_load(name, loader):
+    t0 = time.perf_counter()
+    m = loader()
+    MODEL_STATE[name]['loaded'] = m is not None
+    MODEL_STATE[name]['load_ms'] = round((time.perf_counter() - t0) * 1000.0, 2)
+    return m
+
+
+def get_model():
+    """Return the disease classifier, loading it on first use if it was not preloaded."""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = _timed_load('model', load_model)
+    return model
+
+
+def get_leaf_detector():
+    """Return the optional leaf detector (None if absent), loading it on first use."""
+    global leaf_detector
+    if leaf_detector is None:
+        with _model_lock:
+            if leaf_detector is None:
+                leaf_detector = _timed_load('leaf_detector', load_leaf_detector)
+    return leaf_detector
+
+
+def warm_up_models():
+    """Load both models and run a dummy prediction through each so the first request is not slow."""
+    for name, getter, shape in (('model', get_model, (1, 224, 224, 3)),
+                                ('leaf_detector', get_leaf_detector, (1, 128, 128, 3))):
+        try:
+            m = getter()
+            if m is None:
+                continue
+            t0 = time.perf_counter()
+            m.predict(np.zeros(shape, dtype='float32'))
+            MODEL_STATE[name]['warmup_ms'] = round((time.perf_counter() - t0) * 1000.0, 2)
+        except Exception as e:
+            MODEL_STATE[name]['error'] = str(e)
+            logger.info(f"Warm-up failed for {name}: {e}")
+    MODEL_STATE['warmed_up'] = True
+    logger.info(f"Model warm-up finished: {MODEL_STATE}")
+
+
+def run_classifier(processed_image):
+    """Run the disease classifier on a (1, 224, 224, 3) batch, through the micro-batcher when enabled.
+
+    Multi-row batches (full frame plus crops) are already one forward pass and skip the batcher.
+    """
+    global batcher
+    if not BATCH_ENABLED or processed_image.shape[0] > 1:
+        return model.predict(processed_image)
+    if batcher is None:
+        # concurrent first requests must share one batcher (and its worker thread)
+        with _batcher_lock:
+            if batcher is None:
+                batcher = MicroBatcher(lambda batch: model.predict(batch),
+                                       max_batch_size=BATCH_MAX_SIZE,
+                                       max_wait_ms=BATCH_MAX_WAIT_MS,
+                                       max_queue=BATCH_MAX_QUEUE)
+    return batcher.predict(processed_image)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -132,29 +445,47 @@ def is_leaf_image(image_path, green_h_min=GREEN_H_MIN, green_h_max=GREEN_H_MAX,
     """
     try:
         img = Image.open(image_path).convert('HSV')
-        arr = np.array(img)
-        if arr.size == 0:
-            return False
-        h = arr[:, :, 0]
-        s = arr[:, :, 1]
-        v = arr[:, :, 2]
-
-        green_mask = (h >= green_h_min) & (h <= green_h_max) & (s >= s_min) & (v >= v_min)
-        green_count = np.count_nonzero(green_mask)
-        total_pixels = h.size
-        prop = green_count / float(total_pixels)
-
-        return prop >= green_prop_thresh
+        return is_leaf_hsv(np.array(img), green_h_min, green_h_max, s_min, v_min, green_prop_thresh)
     except Exception as e:
         print(f"Leaf-detection error: {e}")
         return False
 
 
+def is_leaf_hsv(arr, green_h_min=None, green_h_max=None, s_min=None, v_min=None, green_prop_thresh=None):
+    """Green-proportion leaf check on an already decoded (H, W, 3) HSV array.
+
+    Thresholds left as None use the current (admin-tunable) values from current_config().
+    """
+    cfg = current_config().values
+    green_h_min = cfg['GREEN_H_MIN'] if green_h_min is None else green_h_min
+    green_h_max = cfg['GREEN_H_MAX'] if green_h_max is None else green_h_max
+    s_min = cfg['S_MIN'] if s_min is None else s_min
+    v_min = cfg['V_MIN'] if v_min is None else v_min
+    green_prop_thresh = cfg['GREEN_PROP_THRESH'] if green_prop_thresh is None else green_prop_thresh
+    if arr.size == 0:
+        return False
+    prop = green_proportion(arr, {'GREEN_H_MIN': green_h_min, 'GREEN_H_MAX': green_h_max,
+                                  'S_MIN': s_min, 'V_MIN': v_min})
+    return prop >= green_prop_thresh
+
+
+def is_leaf_pipeline(pipeline):
+    """HSV leaf heuristic on a decoded upload: every pixel, or a sampled grid with LEAF_CHECK_MODE=fast."""
+    if LEAF_CHECK_MODE == 'fast':
+        return fast_leaf_check(pipeline.image, current_thresholds(), max_side=LEAF_CHECK_MAX_SIDE)[0]
+    return is_leaf_hsv(pipeline.hsv_array())
+
+
 def load_leaf_detector():
     """Lazy-load an optional leaf-detector binary model if present."""
     try:
+        if INFERENCE_BACKEND == 'remote':
+            return load_remote('leaf_detector')
+        if INFERENCE_BACKEND == 'tflite':
+            return load_tflite(LEAF_DETECTOR_TFLITE_PATH)
         if not os.path.exists(LEAF_DETECTOR_PATH):
             return None
+        import tensorflow as tf
         return tf.keras.models.load_model(LEAF_DETECTOR_PATH)
     except Exception as e:
         print(f"Error loading leaf detector: {e}")
@@ -163,215 +494,734 @@ def load_leaf_detector():
 
 leaf_detector = None
 
+if PRELOAD_MODELS and INFERENCE_BACKEND == 'tflite':
+    preload_tflite_content()
+
+
+def mask_filename(filename):
+    """Overlay filename for an upload under the current HSV thresholds."""
+    name, _ = os.path.splitext(filename)
+    return f"{name}_mask_{mask_key(current_thresholds())}.png"
+
+
+def make_mask_overlay(image_path, image=None):
+    """Create (or reuse) the green-mask overlay PNG next to the uploaded image and return its filename.
 
-def make_mask_overlay(image_path):
-    """Create and save a green-mask overlay PNG next to the uploaded image and return its filename."""
+    The overlay is rendered at MASK_MAX_SIDE and cached under a name that includes the HSV
+    thresholds. Pass an already decoded RGB `image` to skip re-reading the file.
+    """
     try:
-        img = Image.open(image_path).convert('RGB')
-        hsv = img.convert('HSV')
-        arr = np.array(hsv)
-        h = arr[:, :, 0]
-        s = arr[:, :, 1]
-        v = arr[:, :, 2]
-        mask = (h >= GREEN_H_MIN) & (h <= GREEN_H_MAX) & (s >= S_MIN) & (v >= V_MIN)
-
-        mask_img = Image.fromarray((mask * 255).astype('uint8'))
-        mask_img = mask_img.convert('L')
-
-        # Create an RGBA overlay: green where mask true, transparent elsewhere
-        overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
-        green_layer = Image.new('RGBA', img.size, (0, 255, 0, 120))
-        overlay.paste(green_layer, mask=mask_img)
-
-        base = img.convert('RGBA')
-        combined = Image.alpha_composite(base, overlay)
-
-        # Save to uploads folder with suffix
         dirname, fname = os.path.split(image_path)
-        name, ext = os.path.splitext(fname)
-        out_name = f"{name}_mask.png"
+        out_name = mask_filename(fname)
         out_path = os.path.join(dirname, out_name)
-        combined.save(out_path)
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(image_path):
+            return out_name
+
+        with metrics.timer('stage_seconds', stage='mask_render'):
+            img = image if image is not None else ImagePipeline.from_path(image_path, max_side=MASK_MAX_SIDE).image
+            combined = render_mask_overlay(img, current_thresholds(), max_side=MASK_MAX_SIDE)
+
+            # Save to uploads folder with suffix (write-then-rename: other workers may serve it)
+            tmp_path = f"{out_path}.{os.getpid()}.tmp"
+            # low zlib level: a preview overlay is not worth ~100 ms of compression per render
+            combined.save(tmp_path, format='PNG', compress_level=1)
+            os.replace(tmp_path, out_path)
         return out_name
     except Exception as e:
         print(f"Error creating mask overlay: {e}")
         return None
 
+
+def mask_rle(image):
+    """Run-length encoded green mask of a downscaled `image`, for clients that draw it themselves."""
+    small = downscale(image, MASK_RLE_MAX_SIDE)
+    return rle_encode(green_mask(np.asarray(small.convert('HSV')), current_thresholds()))
+
+
+def find_lesions(image, size):
+    """Lesion boxes for a decoded upload, in the pixel coordinates of an image of `size` (the original upload)."""
+    with metrics.timer('stage_seconds', stage='lesions'):
+        return localize_lesions(image, max_side=LESION_MAX_SIDE, max_boxes=LESION_MAX_BOXES, size=size)
+
+
+# Single background thread for MASK_MODE=background, so overlays never compete with requests
+_mask_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mask')
+
+
+NOT_LEAF_ERROR = 'Uploaded image does not appear to contain a tomato leaf.'
+
+
+def current_config():
+    """The shared ConfigSnapshot for this request.
+
+    Taken once per request (and kept on flask.g), so every stage of one
+    decision uses the same thresholds and reports the same config_version
+    even if an admin saves new values mid-request.
+    """
+    if not has_request_context():
+        return shared_config.current()
+    snapshot = g.get('config')
+    if snapshot is None:
+        snapshot = g.config = shared_config.current()
+    return snapshot
+
+
+def current_thresholds():
+    """The decision thresholds in effect; part of every prediction cache key."""
+    return {**current_config().values, 'CONF_THRESH': CONF_THRESH}
+
+
+def _file_identity(path):
+    try:
+        st = os.stat(path)
+        return [path, st.st_size, st.st_mtime_ns]
+    except OSError:
+        return [path, None, None]
+
+
+def model_files_identity():
+    """Backend plus path/size/mtime of the model files this process loads."""
+    if INFERENCE_BACKEND == 'tflite':
+        paths = (TFLITE_MODEL_PATH, LEAF_DETECTOR_TFLITE_PATH)
+    else:
+        paths = (MODEL_PATH, LEAF_DETECTOR_PATH)
+    return [INFERENCE_BACKEND] + [_file_identity(p) for p in paths]
+
+
+def model_identity():
+    """Model files (as reported by the inference server when remote) plus crop settings, so a retrained
+    model misses the cache."""
+    crops = f'crops={INFERENCE_CROPS}:{CROP_CONTEXT}:{CROP_AGGREGATE}' if INFERENCE_CROPS > 0 else 'crops=0'
+    if INFERENCE_BACKEND == 'remote':
+        remote = get_model()
+        return [INFERENCE_BACKEND, crops, remote.identity if remote is not None else None]
+    files = model_files_identity()
+    return files[:1] + [crops] + files[1:]
+
+
+def leaf_gate(pipeline):
+    """True if the decoded upload looks like a leaf: detector model if present, HSV heuristic otherwise."""
+    return leaf_gate_batch([pipeline])[0]
+
+
+def leaf_gate_batch(pipelines):
+    """Leaf check for several decoded uploads; the detector (if present) runs as one batched call."""
+    leaf_detector = get_leaf_detector()
+    if leaf_detector is not None:
+        try:
+            # leaf_detector outputs probability of leaf (sigmoid)
+            batch = np.concatenate([p.detector_tensor() for p in pipelines], axis=0)
+            preds = leaf_detector.predict(batch)
+            return [float(pred[0]) >= 0.5 for pred in preds]
+        except Exception as e:
+            print(f"Leaf-detector prediction error: {e}")
+            return [True] * len(pipelines)
+    return [is_leaf_pipeline(p) for p in pipelines]
+
+
+def classifier_inputs(pipeline):
+    """Classifier batch for one upload: the full frame, followed by lesion crops when INFERENCE_CROPS > 0."""
+    with metrics.timer('stage_seconds', stage='preprocess'):
+        full = pipeline.classifier_tensor()
+    if INFERENCE_CROPS <= 0:
+        return full
+    with metrics.timer('stage_seconds', stage='crop_select'):
+        boxes = localize_lesions(pipeline.image, max_side=LESION_MAX_SIDE, max_boxes=INFERENCE_CROPS)
+        crops = [pipeline.crop_tensor(context_box(b, pipeline.image.size, CROP_CONTEXT), 224) for b in boxes]
+    return np.concatenate([full] + crops, axis=0)
+
+
+def aggregate_crops(rows):
+    """One probability row from the full-frame row and its crop rows: their mean, or with
+    CROP_AGGREGATE=max the single most confident row."""
+    if len(rows) == 1:
+        return rows[0]
+    if CROP_AGGREGATE == 'max':
+        return rows[int(np.argmax(rows.max(axis=1)))]
+    return rows.mean(axis=0)
+
+
+def summarize_predictions(row):
+    """Turn one row of class probabilities into the result dict returned and logged by the endpoints."""
+    top_idx = int(np.argmax(row))
+    top_prob = float(np.max(row))
+    return {
+        'leaf': True,
+        'prediction': class_labels[top_idx] if top_prob >= CONF_THRESH else 'Uncertain',
+        'confidence': round(top_prob * 100, 2),
+        'uncertain': top_prob < CONF_THRESH,
+        'raw_predictions': [float(x) for x in row],
+    }
+
+
+def phash_context():
+    """Model and thresholds a near-duplicate result must have been produced under (cf. PredictionCache.make_key)."""
+    return PredictionCache.make_key(b'', model_identity(), current_thresholds())
+
+
+def find_near_duplicate(pipeline):
+    """A past prediction for a perceptually identical image, or None. Returns (result, dhash)."""
+    with metrics.timer('stage_seconds', stage='phash_lookup'):
+        h = dhash(pipeline.image)
+        match = phash_index.lookup(h, phash_context())
+    metrics.inc('near_duplicate_total', result='miss' if match is None else 'hit')
+    if match is None:
+        return None, h
+    distance, record = match
+    return {**record['result'], 'near_duplicate': {'distance': distance, 'upload_id': record.get('upload_id')}}, h
+
+
+def shadow_submit(data, inputs, row, primary_ms):
+    """Hand a sampled classification to the shadow evaluator (SHADOW_MODEL_PATH); never blocks."""
+    if shadow_evaluator is None or not shadow_evaluator.should_sample():
+        return
+    endpoint = request.path if has_request_context() else None
+    if not shadow_evaluator.submit(inputs, row, primary_ms, upload_id=upload_digest(data), endpoint=endpoint):
+        metrics.inc('shadow_dropped_total')
+
+
+def predict_image_bytes(data):
+    """Leaf-gate and classify uploaded image bytes, consulting the prediction cache first.
+
+    Returns (result, pipeline). result is {'leaf': False} for rejected images, otherwise the
+    dict from summarize_predictions(); pipeline is None when the result came from the cache.
+    With PHASH_ENABLED, a leaf that is near-identical to a past upload gets that upload's
+    result (with a 'near_duplicate' field) instead of running the classifier.
+    """
+    with metrics.timer('stage_seconds', stage='cache_lookup'):
+        key = prediction_cache.make_key(data, model_identity(), current_thresholds())
+        cached = prediction_cache.get(key)
+    metrics.inc('prediction_cache_total', result='miss' if cached is None else 'hit')
+    if cached is not None:
+        return cached, None
+
+    # Decode once from memory; nothing is written until the leaf check passes
+    with metrics.timer('stage_seconds', stage='decode'):
+        pipeline = ImagePipeline(data)
+    with metrics.timer('stage_seconds', stage='leaf_gate'):
+        is_leaf = leaf_gate(pipeline)
+    if is_leaf and PHASH_ENABLED:
+        # only after the leaf gate: a non-leaf must never inherit a leaf's result
+        result, h = find_near_duplicate(pipeline)
+        if result is not None:
+            prediction_cache.put(key, result)
+            return result, pipeline
+    if not is_leaf:
+        result = {'leaf': False}
+    else:
+        tensor = classifier_inputs(pipeline)
+        t0 = time.perf_counter()
+        with metrics.timer('stage_seconds', stage='inference'):
+            predictions = run_classifier(tensor)
+        row = aggregate_crops(predictions)
+        result = summarize_predictions(row)
+        shadow_submit(data, tensor, row, (time.perf_counter() - t0) * 1000.0)
+        if INFERENCE_CROPS > 0:
+            result['crops'] = len(tensor) - 1
+        if PHASH_ENABLED:
+            phash_index.add(h, phash_context(), result, upload_id=upload_digest(data))
+    prediction_cache.put(key, result)
+    return result, pipeline
+
+
+def predict_image_batch(items):
+    """Leaf-gate and classify a list of (filename, bytes) uploads with batched model calls.
+
+    Returns one (result, pipeline) pair per item, in order. result is either what
+    predict_image_bytes() would return or {'error': message} for images that could
+    not be decoded; one bad image never fails the others.
+    """
+    thresholds = current_thresholds()
+    model_id = model_identity()
+    out = [None] * len(items)
+    pending = []
+    for i, (name, data) in enumerate(items):
+        with metrics.timer('stage_seconds', stage='cache_lookup'):
+            key = prediction_cache.make_key(data, model_id, thresholds)
+            cached = prediction_cache.get(key)
+        metrics.inc('prediction_cache_total', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            out[i] = (cached, None)
+            continue
+        try:
+            with metrics.timer('stage_seconds', stage='decode'):
+                pending.append((i, key, ImagePipeline(data)))
+        except Exception as e:
+            out[i] = ({'error': f'Error processing image: {str(e)}'}, None)
+
+    if pending:
+        with metrics.timer('stage_seconds', stage='leaf_gate'):
+            gates = leaf_gate_batch([p for _, _, p in pending])
+        leaves = []
+        for (i, key, pipeline), is_leaf in zip(pending, gates):
+            if is_leaf:
+                leaves.append((i, key, pipeline))
+            else:
+                out[i] = ({'leaf': False}, pipeline)
+                prediction_cache.put(key, {'leaf': False})
+        if leaves:
+            inputs = [classifier_inputs(p) for _, _, p in leaves]
+            t0 = time.perf_counter()
+            with metrics.timer('stage_seconds', stage='inference'):
+                predictions = get_model().predict(np.concatenate(inputs, axis=0))
+            per_image_ms = (time.perf_counter() - t0) * 1000.0 / len(leaves)
+            # each upload owns len(inputs[j]) consecutive rows: full frame, then its crops
+            offsets = np.cumsum([0] + [len(x) for x in inputs])
+            for j, (i, key, pipeline) in enumerate(leaves):
+                row = aggregate_crops(predictions[offsets[j]:offsets[j + 1]])
+                result = summarize_predictions(row)
+                shadow_submit(items[i][1], inputs[j], row, per_image_ms)
+                if INFERENCE_CROPS > 0:
+                    result['crops'] = len(inputs[j]) - 1
+                prediction_cache.put(key, result)
+                out[i] = (result, pipeline)
+    return out
+
+
+def iter_batch_uploads():
+    """Yield (filename, bytes, reason) for every file in the request: repeated 'files'/'file' fields and zip archives.
+
+    Files that are not classified come with bytes None and the reason (invalid_type, too_large_file or,
+    past BATCH_MAX_FILES images, too_many_files), so each still gets its own line in the response.
+    """
+    count = 0
+    for field in ('files', 'file', 'archive'):
+        for storage in request.files.getlist(field):
+            if storage.filename == '':
+                continue
+            if storage.filename.lower().endswith('.zip'):
+                with zipfile.ZipFile(storage.stream) as zf:
+                    for info in zf.infolist():
+                        if info.is_dir():
+                            continue
+                        name = os.path.basename(info.filename)
+                        if not allowed_file(info.filename):
+                            yield name, None, 'invalid_type'
+                            continue
+                        count += 1
+                        if count > BATCH_MAX_FILES:
+                            yield name, None, 'too_many_files'
+                        elif info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                            # never inflate an oversized (or zip-bomb) member
+                            yield name, None, 'too_large_file'
+                        else:
+                            yield name, zf.read(info), None
+            elif not allowed_file(storage.filename):
+                yield storage.filename, None, 'invalid_type'
+            else:
+                count += 1
+                if count > BATCH_MAX_FILES:
+                    yield storage.filename, None, 'too_many_files'
+                else:
+                    yield storage.filename, storage.read(), None
+
+
+def check_upload(fp):
+    """Header-only ingest check (format, dimensions, pixel count); returns None or the error message.
+
+    Rejections are counted in rejections_total by reason.
+    """
+    with metrics.timer('stage_seconds', stage='header_check'):
+        _, reason = check_image_header(fp, max_side=UPLOAD_MAX_DIMENSION, max_pixels=UPLOAD_MAX_PIXELS)
+    if reason is None:
+        return None
+    metrics.inc('rejections_total', reason=reason)
+    return rejection_message(reason, UPLOAD_MAX_DIMENSION, UPLOAD_MAX_PIXELS)
+
+
+def store_upload(data, pipeline=None):
+    """Add an upload to the content-addressed store (one reference per logged prediction); returns its hash.
+
+    Re-uploads of known bytes only bump the reference count. `pipeline` is the
+    ImagePipeline already decoded for inference, reused when the image is new.
+    """
+    with metrics.timer('stage_seconds', stage='upload_save'):
+        image = None
+        if pipeline is not None and max(pipeline.image.size) >= min(max(pipeline.original_size), UPLOAD_MAX_SIDE):
+            image = pipeline.image
+        stored = upload_store.put(data, image=image)
+    metrics.inc('upload_store_total', result='created' if stored.created else 'deduplicated')
+    return stored.digest
+
+
+def resolve_upload(name):
+    """Path of an upload given its hash (store) or a legacy filename in UPLOAD_FOLDER."""
+    if is_digest(name):
+        return upload_store.path(name)
+    return os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(name))
+
+
+def write_debug_entry(endpoint, filename, upload_id, result, cached=False):
+    """Queue a prediction for the debug JSONL log; the upload is referenced by its hash in the store.
+
+    `model` and `context` record what produced the result, so tools rebuilding state from the log
+    (perceptual_index.py --build) can skip entries from another model or threshold set.
+    """
+    model_id = model_identity()
+    debug_entry = {
+        'ts': round(time.time(), 3),
+        'endpoint': endpoint,
+        'filename': filename,
+        'upload_id': upload_id,
+        'prediction': result['prediction'],
+        'confidence': result['confidence'],
+        'uncertain': result['uncertain'],
+        'raw_predictions': result['raw_predictions'],
+        'cached': cached,
+        'config_version': current_config().version,
+        'model': model_id,
+        'context': PredictionCache.make_key(b'', model_id, current_thresholds()),
+    }
+    metrics.inc('predictions_total', endpoint=endpoint, uncertain=str(result['uncertain']).lower())
+    with metrics.timer('stage_seconds', stage='debug_write'):
+        submitted = debug_writer.submit(debug_entry)
+    if not submitted:
+        # no log line will ever release this prediction's reference
+        upload_store.release(upload_id)
+        logger.info(f"Debug queue full, dropped entry for {filename}")
+
+
+@app.before_request
+def _start_request_timer():
+    request.environ['tomato.start'] = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.endpoint or 'none'
+    start = request.environ.get('tomato.start')
+    if start is not None:
+        metrics.observe('request_seconds', time.perf_counter() - start, endpoint=endpoint)
+    metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+    snapshot = g.get('config')
+    if snapshot is not None:
+        response.headers['X-Config-Version'] = str(snapshot.version)
+    return response
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Bodies over MAX_CONTENT_LENGTH are refused while streaming, before the upload is buffered."""
+    metrics.inc('rejections_total', reason='too_large_request')
+    limit_mb = request.max_content_length / (1024 * 1024)
+    if request.path.startswith('/api/'):
+        return jsonify({'error': f'Upload too large (limit {limit_mb:g} MB).'}), 413
+    return render_template('index.html', error=f'File too large (limit {limit_mb:g} MB).'), 413
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of stage latencies, counters and gauges (all workers when METRICS_DIR is set)."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/health')
 def health_check():
     return jsonify({"status": "ok"})
 
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness probe: 200 once the classifier is loaded, with per-model load and warm-up timings."""
+    ready = model is not None
+    return jsonify({
+        'ready': ready,
+        'backend': INFERENCE_BACKEND,
+        'preload': PRELOAD_MODELS,
+        **MODEL_STATE,
+    }), (200 if ready else 503)
+
+
+@app.route('/api/batcher')
+def batcher_stats():
+    """Report micro-batching configuration and queue/batch/wait statistics for this worker."""
+    if batcher is None:
+        return jsonify({
+            'enabled': BATCH_ENABLED,
+            'max_batch_size': BATCH_MAX_SIZE,
+            'max_wait_ms': BATCH_MAX_WAIT_MS,
+            'max_queue': BATCH_MAX_QUEUE,
+        })
+    return jsonify({'enabled': BATCH_ENABLED, **batcher.stats()})
+
+
+@app.route('/api/near-duplicates')
+def near_duplicate_stats():
+    """Perceptual-hash index size and hit/miss counters for this worker; ?clusters=1 adds duplicate clusters."""
+    stats = {'enabled': PHASH_ENABLED, **phash_index.stats()}
+    if request.args.get('clusters') in ('1', 'true'):
+        stats['clusters'] = [[{k: r.get(k) for k in ('hash', 'upload_id', 'filename')} for r in group]
+                             for group in phash_index.clusters()]
+    return jsonify(stats)
+
+
+@app.route('/api/inference-server')
+def inference_server_stats():
+    """Batching statistics of the shared inference server (INFERENCE_BACKEND=remote)."""
+    if INFERENCE_BACKEND != 'remote':
+        return jsonify({'enabled': False})
+    m = get_model()
+    if m is None:
+        return jsonify({'enabled': True, 'error': f'not reachable at {INFERENCE_SOCKET}'}), 503
+    try:
+        return jsonify({'enabled': True, 'socket': INFERENCE_SOCKET, **m.stats()})
+    except Exception as e:
+        return jsonify({'enabled': True, 'error': str(e)}), 503
+
+
+@app.route('/api/shadow')
+def shadow_stats():
+    """Shadow evaluation for this worker: sampling, queue and throttling counters plus the agreement report.
+
+    `python shadow_eval.py --report` summarizes the log written by all workers.
+    """
+    if shadow_evaluator is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'candidate': SHADOW_MODEL_PATH, 'log': SHADOW_LOG, **shadow_evaluator.stats()})
+
+
+@app.route('/api/debug-writer')
+def debug_writer_stats():
+    """Report debug-log queue depth, flushes, rotations and dropped entries for this worker."""
+    return jsonify(debug_writer.stats())
+
+
+@app.route('/api/cache')
+def cache_stats():
+    """Report prediction cache hit/miss counters for this worker."""
+    return jsonify(prediction_cache.stats())
+
+
 @app.route('/api/predict', methods=['POST'])
 def api_predict():
     """JSON API endpoint for mobile apps: accepts multipart form with 'file' and returns prediction JSON."""
     if 'file' not in request.files:
+        metrics.inc('rejections_total', reason='no_file')
         return jsonify({'error': 'No file provided'}), 400
 
     file = request.files['file']
     if file.filename == '':
+        metrics.inc('rejections_total', reason='no_file')
         return jsonify({'error': 'No file selected'}), 400
 
     if not allowed_file(file.filename):
+        metrics.inc('rejections_total', reason='invalid_type')
         return jsonify({'error': 'Invalid file type. Allowed: png,jpg,jpeg'}), 400
 
+    rejected = check_upload(file.stream)
+    if rejected:
+        return jsonify({'error': rejected}), 400
+
     try:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
 
-        # Optional leaf detection (reuse page logic)
-        global leaf_detector
-        if leaf_detector is None:
-            leaf_detector = load_leaf_detector()
+        if get_model() is None:
+            metrics.inc('rejections_total', reason='model_missing')
+            return jsonify({'error': 'Model not found on server.'}), 500
 
-        if leaf_detector is not None:
-            try:
-                ld_img = Image.open(filepath).convert('RGB').resize((128,128))
-                ld_arr = np.array(ld_img).astype('float32') / 255.0
-                ld_arr = np.expand_dims(ld_arr, axis=0)
-                pred = leaf_detector.predict(ld_arr)[0][0]
-                if float(pred) < 0.5:
-                    try:
-                        os.remove(filepath)
-                    except Exception:
-                        pass
-                    return jsonify({'error': 'Uploaded image does not appear to contain a tomato leaf.'}), 400
-            except Exception:
-                pass
-
-        if leaf_detector is None and not is_leaf_image(filepath):
-            try:
-                os.remove(filepath)
-            except Exception:
-                pass
-            return jsonify({'error': 'Uploaded image does not appear to contain a tomato leaf.'}), 400
+        data = file.read()
+        result, pipeline = predict_image_bytes(data)
+        if not result['leaf']:
+            metrics.inc('rejections_total', reason='not_leaf')
+            return jsonify({'error': NOT_LEAF_ERROR}), 400
 
-        processed_image = preprocess_image(filepath)
+        upload_id = store_upload(data, pipeline)
+        filepath = upload_store.path(upload_id)
 
-        global model
-        if model is None:
-            model = load_model()
-            if model is None:
-                return jsonify({'error': 'Model not found on server.'}), 500
-
-        predictions = model.predict(processed_image)
-        top_idx = int(np.argmax(predictions[0]))
-        top_prob = float(np.max(predictions[0]))
-        confidence = top_prob * 100
-        predicted_class = class_labels[top_idx] if top_prob >= CONF_THRESH else 'Uncertain'
-
-        # create mask overlay if requested (best-effort)
+        # Mask overlay: served lazily from mask_url unless the client opts in
+        # (mask=1 renders the PNG now, mask=rle returns a run-length encoded mask)
+        mask_opt = (request.form.get('mask') or request.args.get('mask') or '').lower()
+        image = pipeline.image if pipeline is not None else None
         maskname = None
+        extra = {}
         try:
-            maskname = make_mask_overlay(filepath)
+            if mask_opt == 'rle':
+                if image is None:
+                    image = ImagePipeline(data, max_side=MASK_MAX_SIDE).image
+                extra['mask_rle'] = mask_rle(image)
+            elif mask_opt in ('1', 'true', 'png') or MASK_MODE == 'eager':
+                maskname = make_mask_overlay(filepath, image=image)
+            elif MASK_MODE == 'background':
+                _mask_executor.submit(make_mask_overlay, filepath, image)
         except Exception:
             maskname = None
 
+        # Lesion boxes (lesions=1), in the uploaded image's pixel coordinates
+        if (request.form.get('lesions') or request.args.get('lesions') or '').lower() in ('1', 'true'):
+            decoded = pipeline if pipeline is not None else ImagePipeline(data, max_side=LESION_MAX_SIDE)
+            extra['lesions'] = find_lesions(decoded.image, decoded.original_size)
+
         # Save debug info (append JSON line)
-        try:
-            debug_entry = {
-                'endpoint': 'api/predict',
-                'filename': filename,
-                'prediction': predicted_class,
-                'confidence': round(confidence, 2),
-                'uncertain': top_prob < CONF_THRESH,
-                'raw_predictions': [float(x) for x in predictions[0]]
-            }
-            with open(DEBUG_LOG, 'a', encoding='utf-8') as df:
-                df.write(json.dumps(debug_entry) + '\n')
-            # also copy the uploaded file to debug folder for inspection
-            shutil.copy2(filepath, os.path.join(DEBUG_DIR, filename))
-        except Exception as e:
-            logger.info(f"Failed to write debug info: {e}")
+        write_debug_entry('api/predict', filename, upload_id, result, cached=pipeline is None)
 
         return jsonify({
             'filename': filename,
-            'prediction': predicted_class,
-            'confidence': round(confidence, 2),
-            'mask': maskname
+            'upload_id': upload_id,
+            'image_url': url_for('upload_image', upload_id=upload_id),
+            'prediction': result['prediction'],
+            'confidence': result['confidence'],
+            'mask': maskname,
+            'mask_url': url_for('mask_image', filename=upload_id),
+            'config_version': current_config().version,
+            **({'crops': result['crops']} if 'crops' in result else {}),
+            **({'near_duplicate': result['near_duplicate']} if 'near_duplicate' in result else {}),
+            **extra
         })
     except Exception as e:
+        metrics.inc('rejections_total', reason='error')
         return jsonify({'error': f'Error processing image: {str(e)}'}), 500
+
+
+@app.route('/api/predict/batch', methods=['POST'])
+def api_predict_batch():
+    """Bulk JSON API: accepts many 'files' (or a zip archive) in one multipart body and
+    streams one JSON line per image (application/x-ndjson) as each chunk is classified."""
+    if not request.files:
+        metrics.inc('rejections_total', reason='no_file')
+        return jsonify({'error': 'No file provided'}), 400
+    if get_model() is None:
+        metrics.inc('rejections_total', reason='model_missing')
+        return jsonify({'error': 'Model not found on server.'}), 500
+
+    def process(chunk):
+        try:
+            results = predict_image_batch(chunk)
+        except Exception as e:
+            results = [({'error': f'Error processing image: {str(e)}'}, None)] * len(chunk)
+        for (name, data), (result, pipeline) in zip(chunk, results):
+            filename = secure_filename(name)
+            if 'error' in result:
+                metrics.inc('rejections_total', reason='error')
+                yield {'filename': filename, 'error': result['error']}
+            elif not result['leaf']:
+                metrics.inc('rejections_total', reason='not_leaf')
+                yield {'filename': filename, 'error': NOT_LEAF_ERROR}
+            else:
+                upload_id = store_upload(data, pipeline)
+                write_debug_entry('api/predict/batch', filename, upload_id, result, cached=pipeline is None)
+                yield {
+                    'filename': filename,
+                    'upload_id': upload_id,
+                    'prediction': result['prediction'],
+                    'confidence': result['confidence'],
+                    'config_version': current_config().version,
+                }
+
+    def generate():
+        chunk = []
+        try:
+            skipped = {
+                'invalid_type': 'Invalid file type. Allowed: png,jpg,jpeg',
+                'too_large_file': 'File is too large.',
+                'too_many_files': f'Not processed: more than {BATCH_MAX_FILES} images in one request.',
+            }
+            for name, data, reason in iter_batch_uploads():
+                if reason:
+                    metrics.inc('rejections_total', reason=reason)
+                    yield json.dumps({'filename': secure_filename(name), 'error': skipped[reason]}) + '\n'
+                    continue
+                rejected = check_upload(data)
+                if rejected:
+                    yield json.dumps({'filename': secure_filename(name), 'error': rejected}) + '\n'
+                    continue
+                chunk.append((name, data))
+                if len(chunk) >= BATCH_PREDICT_CHUNK:
+                    for line in process(chunk):
+                        yield json.dumps(line) + '\n'
+                    chunk = []
+            for line in process(chunk):
+                yield json.dumps(line) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f'Error processing batch: {str(e)}'}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_page():
     """Simple admin UI to view/update HSV thresholds."""
-    global GREEN_H_MIN, GREEN_H_MAX, S_MIN, V_MIN, GREEN_PROP_THRESH
     if request.method == 'POST':
         try:
-            GREEN_H_MIN = int(request.form.get('GREEN_H_MIN', GREEN_H_MIN))
-            GREEN_H_MAX = int(request.form.get('GREEN_H_MAX', GREEN_H_MAX))
-            S_MIN = int(request.form.get('S_MIN', S_MIN))
-            V_MIN = int(request.form.get('V_MIN', V_MIN))
-            GREEN_PROP_THRESH = float(request.form.get('GREEN_PROP_THRESH', GREEN_PROP_THRESH))
-            # persist
-            cfg = {
-                'GREEN_H_MIN': GREEN_H_MIN,
-                'GREEN_H_MAX': GREEN_H_MAX,
-                'S_MIN': S_MIN,
-                'V_MIN': V_MIN,
-                'GREEN_PROP_THRESH': GREEN_PROP_THRESH
-            }
-            save_config(cfg)
-            return render_template('admin.html', success='Saved', **cfg)
+            g.config = shared_config.update({k: request.form[k] for k in CONFIG_KEYS if k in request.form})
+            prediction_cache.clear()
+            return render_template('admin.html', success='Saved', config_version=g.config.version,
+                                   **g.config.values)
         except Exception as e:
-            return render_template('admin.html', error=str(e),
-                                   GREEN_H_MIN=GREEN_H_MIN, GREEN_H_MAX=GREEN_H_MAX,
-                                   S_MIN=S_MIN, V_MIN=V_MIN, GREEN_PROP_THRESH=GREEN_PROP_THRESH)
+            return render_template('admin.html', error=str(e), config_version=current_config().version,
+                                   **current_config().values)
 
-    return render_template('admin.html', GREEN_H_MIN=GREEN_H_MIN, GREEN_H_MAX=GREEN_H_MAX,
-                           S_MIN=S_MIN, V_MIN=V_MIN, GREEN_PROP_THRESH=GREEN_PROP_THRESH)
+    return render_template('admin.html', config_version=current_config().version, **current_config().values)
 
 
 @app.route('/admin/api', methods=['GET', 'POST'])
 def admin_api():
-    """JSON API to get or set thresholds. GET returns current values. POST accepts JSON body to update and persist."""
-    global GREEN_H_MIN, GREEN_H_MAX, S_MIN, V_MIN, GREEN_PROP_THRESH
+    """JSON API to get or set thresholds. GET returns current values. POST accepts JSON body to update and persist.
+
+    Updates are published to every worker through the shared config; responses include the new config_version.
+    """
     if request.method == 'GET':
-        return jsonify({
-            'GREEN_H_MIN': GREEN_H_MIN,
-            'GREEN_H_MAX': GREEN_H_MAX,
-            'S_MIN': S_MIN,
-            'V_MIN': V_MIN,
-            'GREEN_PROP_THRESH': GREEN_PROP_THRESH
-        })
+        return jsonify({**current_config().values, 'config_version': current_config().version})
 
     data = request.get_json(force=True)
     if not data:
         return jsonify({'error': 'No JSON body provided'}), 400
     try:
-        GREEN_H_MIN = int(data.get('GREEN_H_MIN', GREEN_H_MIN))
-        GREEN_H_MAX = int(data.get('GREEN_H_MAX', GREEN_H_MAX))
-        S_MIN = int(data.get('S_MIN', S_MIN))
-        V_MIN = int(data.get('V_MIN', V_MIN))
-        GREEN_PROP_THRESH = float(data.get('GREEN_PROP_THRESH', GREEN_PROP_THRESH))
-        cfg = {
-            'GREEN_H_MIN': GREEN_H_MIN,
-            'GREEN_H_MAX': GREEN_H_MAX,
-            'S_MIN': S_MIN,
-            'V_MIN': V_MIN,
-            'GREEN_PROP_THRESH': GREEN_PROP_THRESH
-        }
-        save_config(cfg)
-        return jsonify({'status': 'ok', **cfg})
+        g.config = shared_config.update({k: data[k] for k in CONFIG_KEYS if k in data})
+        prediction_cache.clear()
+        return jsonify({'status': 'ok', **g.config.values, 'config_version': g.config.version})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 
+@app.route('/uploads/<upload_id>')
+def upload_image(upload_id):
+    """Serve a stored upload by hash; the content never changes, so it is cached for a long time."""
+    if not is_digest(upload_id) or not os.path.isfile(upload_store.path(upload_id)):
+        return "File not found", 404
+    return send_file(os.path.abspath(upload_store.path(upload_id)), mimetype='image/jpeg',
+                     max_age=365 * 24 * 3600)
+
+
+@app.route('/api/uploads')
+def upload_stats():
+    """Upload store totals: distinct images, references and bytes saved by deduplication and normalization."""
+    return jsonify(upload_store.stats())
+
+
 @app.route('/preview/<filename>')
 def preview(filename):
-    """Generate (if needed) and show mask overlay for an uploaded file."""
-    uploads = app.config['UPLOAD_FOLDER']
-    filepath = os.path.join(uploads, filename)
-    if not os.path.exists(filepath):
+    """Show an upload (by hash, or a legacy filename) next to its mask overlay (rendered on demand by /mask)."""
+    filepath = resolve_upload(filename)
+    if not os.path.isfile(filepath):
+        return "File not found", 404
+
+    if is_digest(filename):
+        image_url = url_for('upload_image', upload_id=filename)
+    else:
+        image_url = url_for('static', filename='uploads/' + os.path.basename(filepath))
+    return render_template('preview.html', filename=filename, image_url=image_url,
+                           mask_url=url_for('mask_image', filename=filename))
+
+
+@app.route('/mask/<filename>')
+def mask_image(filename):
+    """Serve the green-mask overlay for an upload, rendering and caching it on first request."""
+    filepath = resolve_upload(filename)
+    if not os.path.isfile(filepath):
         return "File not found", 404
 
-    maskname = f"{os.path.splitext(filename)[0]}_mask.png"
-    maskpath = os.path.join(uploads, maskname)
-    if not os.path.exists(maskpath):
-        make_mask_overlay(filepath)
+    # The ETag changes with the thresholds and with the upload itself
+    etag = f"{mask_key(current_thresholds())}-{os.stat(filepath).st_mtime_ns}"
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
 
-    return render_template('preview.html', filename=filename, maskname=maskname)
+    maskname = make_mask_overlay(filepath)
+    if maskname is None:
+        return "Could not render mask", 500
+    resp = send_file(os.path.abspath(os.path.join(os.path.dirname(filepath), maskname)), mimetype='image/png',
+                     etag=False, conditional=False, max_age=0)
+    resp.set_etag(etag)
+    return resp
 
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
@@ -379,91 +1229,50 @@ def upload_file():
 
         # Check if a file was uploaded
         if 'file' not in request.files:
+            metrics.inc('rejections_total', reason='no_file')
             return render_template('index.html', error='No file selected')
         
         file = request.files['file']
         if file.filename == '':
+            metrics.inc('rejections_total', reason='no_file')
             return render_template('index.html', error='No file selected')
 
         if file and allowed_file(file.filename):
+            rejected = check_upload(file.stream)
+            if rejected:
+                return render_template('index.html', error=rejected)
             try:
-                # Save the uploaded file
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-
-                
-                # Quick leaf/plant check — reject images with too little green
-                # Prefer the optional leaf detector model if available
-                global leaf_detector
-                if leaf_detector is None:
-                    leaf_detector = load_leaf_detector()
-
-                if leaf_detector is not None:
-                    try:
-                        ld_img = Image.open(filepath).convert('RGB').resize((128,128))
-                        ld_arr = np.array(ld_img).astype('float32') / 255.0
-                        ld_arr = np.expand_dims(ld_arr, axis=0)
-                        pred = leaf_detector.predict(ld_arr)[0][0]
-                        # leaf_detector outputs probability of leaf (sigmoid)
-                        if float(pred) < 0.5:
-                            try:
-                                os.remove(filepath)
-                            except Exception:
-                                pass
-                            return render_template('index.html', error='Uploaded image does not appear to contain a tomato leaf. Please upload a clear leaf image.')
-                    except Exception as e:
-                        print(f"Leaf-detector prediction error: {e}")
-                        # fallback to heuristic below
-
-                # If no detector or detector couldn't run, fallback to HSV heuristic
-                if leaf_detector is None and not is_leaf_image(filepath):
-                    try:
-                        os.remove(filepath)
-                    except Exception:
-                        pass
-                    return render_template('index.html', error='Uploaded image does not appear to contain a tomato leaf. Please upload a clear leaf image.')
-
-                # Preprocess the image
-                processed_image = preprocess_image(filepath)
 
                 # Ensure model is loaded (lazy load)
-                global model
-                if model is None:
-                    model = load_model()
-                    if model is None:
-                        return render_template('index.html', 
-                                               error="Model not found. Please place tomato_model.h5 in the models directory.")
-
-                # Make prediction
-                predictions = model.predict(processed_image)
-                top_idx = int(np.argmax(predictions[0]))
-                top_prob = float(np.max(predictions[0]))
-                confidence = top_prob * 100
-                predicted_class = class_labels[top_idx] if top_prob >= CONF_THRESH else 'Uncertain'
+                if get_model() is None:
+                    metrics.inc('rejections_total', reason='model_missing')
+                    return render_template('index.html', 
+                                           error="Model not found. Please place tomato_model.h5 in the models directory.")
+
+                # Quick leaf/plant check and prediction on the in-memory upload
+                data = file.read()
+                result, pipeline = predict_image_bytes(data)
+                if not result['leaf']:
+                    metrics.inc('rejections_total', reason='not_leaf')
+                    return render_template('index.html', error=NOT_LEAF_ERROR + ' Please upload a clear leaf image.')
+
+                # Store the upload once it passed validation
+                upload_id = store_upload(data, pipeline)
 
                 # Save debug info for web uploads as well
-                try:
-                    debug_entry = {
-                        'endpoint': 'web/upload',
-                        'filename': filename,
-                        'prediction': predicted_class,
-                        'confidence': round(confidence, 2),
-                        'uncertain': top_prob < CONF_THRESH,
-                        'raw_predictions': [float(x) for x in predictions[0]]
-                    }
-                    with open(DEBUG_LOG, 'a', encoding='utf-8') as df:
-                        df.write(json.dumps(debug_entry) + '\n')
-                    shutil.copy2(filepath, os.path.join(DEBUG_DIR, filename))
-                except Exception as e:
-                    logger.info(f"Failed to write debug info: {e}")
+                write_debug_entry('web/upload', filename, upload_id, result, cached=pipeline is None)
                 return render_template('index.html',
                                     filename=filename,
-                                    prediction=predicted_class,
-                                    confidence=f"{confidence:.2f}%")
+                                    image_url=url_for('upload_image', upload_id=upload_id),
+                                    preview_url=url_for('preview', filename=upload_id),
+                                    prediction=result['prediction'],
+                                    confidence=f"{result['confidence']:.2f}%")
             except Exception as e:
+                metrics.inc('rejections_total', reason='error')
                 return render_template('index.html', error=f"Error processing image: {str(e)}")
         else:
+            metrics.inc('rejections_total', reason='invalid_type')
             return render_template('index.html', 
                                 error='Invalid file type. Please upload a JPG, JPEG, or PNG image.')
 
@@ -478,4 +1287,6 @@ if __name__ == '__main__':
         print("Model file found.")
     else:
         print("Warning: Model not found. Please place tomato_model.h5 in the models directory.")
+    if PRELOAD_MODELS:
+        warm_up_models()
     app.run(debug=True)
\ No newline at end of file
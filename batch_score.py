@@ -0,0 +1,271 @@
+"""Score a folder of field photos offline with the app's own pipeline, resumably.
+
+    python batch_score.py photos/ --out scores.jsonl [--workers 4] [--batch-size 32]
+    python batch_score.py photos/ --out scores.csv           # CSV instead of JSONL
+
+Images are decoded, leaf-checked (HSV heuristic) and preprocessed on a
+process pool; the main process runs the leaf detector and classifier on
+batches of them and applies CONF_THRESH exactly as /api/predict does.
+Results are appended to --out after every batch, and the output file is
+the checkpoint: running the same command again skips every image already
+in it, so an interrupted overnight run just continues.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+CSV_FIELDS = ('path', 'leaf', 'prediction', 'confidence', 'uncertain', 'error')
+
+
+def find_images(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def prepare(path, with_detector):
+    """Worker: header check, decode, HSV leaf check and model inputs for one file (all CPU-bound)."""
+    import app
+    from image_pipeline import ImagePipeline
+    from upload_check import check_image_header, rejection_message
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        _, reason = check_image_header(data, max_side=app.UPLOAD_MAX_DIMENSION, max_pixels=app.UPLOAD_MAX_PIXELS)
+        if reason:
+            return {'path': path, 'error': rejection_message(reason, app.UPLOAD_MAX_DIMENSION, app.UPLOAD_MAX_PIXELS)}
+        pipeline = ImagePipeline(data)
+        item = {'path': path, 'inputs': app.classifier_inputs(pipeline)}
+        if with_detector:
+            item['detector'] = pipeline.detector_tensor()
+        else:
+            item['leaf'] = bool(app.is_leaf_pipeline(pipeline))
+        return item
+    except Exception as e:
+        return {'path': path, 'error': f'Error processing image: {e}'}
+
+
+def iter_prepared(pool, paths, with_detector, window):
+    """Prepared items in input order, with at most `window` in flight so memory stays flat.
+
+    The first window is submitted right away, which forks every pool worker
+    before the caller loads any model.
+    """
+    paths = iter(paths)
+    if pool is None:
+        return (prepare(path, with_detector) for path in paths)
+    pending = deque(pool.submit(prepare, path, with_detector) for _, path in zip(range(window), paths))
+
+    def drain():
+        for path in paths:
+            pending.append(pool.submit(prepare, path, with_detector))
+            yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    return drain()
+
+
+def detector_available(app):
+    """Whether the leaf detector will be used (decided without loading TensorFlow here)."""
+    if app.INFERENCE_BACKEND == 'remote':
+        return app.get_leaf_detector() is not None
+    if app.INFERENCE_BACKEND == 'tflite':
+        return os.path.exists(app.LEAF_DETECTOR_TFLITE_PATH)
+    return os.path.exists(app.LEAF_DETECTOR_PATH)
+
+
+def score_batch(app, items, detector):
+    """Leaf gate and classify prepared items in (at most) two forward passes; returns result rows."""
+    rows = [None] * len(items)
+    ready = [i for i, item in enumerate(items) if 'error' not in item]
+    for i, item in enumerate(items):
+        if 'error' in item:
+            rows[i] = {'path': item['path'], 'error': item['error']}
+    if detector is not None and ready:
+        preds = detector.predict(np.concatenate([items[i]['detector'] for i in ready], axis=0), verbose=0)
+        for i, pred in zip(ready, preds):
+            # same rule as app.leaf_gate_batch: the detector outputs P(leaf)
+            items[i]['leaf'] = float(pred[0]) >= 0.5
+    leaves = []
+    for i in ready:
+        if items[i]['leaf']:
+            leaves.append(i)
+        else:
+            rows[i] = {'path': items[i]['path'], 'leaf': False}
+    if leaves:
+        inputs = [items[i]['inputs'] for i in leaves]
+        predictions = app.get_model().predict(np.concatenate(inputs, axis=0), verbose=0)
+        offsets = np.cumsum([0] + [len(x) for x in inputs])
+        for j, i in enumerate(leaves):
+            result = app.summarize_predictions(app.aggregate_crops(predictions[offsets[j]:offsets[j + 1]]))
+            rows[i] = {'path': items[i]['path'], **result}
+    return rows
+
+
+class ResultWriter:
+    """
+    Appends result rows to a JSONL or CSV file that doubles as the resume checkpoint.
+
+    On open, a partially written last line (from a crash mid-write) is cut
+    off, and the paths already present are collected in `done`.
+    """
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        self.done = set()
+        if os.path.exists(path):
+            self._truncate_partial_line()
+            self._load_done()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, 'a', newline='', encoding='utf-8')
+        if self.fmt == 'csv':
+            self._csv = csv.DictWriter(self._f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if new_file:
+                self._csv.writeheader()
+
+    def _truncate_partial_line(self):
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _load_done(self):
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            if self.fmt == 'csv':
+                self.done.update(row['path'] for row in csv.DictReader(f))
+            else:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        continue
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow(row)
+            else:
+                self._f.write(json.dumps(row) + '\n')
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+def run(root, out, workers=None, batch_size=32, fmt=None, resume=True, limit=None, progress_every=10.0):
+    """Score every image under root into `out`; returns a summary dict."""
+    if not resume and os.path.exists(out):
+        os.remove(out)
+    writer = ResultWriter(out, fmt)
+    paths = [p for p in find_images(root) if p not in writer.done]
+    if limit:
+        paths = paths[:limit]
+    workers = workers or os.cpu_count() or 1
+
+    import app
+    with_detector = detector_available(app)
+    # Fork the decode workers before any model (and TensorFlow) is loaded in this process
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    prepared = iter_prepared(pool, paths, with_detector, window=max(batch_size, workers) * 2)
+
+    counts = {'scored': 0, 'not_leaf': 0, 'uncertain': 0, 'errors': 0}
+    t0 = last_report = time.perf_counter()
+    batch = []
+    try:
+        if app.get_model() is None:
+            raise SystemExit('Model not found; place tomato_model.h5 in models/ (or set INFERENCE_BACKEND).')
+        detector = app.get_leaf_detector() if with_detector else None
+        for item in prepared:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+            _flush(app, batch, detector, writer, counts)
+            batch = []
+            now = time.perf_counter()
+            if progress_every and now - last_report >= progress_every:
+                last_report = now
+                _report(counts, len(paths), now - t0)
+        if batch:
+            _flush(app, batch, detector, writer, counts)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - t0
+    done = _processed(counts)
+    return {
+        'root': root,
+        'out': out,
+        'skipped_already_scored': len(writer.done),
+        'processed': done,
+        **counts,
+        'elapsed_s': round(elapsed, 2),
+        'images_per_s': round(done / elapsed, 2) if elapsed else None,
+        'workers': workers,
+        'batch_size': batch_size,
+    }
+
+
+def _flush(app, batch, detector, writer, counts):
+    rows = score_batch(app, batch, detector)
+    writer.write(rows)
+    for row in rows:
+        if 'error' in row:
+            counts['errors'] += 1
+        elif not row['leaf']:
+            counts['not_leaf'] += 1
+        else:
+            counts['scored'] += 1
+            counts['uncertain'] += int(row['uncertain'])
+
+
+def _processed(counts):
+    # 'uncertain' is a subset of 'scored'
+    return counts['scored'] + counts['not_leaf'] + counts['errors']
+
+
+def _report(counts, total, elapsed):
+    done = _processed(counts)
+    rate = done / elapsed if elapsed else 0.0
+    eta = (total - done) / rate if rate else float('inf')
+    print(f'{done}/{total} images, {rate:.1f} images/s, ETA {eta / 60:.1f} min', file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root', help='folder of images (searched recursively)')
+    parser.add_argument('--out', required=True, help='results file, .jsonl or .csv; also the resume checkpoint')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='default: from the --out extension')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='decode processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=32, help='images per forward pass')
+    parser.add_argument('--no-resume', action='store_true', help='start over instead of skipping scored images')
+    parser.add_argument('--limit', type=int, help='score at most N new images')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    summary = run(args.root, args.out, workers=args.workers, batch_size=args.batch_size, fmt=args.format,
+                  resume=not args.no_resume, limit=args.limit)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Scored {summary['processed']} images in {summary['elapsed_s']} s "
+          f"({summary['images_per_s']} images/s, {summary['workers']} workers); "
+          f"{summary['skipped_already_scored']} already in {summary['out']}")
+    print(f"  leaf: {summary['scored']} ({summary['uncertain']} uncertain), not leaf: {summary['not_leaf']}, "
+          f"errors: {summary['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+
+class _PendingRequest:
+    """One caller's input row plus the slot its prediction is handed back through."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of a model's predict function.
+
+    Callers pass a batch-of-one input to predict() and block until their row is ready.
+    A single background thread gathers pending requests until either
+    `max_batch_size` rows are collected or `max_wait_ms` has passed since the
+    first one arrived, runs one forward pass over the stacked batch and hands
+    each caller back its own row of predictions. When `max_queue` requests
+    are already waiting, predict() does not queue behind them: it runs the
+    caller's row on its own, so a burst never adds queueing delay on top.
+
+    Parameters:
+    - predict_fn: callable taking an (N, ...) array and returning (N, classes)
+    - max_batch_size: upper bound on rows per forward pass
+    - max_wait_ms: how long the first request in a batch may wait for company
+    - max_queue: pending requests allowed before predict() bypasses the queue
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0, max_queue=64):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._bypassed = 0
+        self._batches = 0
+        self._rows = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._infer_total = 0.0
+        self._infer_max = 0.0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a batcher created before gunicorn
+        # forks its workers has to start a fresh thread in each child.
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def predict(self, inputs, timeout=30.0):
+        """Submit one (1, ...) or (...) input and block until its prediction row is ready.
+
+        Returns an array shaped (1, classes) so callers can keep indexing `[0]`.
+        """
+        arr = np.asarray(inputs)
+        if arr.ndim > 0 and arr.shape[0] == 1:
+            arr = arr[0]
+        self._ensure_worker()
+        req = _PendingRequest(arr)
+        try:
+            self._queue.put_nowait(req)
+        except queue.Full:
+            with self._lock:
+                self._bypassed += 1
+            return np.asarray(self.predict_fn(np.expand_dims(arr, axis=0)))
+        with self._lock:
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        if not req.done.wait(timeout):
+            raise RuntimeError('Timed out waiting for batched inference.')
+        if req.error is not None:
+            raise req.error
+        return np.expand_dims(req.result, axis=0)
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires."""
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Still take whatever is already queued without waiting further
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                stacked = np.stack([r.inputs for r in batch], axis=0)
+                outputs = np.asarray(self.predict_fn(stacked))
+                for i, r in enumerate(batch):
+                    r.result = outputs[i]
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            finished = time.perf_counter()
+
+            with self._lock:
+                self._batches += 1
+                self._rows += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                infer = finished - started
+                self._infer_total += infer
+                self._infer_max = max(self._infer_max, infer)
+                for r in batch:
+                    waited = started - r.enqueued_at
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+
+            for r in batch:
+                r.done.set()
+
+    def stats(self):
+        """Return configuration and observed queue/batch/wait statistics as a JSON-friendly dict."""
+        with self._lock:
+            rows = self._rows
+            batches = self._batches
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000.0, 3),
+                'max_queue': self.max_queue,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': self._requests,
+                'bypassed': self._bypassed,
+                'batches': batches,
+                'mean_batch_size': round(rows / batches, 3) if batches else 0.0,
+                'batch_sizes': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'mean_wait_ms': round(self._wait_total / rows * 1000.0, 3) if rows else 0.0,
+                'max_wait_observed_ms': round(self._wait_max * 1000.0, 3),
+                'mean_inference_ms': round(self._infer_total / batches * 1000.0, 3) if batches else 0.0,
+                'max_inference_ms': round(self._infer_max * 1000.0, 3),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._reset_stats()
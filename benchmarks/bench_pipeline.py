@@ -0,0 +1,277 @@
+"""Stage-level microbenchmarks for the prediction pipeline.
+
+Times every stage of /api/predict and the web upload route separately, on
+synthetic images of several resolutions plus any recorded uploads, and then
+the two endpoints end to end through the Flask test client. Results are
+written as JSON so runs from different commits can be compared:
+
+    python benchmarks/bench_pipeline.py --out bench.json
+    python benchmarks/bench_pipeline.py --compare bench.json
+
+Without models/tomato_model.h5 (or with --stub) tiny stand-in Keras models
+from benchmarks/stub_model.py are used, so only the model stages change.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from upload_store import DEFAULT_ROOT, find_upload_images  # noqa: E402
+
+DEFAULT_RESOLUTIONS = '640x480,1600x1200,4000x3000'
+
+
+def synthetic_jpeg(width, height, seed=0):
+    """A leaf-ish JPEG: green background, darker lesion blobs and sensor-like noise."""
+    rs = np.random.RandomState(seed)
+    small = np.zeros((height // 8, width // 8, 3), dtype='float32')
+    small[:] = (50, 140, 45)
+    for _ in range(12):
+        cy, cx = rs.randint(0, small.shape[0]), rs.randint(0, small.shape[1])
+        r = rs.randint(2, max(3, small.shape[0] // 10))
+        small[max(0, cy - r):cy + r, max(0, cx - r):cx + r] = (90, 70, 30)
+    img = Image.fromarray(small.astype('uint8')).resize((width, height), Image.BILINEAR)
+    arr = np.asarray(img, dtype='float32') + rs.normal(0, 6, (height, width, 3))
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(arr, 0, 255).astype('uint8')).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def load_images(resolutions, image_dir, max_recorded):
+    images = []
+    for i, res in enumerate(r for r in resolutions.split(',') if r):
+        w, h = (int(x) for x in res.lower().split('x'))
+        images.append((f'synthetic_{w}x{h}.jpg', synthetic_jpeg(w, h, seed=i)))
+    if image_dir and os.path.isdir(image_dir):
+        for p in find_upload_images(image_dir)[:max_recorded]:
+            with open(p, 'rb') as f:
+                images.append((os.path.basename(p), f.read()))
+    return images
+
+
+def summarize(times):
+    arr = np.asarray(times, dtype='float64')
+    return {
+        'runs': int(arr.size),
+        'mean_ms': round(float(arr.mean()), 3),
+        'p50_ms': round(float(np.percentile(arr, 50)), 3),
+        'p95_ms': round(float(np.percentile(arr, 95)), 3),
+        'min_ms': round(float(arr.min()), 3),
+    }
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+
+    def run(self, stage, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.times.setdefault(stage, []).append((time.perf_counter() - t0) * 1000.0)
+        return out
+
+
+def setup_app(work_dir, use_stub):
+    """Import app with uploads, debug log and caches redirected to work_dir."""
+    import app as app_module
+    from debug_writer import DebugWriter
+    from prediction_cache import PredictionCache
+    from upload_store import UploadStore
+
+    uploads = os.path.join(work_dir, 'uploads')
+    debug = os.path.join(uploads, 'debug')
+    os.makedirs(debug, exist_ok=True)
+    app_module.app.config['UPLOAD_FOLDER'] = uploads
+    app_module.DEBUG_DIR = debug
+    app_module.DEBUG_LOG = os.path.join(debug, 'debug_logs.jsonl')
+    app_module.debug_writer = DebugWriter(app_module.DEBUG_LOG, debug, flush_interval=0)
+    app_module.upload_store = UploadStore(os.path.join(uploads, 'store'), max_side=app_module.UPLOAD_MAX_SIDE,
+                                          quality=app_module.UPLOAD_JPEG_QUALITY)
+    # Every run must do the full work, so no cached predictions
+    app_module.prediction_cache = PredictionCache(max_entries=0)
+
+    try:
+        import tensorflow as tf
+        # keep Keras progress bars out of the JSON written to stdout
+        tf.keras.utils.disable_interactive_logging()
+    except Exception:
+        pass
+    if use_stub:
+        from benchmarks.stub_model import build_stub_classifier, build_stub_detector
+        classifier, detector = build_stub_classifier(), build_stub_detector()
+        app_module.load_model = lambda: classifier
+        app_module.load_leaf_detector = lambda: detector
+    app_module.model = None
+    app_module.leaf_detector = None
+    if app_module.get_model() is None:
+        raise SystemExit('No model available; run with --stub')
+    app_module.warm_up_models()
+    return app_module
+
+
+def multi_crop_predict(app_module, pipeline, crops):
+    """Full frame plus `crops` lesion crops in one forward pass, as with INFERENCE_CROPS set."""
+    saved = app_module.INFERENCE_CROPS
+    app_module.INFERENCE_CROPS = crops
+    try:
+        return app_module.aggregate_crops(app_module.run_classifier(app_module.classifier_inputs(pipeline)))
+    finally:
+        app_module.INFERENCE_CROPS = saved
+
+
+def bench_stages(app_module, name, data, runs, crops=3):
+    """Time each pipeline stage in the order the endpoints run them."""
+    from image_pipeline import ImagePipeline
+    from leaf_check import fast_leaf_check
+
+    uploads = app_module.app.config['UPLOAD_FOLDER']
+    filepath = os.path.join(uploads, name)
+    # the legacy stages below read the raw upload from disk, as the old endpoints did
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    detector = app_module.get_leaf_detector()
+    thresholds = app_module.current_thresholds()
+    t = StageTimer()
+    for i in range(runs):
+        pipeline = t.run('decode', ImagePipeline, data)
+        if detector is not None:
+            t.run('leaf_detector', lambda: detector.predict(pipeline.detector_tensor()))
+        t.run('leaf_check_exact', lambda: app_module.is_leaf_hsv(pipeline.hsv_array()))
+        t.run('leaf_check_fast', fast_leaf_check, pipeline.image, thresholds,
+              max_side=app_module.LEAF_CHECK_MAX_SIDE)
+        tensor = t.run('preprocess', pipeline.classifier_tensor)
+        predictions = t.run('model_predict', app_module.run_classifier, tensor)
+        if crops > 0:
+            t.run('multi_crop_predict', multi_crop_predict, app_module, pipeline, crops)
+        upload_id = t.run('upload_save', app_module.store_upload, data, pipeline)
+        t.run('upload_dedup', app_module.store_upload, data, pipeline)
+        t.run('mask_overlay', app_module.make_mask_overlay, app_module.upload_store.path(upload_id),
+              image=pipeline.image)
+        entry = {'endpoint': 'bench', 'filename': name, 'upload_id': upload_id,
+                 **app_module.summarize_predictions(predictions[0])}
+        t.run('debug_write', app_module.debug_writer._write, [(entry, None, None)])
+        # drop both references so the next run stores (and renders the mask) from scratch
+        app_module.upload_store.release(upload_id)
+        app_module.upload_store.release(upload_id)
+        # the pre-pipeline path: re-open and re-decode the saved file per stage
+        t.run('legacy_is_leaf_image', app_module.is_leaf_image, filepath)
+        t.run('legacy_preprocess_image', app_module.preprocess_image, filepath)
+    return {stage: summarize(times) for stage, times in t.times.items()}
+
+
+def bench_endpoints(app_module, images, runs):
+    client = app_module.app.test_client()
+    results = {}
+    for url, label in (('/api/predict', 'api_predict'), ('/', 'upload_file')):
+        for name, data in images:
+            times, statuses = [], set()
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                resp = client.post(url, data={'file': (io.BytesIO(data), name)},
+                                   content_type='multipart/form-data')
+                times.append((time.perf_counter() - t0) * 1000.0)
+                statuses.add(resp.status_code)
+            results.setdefault(label, {})[name] = {**summarize(times), 'status': sorted(statuses)}
+    app_module.debug_writer.flush()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline_path} (commit {baseline['meta'].get('commit')}), p50 ms:")
+    base_images = {img['name']: img for img in baseline.get('images', [])}
+    for img in current['images']:
+        old = base_images.get(img['name'])
+        if old is None:
+            continue
+        print(f"  {img['name']}")
+        for stage, stats in img['stages'].items():
+            if stage in old['stages']:
+                before = old['stages'][stage]['p50_ms']
+                ratio = stats['p50_ms'] / before if before else float('inf')
+                print(f"    {stage:<24} {before:>10.3f} -> {stats['p50_ms']:>10.3f}  ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolutions', default=DEFAULT_RESOLUTIONS,
+                        help=f'synthetic image sizes, WxH comma-separated (default {DEFAULT_RESOLUTIONS})')
+    parser.add_argument('--images', default=os.path.join(ROOT, DEFAULT_ROOT),
+                        help='upload store (or folder) of recorded uploads to include')
+    parser.add_argument('--max-recorded', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=5, help='repetitions per stage')
+    parser.add_argument('--endpoint-runs', type=int, default=5)
+    parser.add_argument('--stub', action='store_true', help='use stand-in Keras models')
+    parser.add_argument('--crops', type=int, default=3,
+                        help='lesion crops for the multi_crop_predict stage (0 skips it)')
+    parser.add_argument('--out', help='write JSON results to this path (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import app as app_module
+    use_stub = args.stub or not os.path.exists(app_module.MODEL_PATH)
+    images = load_images(args.resolutions, args.images, args.max_recorded)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        app_module = setup_app(work_dir, use_stub)
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'backend': app_module.INFERENCE_BACKEND,
+                'stub_models': use_stub,
+                'runs': args.runs,
+            },
+            'model_state': app_module.MODEL_STATE,
+            'images': [],
+        }
+        for name, data in images:
+            size = Image.open(io.BytesIO(data)).size
+            print(f'Benchmarking stages on {name} {size[0]}x{size[1]}...', file=sys.stderr)
+            results['images'].append({
+                'name': name,
+                'width': size[0],
+                'height': size[1],
+                'bytes': len(data),
+                'stages': bench_stages(app_module, name, data, args.runs, crops=args.crops),
+            })
+        print('Benchmarking endpoints...', file=sys.stderr)
+        results['endpoints'] = bench_endpoints(app_module, images, args.endpoint_runs)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print('Wrote', args.out, file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Open-loop load generator for a running server.
+
+Requests are sent on a fixed schedule (`--rate` per second, evenly spaced or
+with `--arrival poisson`) whether or not earlier ones have finished, so a
+slow server builds a queue instead of slowing the client down. Latency is
+measured from each request's scheduled send time, which keeps that queueing
+in the numbers. A `--rates` list runs one step per rate and prints a
+saturation curve:
+
+    gunicorn -c gunicorn.conf.py app:app &
+    python benchmarks/load_test.py --rates 1,2,4,8 --duration 30 --out load.json
+    python benchmarks/load_test.py --rate 5 --mix api_predict=6,upload=2,preview=2 --resolutions 640x480*3,4000x3000
+    python benchmarks/load_test.py --rate 5 --from-log static/uploads/debug/debug_logs.jsonl
+
+Images come from synthetic leaves (`--resolutions`, with an optional `*weight`)
+and recorded uploads (`--images`, weighted by `--recorded-weight`). With
+--from-log, the endpoints and images of the recorded debug log are replayed
+in order instead (images as kept in the upload store, i.e. normalized).
+Each upload gets a few random trailing bytes (ignored by decoders) so it
+misses the prediction cache and the upload store's deduplication, unless
+--repeat is given.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_pipeline import git_commit, synthetic_jpeg  # noqa: E402
+from upload_store import DEFAULT_ROOT, UploadStore, find_upload_images, logged_upload_path  # noqa: E402
+
+ENDPOINTS = ('api_predict', 'upload', 'preview', 'mask')
+# debug-log endpoint names -> load-test endpoints
+LOG_ENDPOINTS = {'api/predict': 'api_predict', 'api/predict/batch': 'api_predict', 'web/upload': 'upload'}
+
+
+def parse_weights(spec, allowed=None):
+    """'a=3,b=1' (or 'a*3,b') -> [(name, weight)]."""
+    out = []
+    for part in (p.strip() for p in spec.split(',') if p.strip()):
+        name, _, weight = part.replace('*', '=').partition('=')
+        if allowed is not None and name not in allowed:
+            raise ValueError(f'unknown endpoint {name!r} (choose from {", ".join(allowed)})')
+        out.append((name, float(weight or 1)))
+    return out
+
+
+def load_images(resolutions, image_dir, max_recorded, recorded_weight):
+    """[(name, bytes, weight)] of synthetic and recorded uploads."""
+    images = []
+    for i, (res, weight) in enumerate(parse_weights(resolutions)):
+        w, h = (int(x) for x in res.lower().split('x'))
+        images.append((f'synthetic_{w}x{h}.jpg', synthetic_jpeg(w, h, seed=i), weight))
+    if image_dir and os.path.isdir(image_dir) and recorded_weight > 0:
+        paths = find_upload_images(image_dir)[:max_recorded]
+        for p in paths:
+            with open(p, 'rb') as f:
+                images.append((os.path.basename(p), f.read(), recorded_weight / len(paths)))
+    return images
+
+
+def load_log_traffic(log_path, store_dir, debug_dir):
+    """[(endpoint, name, bytes)] for the recorded predictions whose image is still on disk, in log order."""
+    from debug_analysis import iter_chunks, log_paths
+    store = UploadStore(store_dir)
+    cache = {}
+    traffic = []
+    for chunk in iter_chunks(log_paths(log_path, rotated=False)):
+        for entry in chunk:
+            endpoint = LOG_ENDPOINTS.get((entry or {}).get('endpoint'))
+            if endpoint is None:
+                continue
+            filename = entry.get('filename') or 'upload.jpg'
+            path = logged_upload_path(entry, store, debug_dir)
+            if path not in cache:
+                try:
+                    with open(path, 'rb') as f:
+                        cache[path] = f.read()
+                except OSError:
+                    cache[path] = None
+            if cache[path] is not None:
+                traffic.append((endpoint, filename, cache[path]))
+    return traffic
+
+
+class Workload:
+    """
+    Chooses what each request sends.
+
+    Parameters:
+    - mix: [(endpoint, weight)] drawn at random per request
+    - images: [(name, bytes, weight)] drawn at random per upload
+    - traffic: recorded [(endpoint, name, bytes)] replayed in order instead of the mixes
+    - unique: make every upload's bytes distinct (defeats caching and deduplication)
+    """
+
+    def __init__(self, mix, images=(), traffic=None, unique=True, seed=0):
+        self.mix = mix
+        self.images = list(images)
+        self.traffic = traffic
+        self.unique = unique
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._n = 0
+        self._upload_ids = []
+
+    def next(self):
+        """(endpoint, filename, bytes or None); preview/mask fall back to api_predict until an upload exists."""
+        with self._lock:
+            if self.traffic:
+                endpoint, name, data = self.traffic[self._n % len(self.traffic)]
+            else:
+                endpoint = self._rng.choices([e for e, _ in self.mix], [w for _, w in self.mix])[0]
+                name, data, _ = self._rng.choices(self.images, [w for _, _, w in self.images])[0]
+            self._n += 1
+            if endpoint in ('preview', 'mask'):
+                if self._upload_ids:
+                    return endpoint, self._rng.choice(self._upload_ids), None
+                endpoint = 'api_predict'
+            if self.unique:
+                data = data + self._rng.getrandbits(64).to_bytes(8, 'little')
+            return endpoint, name, data
+
+    def remember(self, upload_id):
+        with self._lock:
+            if len(self._upload_ids) < 1000:
+                self._upload_ids.append(upload_id)
+
+
+class LoadGenerator:
+    """
+    Sends one step of open-loop traffic and records each request's outcome.
+
+    Parameters:
+    - base_url: server root, e.g. http://127.0.0.1:5000
+    - workload: a Workload
+    - concurrency: most requests in flight; later arrivals wait (and that wait counts as latency)
+    - timeout: per-request timeout in seconds
+    """
+
+    def __init__(self, base_url, workload, concurrency=16, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.workload = workload
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = float(timeout)
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, endpoint, name, data):
+        session = self._session()
+        if endpoint == 'api_predict':
+            resp = session.post(self.base_url + '/api/predict', files={'file': (name, data, 'image/jpeg')},
+                                timeout=self.timeout)
+            if resp.status_code == 200:
+                upload_id = resp.json().get('upload_id')
+                if upload_id:
+                    self.workload.remember(upload_id)
+            return resp.status_code
+        if endpoint == 'upload':
+            resp = session.post(self.base_url + '/', files={'file': (name, data, 'image/jpeg')},
+                                timeout=self.timeout)
+            # the upload page answers 200 with an error message instead of an error status
+            return resp.status_code if b'alert-danger' not in resp.content else 400
+        return session.get(f'{self.base_url}/{endpoint}/{name}', timeout=self.timeout).status_code
+
+    def _request(self, scheduled, endpoint, name, data):
+        started = time.perf_counter()
+        try:
+            status = self._send(endpoint, name, data)
+        except requests.Timeout:
+            status = 'timeout'
+        except requests.RequestException:
+            status = 'connection_error'
+        done = time.perf_counter()
+        return {'endpoint': endpoint, 'status': status, 'latency_ms': (done - scheduled) * 1000.0,
+                'service_ms': (done - started) * 1000.0, 'wait_ms': (started - scheduled) * 1000.0}
+
+    def warm_up(self, n):
+        """Send n requests one at a time, unrecorded, so lazy model loading stays out of the first step."""
+        for _ in range(n):
+            self._request(time.perf_counter(), *self.workload.next())
+
+    def run(self, rate, duration, arrival='uniform', drain_timeout=None, seed=0):
+        """Send `rate` requests/s for `duration` s; returns (results, not_sent, elapsed_s)."""
+        rng = random.Random(seed)
+        drain_timeout = self.timeout if drain_timeout is None else drain_timeout
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            t0 = time.perf_counter()
+            offset = 0.0
+            while offset < duration:
+                scheduled = t0 + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(self._request, scheduled, *self.workload.next()))
+                offset += rng.expovariate(rate) if arrival == 'poisson' else 1.0 / rate
+            # Arrivals stop at `duration`; requests still queued in the client after the drain are counted, not sent
+            deadline = time.perf_counter() + drain_timeout
+            results, not_sent = [], 0
+            for f in futures:
+                try:
+                    results.append(f.result(timeout=max(deadline - time.perf_counter(), 0)))
+                    continue
+                except FutureTimeout:
+                    pass
+                if f.cancel():
+                    not_sent += 1
+                else:
+                    # already on the wire: it finishes (or times out) within self.timeout
+                    results.append(f.result())
+            elapsed = time.perf_counter() - t0
+        return results, not_sent, elapsed
+
+
+def summarize(results, elapsed, duration):
+    """Per-endpoint (and 'all') throughput, error rate, status counts and latency percentiles."""
+    groups = {'all': results}
+    for r in results:
+        groups.setdefault(r['endpoint'], []).append(r)
+    out = {}
+    for endpoint, rows in groups.items():
+        ok = [r for r in rows if r['status'] == 200]
+        latency = np.asarray([r['latency_ms'] for r in rows], dtype='float64')
+        statuses = {}
+        for r in rows:
+            statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+        out[endpoint] = {
+            'requests': len(rows),
+            'offered_rps': round(len(rows) / duration, 2),
+            'throughput_rps': round(len(ok) / elapsed, 2) if elapsed else None,
+            'error_rate': round(1 - len(ok) / len(rows), 4) if rows else None,
+            'status': statuses,
+            **{f'p{q}_ms': round(float(np.percentile(latency, q)), 1) if rows else None for q in (50, 90, 99)},
+            'max_ms': round(float(latency.max()), 1) if rows else None,
+            'service_p50_ms': round(float(np.percentile([r['service_ms'] for r in rows], 50)), 1) if rows else None,
+            'client_wait_p99_ms': round(float(np.percentile([r['wait_ms'] for r in rows], 99)), 1) if rows else None,
+        }
+    return out
+
+
+def print_step(step):
+    print(f"rate {step['rate']}/s for {step['duration_s']} s ({step['not_sent']} not sent):")
+    print(f"  {'endpoint':<12} {'reqs':>6} {'ok/s':>7} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for endpoint, s in step['endpoints'].items():
+        print(f"  {endpoint:<12} {s['requests']:>6} {s['throughput_rps']:>7} {s['error_rate'] * 100:>6.1f}% "
+              f"{s['p50_ms']:>9} {s['p90_ms']:>9} {s['p99_ms']:>9}")
+    wait = step['endpoints'].get('all', {}).get('client_wait_p99_ms')
+    if wait is not None and wait > 1000:
+        print(f"  note: requests waited up to {wait} ms for a free client slot; raise --concurrency "
+              f"if the server is not saturated")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--rate', type=float, default=2.0, help='requests per second')
+    parser.add_argument('--rates', help='comma-separated rates: one step each, for a saturation curve')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per step')
+    parser.add_argument('--arrival', choices=('uniform', 'poisson'), default='uniform')
+    parser.add_argument('--concurrency', type=int, default=16, help='most requests in flight')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per-request timeout in seconds')
+    parser.add_argument('--mix', default='api_predict=1',
+                        help=f'endpoint weights, e.g. api_predict=6,upload=2,preview=2 ({", ".join(ENDPOINTS)})')
+    parser.add_argument('--resolutions', default='640x480,1600x1200',
+                        help='synthetic image sizes, WxH with an optional *weight, comma-separated')
+    parser.add_argument('--images', default=os.path.join(ROOT, DEFAULT_ROOT),
+                        help='upload store (or folder) of recorded uploads to include')
+    parser.add_argument('--max-recorded', type=int, default=20)
+    parser.add_argument('--recorded-weight', type=float, default=1.0,
+                        help='total weight of the recorded uploads in the image mix (0 leaves them out)')
+    parser.add_argument('--from-log', help='replay the endpoints and images of this debug log')
+    parser.add_argument('--repeat', action='store_true', help='send identical bytes (lets the server cache them)')
+    parser.add_argument('--warmup', type=int, default=3, help='unrecorded requests sent before the first step')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results as JSON')
+    args = parser.parse_args()
+
+    traffic = None
+    if args.from_log:
+        debug_dir = os.path.dirname(os.path.abspath(args.from_log))
+        store_dir = os.path.join(ROOT, DEFAULT_ROOT)
+        traffic = load_log_traffic(args.from_log, store_dir, debug_dir)
+        if not traffic:
+            raise SystemExit(f'No replayable predictions in {args.from_log}')
+        images = []
+    else:
+        images = load_images(args.resolutions, args.images, args.max_recorded, args.recorded_weight)
+    try:
+        mix = parse_weights(args.mix, ENDPOINTS)
+    except ValueError as e:
+        parser.error(str(e))
+    workload = Workload(mix, images, traffic=traffic, unique=not args.repeat, seed=args.seed)
+    generator = LoadGenerator(args.url, workload, concurrency=args.concurrency, timeout=args.timeout)
+
+    rates = [float(r) for r in args.rates.split(',')] if args.rates else [args.rate]
+    generator.warm_up(args.warmup)
+    steps = []
+    for rate in rates:
+        results, not_sent, elapsed = generator.run(rate, args.duration, arrival=args.arrival, seed=args.seed)
+        step = {'rate': rate, 'duration_s': args.duration, 'elapsed_s': round(elapsed, 2), 'not_sent': not_sent,
+                'endpoints': summarize(results, elapsed, args.duration)}
+        print_step(step)
+        steps.append(step)
+    if len(steps) > 1:
+        print('saturation curve (all endpoints): rate -> ok/s, p99 ms, errors')
+        for step in steps:
+            s = step['endpoints']['all']
+            print(f"  {step['rate']:>7} -> {s['throughput_rps']:>7} ok/s, p99 {s['p99_ms']:>9} ms, "
+                  f"{s['error_rate'] * 100:.1f}% errors")
+    if args.out:
+        meta = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'url': args.url,
+                'arrival': args.arrival, 'concurrency': args.concurrency, 'mix': dict(mix),
+                'from_log': args.from_log, 'images': [name for name, _, _ in images]}
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'steps': steps}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Tiny stand-in Keras models with the same input/output shapes as the real ones.
+
+They let the benchmarks (and anyone without the trained .h5 files) exercise the
+whole prediction path. The numbers they produce are meaningless; only the
+shapes, dtypes and call overhead match.
+"""
+import os
+
+
+def build_stub_classifier(num_classes=10, input_size=224):
+    import tensorflow as tf
+    inputs = tf.keras.Input(shape=(input_size, input_size, 3))
+    x = tf.keras.layers.Conv2D(8, 3, strides=4, activation='relu')(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def build_stub_detector(input_size=128):
+    import tensorflow as tf
+    inputs = tf.keras.Input(shape=(input_size, input_size, 3))
+    x = tf.keras.layers.Conv2D(4, 3, strides=4, activation='relu')(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(1, activation='sigmoid', bias_initializer='ones')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def save_stub_models(out_dir):
+    """Write stub tomato_model.h5 and leaf_detector.h5 into out_dir and return their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    classifier_path = os.path.join(out_dir, 'tomato_model.h5')
+    detector_path = os.path.join(out_dir, 'leaf_detector.h5')
+    build_stub_classifier().save(classifier_path)
+    build_stub_detector().save(detector_path)
+    return classifier_path, detector_path
@@ -1,19 +1,207 @@
-from PIL import Image
+"""Shrink uploaded images in place, in parallel, skipping files already compacted.
+
+Each image is decoded with JPEG draft mode straight to at most --max-side
+pixels (ImagePipeline), re-encoded and swapped in with a temp file + rename,
+and only if the result is smaller. A manifest (path -> size, mtime, SHA-1 of
+the compacted file) makes reruns touch only new or changed files.
+
+It is safe to run next to the server: uploads younger than --min-age seconds
+are left for the next run, and a file that changes while it is being
+re-encoded is left alone. Because the output replaces the upload rather than
+rewriting it, hard-linked copies in the debug folder keep the original bytes.
+
+    python compress_images.py [--root static/uploads] [--workers 4] [--dry-run]
+"""
+import argparse
+import hashlib
+import json
 import os
-import glob
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-root = 'static/uploads'
-count=0
-for ext in ('*.jpg','*.jpeg','*.png'):
-    for path in glob.glob(os.path.join(root,'**',ext), recursive=True):
-        if 'debug' in path.replace('\\','/').lower():
-            continue
+from image_pipeline import ImagePipeline
+from upload_store import DEFAULT_ROOT as UPLOAD_STORE_DIR
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MANIFEST_NAME = '.compress_manifest.json'
+
+
+def sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_upload_store(path):
+    """The content-addressed store (UPLOAD_STORE_DIR) is already normalized at ingest and must not be re-encoded."""
+    return (os.path.exists(os.path.join(path, 'index.sqlite3'))
+            or os.path.realpath(path) == os.path.realpath(UPLOAD_STORE_DIR))
+
+
+def find_images(root, include_debug=False):
+    """Upload files under root, skipping the upload store, the debug folder, mask overlays and temp files."""
+    if is_upload_store(root):
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not is_upload_store(os.path.join(dirpath, d))]
+        if not include_debug:
+            dirnames[:] = [d for d in dirnames if d.lower() != 'debug']
+        for name in filenames:
+            if name.lower().endswith(EXTENSIONS) and '_mask_' not in name:
+                yield os.path.join(dirpath, name)
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.part')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def needs_work(path, st, manifest_entry):
+    """False when the manifest says this exact file was already compacted (stat first, hash only on doubt)."""
+    if not manifest_entry:
+        return True
+    if manifest_entry['size'] == st.st_size and manifest_entry['mtime_ns'] == st.st_mtime_ns:
+        return False
+    return manifest_entry['size'] != st.st_size or manifest_entry['sha1'] != sha1_file(path)
+
+
+def compact_file(path, max_side=1024, quality=80, dry_run=False):
+    """Re-encode one image; returns a result dict (also used as the manifest entry)."""
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        pipeline = ImagePipeline(data, max_side=max_side)
+        fmt = 'PNG' if path.lower().endswith('.png') else 'JPEG'
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pipeline.image.save(f, format=fmt, quality=quality, optimize=True)
+            after = os.path.getsize(tmp)
+            now = os.stat(path)
+            if (now.st_size, now.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                return {'path': path, 'status': 'changed', 'before': st.st_size, 'after': st.st_size}
+            if dry_run:
+                return {'path': path, 'status': 'dry-run', 'before': st.st_size, 'after': min(after, st.st_size)}
+            if after >= st.st_size:
+                # Re-encoding does not help; remember the file so the next run skips it
+                return {'path': path, 'status': 'kept', 'before': st.st_size, 'after': st.st_size,
+                        'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': hashlib.sha1(data).hexdigest()}
+            os.replace(tmp, path)
+            tmp = None
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+        st = os.stat(path)
+        return {'path': path, 'status': 'compacted', 'before': len(data), 'after': st.st_size,
+                'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1_file(path)}
+    except Exception as e:
+        return {'path': path, 'status': 'error', 'error': str(e), 'before': 0, 'after': 0}
+
+
+def _compact_args(args):
+    return compact_file(*args)
+
+
+def compact(root, workers=None, max_side=1024, quality=80, min_age=10.0, manifest_path=None,
+            include_debug=False, dry_run=False):
+    """Compact every new or changed image under root; returns a summary dict."""
+    manifest_path = manifest_path or os.path.join(root, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    t0 = time.perf_counter()
+    now = time.time()
+    todo, skipped, too_new = [], 0, 0
+    for path in find_images(root, include_debug):
+        rel = os.path.relpath(path, root)
         try:
-            img = Image.open(path)
-            img = img.convert('RGB')
-            img.thumbnail((1024,1024))
-            img.save(path, quality=80, optimize=True)
-            count+=1
-        except Exception as e:
-            print('skip', path, e)
-print('Processed', count, 'images')
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime < min_age:
+            too_new += 1
+        elif needs_work(path, st, manifest.get(rel)):
+            todo.append(path)
+        else:
+            skipped += 1
+
+    jobs = [(p, max_side, quality, dry_run) for p in todo]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_compact_args, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [_compact_args(job) for job in jobs]
+
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+        if 'sha1' in r:
+            manifest[os.path.relpath(r['path'], root)] = {k: r[k] for k in ('size', 'mtime_ns', 'sha1')}
+    if not dry_run:
+        # forget files that no longer exist
+        manifest = {rel: e for rel, e in manifest.items() if os.path.exists(os.path.join(root, rel))}
+        save_manifest(manifest_path, manifest)
+
+    elapsed = time.perf_counter() - t0
+    before = sum(r['before'] for r in results)
+    after = sum(r['after'] for r in results)
+    return {
+        'scanned': len(todo) + skipped + too_new,
+        'processed': len(results),
+        'skipped_in_manifest': skipped,
+        'skipped_too_new': too_new,
+        'statuses': counts,
+        'errors': [{'path': r['path'], 'error': r['error']} for r in results if r['status'] == 'error'],
+        'bytes_before': before,
+        'bytes_after': after,
+        'bytes_saved': before - after,
+        'elapsed_s': round(elapsed, 3),
+        'files_per_s': round(len(results) / elapsed, 2) if elapsed else None,
+        'mb_per_s': round(before / 1e6 / elapsed, 2) if elapsed else None,
+        'workers': workers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default='static/uploads')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes (default: CPU count)')
+    parser.add_argument('--max-side', type=int, default=1024)
+    parser.add_argument('--quality', type=int, default=80, help='JPEG quality')
+    parser.add_argument('--min-age', type=float, default=10.0,
+                        help='leave files modified in the last N seconds for the next run')
+    parser.add_argument('--manifest', help=f'manifest path (default <root>/{MANIFEST_NAME})')
+    parser.add_argument('--include-debug', action='store_true', help='also compact the debug folder')
+    parser.add_argument('--dry-run', action='store_true', help='report savings without replacing files')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    summary = compact(args.root, workers=args.workers, max_side=args.max_side, quality=args.quality,
+                      min_age=args.min_age, manifest_path=args.manifest,
+                      include_debug=args.include_debug, dry_run=args.dry_run)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    for e in summary['errors']:
+        print('skip', e['path'], e['error'])
+    print(f"Processed {summary['processed']} images ({summary['skipped_in_manifest']} already compacted, "
+          f"{summary['skipped_too_new']} too new) with {summary['workers']} workers")
+    print(f"Bytes: {summary['bytes_before']} -> {summary['bytes_after']} (saved {summary['bytes_saved']})")
+    print(f"Throughput: {summary['files_per_s']} files/s, {summary['mb_per_s']} MB/s in {summary['elapsed_s']} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,200 @@
+"""Export the Keras models to TFLite variants and report size, latency and agreement.
+
+For each model (tomato_model.h5 and, if present, leaf_detector.h5) this writes
+
+    models/<name>.tflite          float32 (the file the tflite backend serves)
+    models/<name>_dynamic.tflite  dynamic-range quantized weights
+    models/<name>_float16.tflite  float16 weights
+    models/<name>_int8.tflite     full-integer, calibrated on images from --data-dir
+
+and, for every variant, measures file size, single-image and batched CPU
+latency, and top-1 agreement with the float Keras model on a held-out split
+of the images. The report is printed and saved as JSON.
+
+    python convert_to_tflite.py [--variants float32,int8] [--data-dir static/uploads/store]
+"""
+import argparse
+import json
 import os
 import sys
+import time
+
+import numpy as np
+
+from image_pipeline import ImagePipeline
+from tflite_backend import TFLiteModel
+from upload_store import DEFAULT_ROOT, find_upload_images
+
+MODELS = {
+    'tomato_model': os.path.join('models', 'tomato_model.h5'),
+    'leaf_detector': os.path.join('models', 'leaf_detector.h5'),
+}
+VARIANTS = ('float32', 'dynamic', 'float16', 'int8')
+
 
-MODEL_PATH = os.path.join('models', 'tomato_model.h5')
-OUT_PATH = os.path.join('models', 'tomato_model.tflite')
+def list_images(data_dir):
+    return find_upload_images(data_dir)
 
-if not os.path.exists(MODEL_PATH):
-    print(f"Model file not found: {MODEL_PATH}")
-    sys.exit(1)
 
-try:
-    import tensorflow as tf
-    print('Loading Keras model...')
-    model = tf.keras.models.load_model(MODEL_PATH)
+def split_images(paths, holdout_every):
+    """Deterministic split: every Nth image is held out for agreement, the rest calibrate int8."""
+    held_out = paths[::holdout_every]
+    calibration = [p for i, p in enumerate(paths) if i % holdout_every]
+    return calibration, held_out
 
-    print('Converting to TFLite (float32)...')
+
+def load_batch(paths, size):
+    """Preprocess images exactly like the app (RGB resize, /255) into one (N, size, size, 3) batch."""
+    rows = []
+    for p in paths:
+        try:
+            rows.append(ImagePipeline.from_path(p).tensor(size)[0])
+        except Exception as e:
+            print('skip', p, e)
+    if not rows:
+        return np.zeros((0, size, size, 3), dtype='float32')
+    return np.stack(rows).astype('float32')
+
+
+def convert(tf, model, variant, calibration):
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    tflite_model = converter.convert()
-
-    with open(OUT_PATH, 'wb') as f:
-        f.write(tflite_model)
-
-    orig_size = os.path.getsize(MODEL_PATH)
-    tflite_size = os.path.getsize(OUT_PATH)
-    print(f'Wrote TFLite model to {OUT_PATH}')
-    print(f'Original size: {orig_size} bytes')
-    print(f'TFLite size: {tflite_size} bytes')
-    print('Conversion complete.')
-except Exception as e:
-    print('Conversion failed:', e)
-    sys.exit(2)
+    if variant == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        def representative_dataset():
+            for row in calibration:
+                yield [row[np.newaxis].astype('float32')]
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def time_predict(m, batch, runs):
+    m.predict(batch)  # warm-up
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        m.predict(batch)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return round(float(np.median(times)), 3)
+
+
+def agreement(reference, candidate):
+    """Top-1 agreement (or leaf/not-leaf agreement for single-output models) plus max prob delta."""
+    if len(reference) == 0:
+        return None, None
+    if reference.shape[1] == 1:
+        same = (reference[:, 0] >= 0.5) == (candidate[:, 0] >= 0.5)
+    else:
+        same = np.argmax(reference, axis=1) == np.argmax(candidate, axis=1)
+    return round(float(np.mean(same)), 4), round(float(np.max(np.abs(reference - candidate))), 4)
+
+
+def export_model(tf, name, path, args, calibration_paths, held_out_paths):
+    print(f'Loading Keras model {path}...')
+    model = tf.keras.models.load_model(path)
+    size = int(model.input_shape[1])
+    calibration = load_batch(calibration_paths[:args.num_calibration], size)
+    held_out = load_batch(held_out_paths, size)
+    reference = model.predict(held_out, verbose=0) if len(held_out) else np.zeros((0, 1))
+
+    single = np.zeros((1, size, size, 3), dtype='float32')
+    batched = np.zeros((args.batch_size, size, size, 3), dtype='float32')
+    results = []
+    for variant in args.variants:
+        if variant == 'int8' and len(calibration) == 0:
+            print(f'Skipping {name} int8: no calibration images in {args.data_dir}')
+            continue
+        print(f'Converting {name} to TFLite ({variant})...')
+        content = convert(tf, model, variant, calibration)
+        suffix = '' if variant == 'float32' else f'_{variant}'
+        out_path = os.path.join(args.out_dir, f'{name}{suffix}.tflite')
+        with open(out_path, 'wb') as f:
+            f.write(content)
+
+        m = TFLiteModel(model_content=content, num_threads=args.threads)
+        single_ms = time_predict(m, single, args.runs)
+        batch_ms = time_predict(m, batched, args.runs)
+        agree, max_delta = agreement(reference, m.predict(held_out)) if len(held_out) else (None, None)
+        results.append({
+            'model': name,
+            'variant': variant,
+            'path': out_path,
+            'size_bytes': len(content),
+            'single_ms': single_ms,
+            f'batch{args.batch_size}_ms': batch_ms,
+            'batched_per_image_ms': round(batch_ms / args.batch_size, 3),
+            'top1_agreement': agree,
+            'max_prob_delta': max_delta,
+            'held_out_images': int(len(held_out)),
+        })
+    return {'model': name, 'source': path, 'source_size_bytes': os.path.getsize(path), 'variants': results}
+
+
+def print_report(report):
+    for entry in report['models']:
+        print(f"\n{entry['model']} (Keras .h5: {entry['source_size_bytes']} bytes)")
+        print(f"  {'variant':<9} {'size':>10} {'single ms':>10} {'batch/img ms':>13} {'agreement':>10}")
+        for r in entry['variants']:
+            agree = '-' if r['top1_agreement'] is None else f"{r['top1_agreement']:.4f}"
+            print(f"  {r['variant']:<9} {r['size_bytes']:>10} {r['single_ms']:>10} "
+                  f"{r['batched_per_image_ms']:>13} {agree:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help=f'comma-separated subset of {",".join(VARIANTS)}')
+    parser.add_argument('--data-dir', default=DEFAULT_ROOT,
+                        help='images for int8 calibration and the held-out agreement set')
+    parser.add_argument('--holdout-every', type=int, default=5,
+                        help='every Nth image is held out for agreement (default 5)')
+    parser.add_argument('--num-calibration', type=int, default=200)
+    parser.add_argument('--tomato-model', default=MODELS['tomato_model'])
+    parser.add_argument('--leaf-model', default=MODELS['leaf_detector'])
+    parser.add_argument('--out-dir', default='models')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('TFLITE_NUM_THREADS', 2)))
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per measurement')
+    parser.add_argument('--report', default=os.path.join('models', 'export_report.json'))
+    args = parser.parse_args()
+    args.variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    unknown = set(args.variants) - set(VARIANTS)
+    if unknown:
+        parser.error(f'unknown variants: {", ".join(sorted(unknown))}')
+
+    if not os.path.exists(args.tomato_model):
+        print(f"Model file not found: {args.tomato_model}")
+        sys.exit(1)
+
+    try:
+        import tensorflow as tf
+        os.makedirs(args.out_dir, exist_ok=True)
+        calibration_paths, held_out_paths = split_images(list_images(args.data_dir), max(2, args.holdout_every))
+        print(f'{len(calibration_paths)} calibration / {len(held_out_paths)} held-out images from {args.data_dir}')
+
+        report = {'threads': args.threads, 'batch_size': args.batch_size, 'models': []}
+        for name, path in (('tomato_model', args.tomato_model), ('leaf_detector', args.leaf_model)):
+            if not os.path.exists(path):
+                print(f'Skipping {path} (not found)')
+                continue
+            report['models'].append(export_model(tf, name, path, args, calibration_paths, held_out_paths))
+
+        print_report(report)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nWrote report to {args.report}')
+        print('Conversion complete.')
+    except Exception as e:
+        print('Conversion failed:', e)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
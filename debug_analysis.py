@@ -1,5 +1,25 @@
+"""Summarize the prediction debug log without loading it into memory.
+
+Streams debug_logs.jsonl (and, with --rotated, the rotated
+debug_logs.<stamp>-<pid>.jsonl files) in chunks, turns each chunk's
+raw_predictions into a NumPy matrix and folds it into fixed-size aggregates:
+class distribution, uncertain rate, confidence and top-1/top-2 margin
+histograms, top-k probability mass, per-endpoint and per-file breakdowns.
+Memory use depends on --chunk-lines and --top-files, not on the log size.
+
+    python debug_analysis.py [--since 24h] [--endpoint api/predict] [--json summary.json]
+"""
+import argparse
+import glob
 import json
+import os
+import time
 from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from upload_store import DEFAULT_ROOT
 
 LOG = 'static/uploads/debug/debug_logs.jsonl'
 CLASS_LABELS = [
@@ -8,60 +28,282 @@ CLASS_LABELS = [
     'Target_Spot', 'Yellow_Leaf_Curl_Virus',
     'Mosaic_virus', 'Healthy'
 ]
+CONFIDENCE_BINS = np.linspace(0.0, 100.0, 21)
+MARGIN_BINS = np.linspace(0.0, 1.0, 21)
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(value, now=None):
+    """Epoch seconds from '90m'/'24h'/'7d' (ago), a Unix timestamp or an ISO date/time."""
+    if value is None:
+        return None
+    value = value.strip()
+    if value[-1:] in _UNITS and value[:-1].replace('.', '', 1).isdigit():
+        return (now or time.time()) - float(value[:-1]) * _UNITS[value[-1]]
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def log_paths(log, rotated=False):
+    """The live log, preceded (oldest first) by its rotated siblings when `rotated` is set."""
+    paths = []
+    if rotated:
+        stem, ext = os.path.splitext(log)
+        paths.extend(sorted(p for p in glob.glob(f'{stem}.*{ext}') if p != log))
+    if os.path.exists(log):
+        paths.append(log)
+    return paths
+
+
+def iter_chunks(paths, chunk_lines=20000):
+    """Yield lists of at most chunk_lines parsed entries; malformed lines are counted, not fatal."""
+    chunk = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError:
+                    chunk.append(None)
+                if len(chunk) >= chunk_lines:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
 
-entries = []
-try:
-    with open(LOG, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+class TopFiles:
+    """Per-file counts with bounded memory: beyond 2 x capacity names the smallest are pruned,
+    so counts are exact until the log has more distinct files than that and lower bounds after."""
+
+    def __init__(self, capacity=1000):
+        self.capacity = max(1, int(capacity))
+        self.counts = {}
+        self.pruned = False
+
+    def add(self, name, uncertain):
+        c = self.counts.get(name)
+        if c is None:
+            c = self.counts[name] = [0, 0]
+        c[0] += 1
+        c[1] += int(bool(uncertain))
+        if len(self.counts) > 2 * self.capacity:
+            keep = sorted(self.counts.items(), key=lambda kv: kv[1][0], reverse=True)[:self.capacity]
+            self.counts = dict(keep)
+            self.pruned = True
+
+    def most_common(self, n):
+        return sorted(self.counts.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+
+
+class Aggregates:
+    """Running totals over every chunk that passes the filters."""
+
+    def __init__(self, num_classes=len(CLASS_LABELS), top_k=3, top_files=1000):
+        self.num_classes = num_classes
+        self.top_k = max(1, min(int(top_k), num_classes))
+        self.entries = 0
+        self.skipped = 0
+        self.malformed = 0
+        self.uncertain = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.class_counts = np.zeros(num_classes, dtype='int64')
+        self.reported = Counter()
+        self.confidence_hist = np.zeros(len(CONFIDENCE_BINS) - 1, dtype='int64')
+        self.margin_hist = np.zeros(len(MARGIN_BINS) - 1, dtype='int64')
+        self.topk_mass_sum = 0.0
+        self.margin_sum = 0.0
+        self.rows = 0
+        self.endpoints = {}
+        self.files = TopFiles(top_files)
+
+    def add_chunk(self, entries, since=None, until=None, endpoints=None):
+        kept = []
+        for e in entries:
+            if e is None:
+                self.malformed += 1
+                continue
+            ts = e.get('ts')
+            if since is not None and (ts is None or ts < since):
+                continue
+            if until is not None and (ts is None or ts >= until):
                 continue
-            entries.append(json.loads(line))
-except FileNotFoundError:
-    print('No debug log found at', LOG)
-    raise
-
-print(f'Total debug entries: {len(entries)}\n')
-
-agg_top = Counter()
-uncount = 0
-files = Counter()
-
-for e in entries:
-    fname = e.get('filename')
-    files[fname] += 1
-    raw = e.get('raw_predictions', [])
-    if raw:
-        # get top-3
-        top = sorted(enumerate(raw), key=lambda x: x[1], reverse=True)[:3]
-        top3 = [(CLASS_LABELS[idx], float(score)) for idx,score in top]
-    else:
-        top3 = []
-    print('File:', fname)
-    print(' Endpoint:', e.get('endpoint'))
-    print(' Reported prediction:', e.get('prediction'), 'confidence:', e.get('confidence'))
-    print(' Uncertain flag:', e.get('uncertain', False))
-    print(' Top-3:')
-    for label,score in top3:
-        print('  -', label, f'{score:.4f}')
-    print()
-    if e.get('uncertain'):
-        uncount += 1
-    if top3:
-        agg_top[top3[0][0]] += 1
-
-print('Files seen and counts:')
-for f,c in files.items():
-    print('-', f, c)
-
-print('\nTop reported top-1 labels count:')
-for k,v in agg_top.most_common():
-    print(f' - {k}: {v}')
-
-print(f'\nUncertain entries: {uncount} / {len(entries)}')
-
-# Suggestions
-print('\nSuggestions:')
-print('- If many entries are "Uncertain", consider lowering CONF_THRESH or collecting more labeled training images.')
-print('- If specific wrong classes dominate (e.g., Early_blight predicted often), examine training label distribution and class mapping.')
-print('- Inspect the images in static/uploads/debug/ to verify content and cropping.')
+            if endpoints and e.get('endpoint') not in endpoints:
+                continue
+            kept.append(e)
+        if not kept:
+            return
+
+        n = len(kept)
+        self.entries += n
+        uncertain = np.fromiter((bool(e.get('uncertain')) for e in kept), dtype=bool, count=n)
+        confidence = np.fromiter((e.get('confidence') or 0.0 for e in kept), dtype='float64', count=n)
+        stamps = np.fromiter((e.get('ts') or np.nan for e in kept), dtype='float64', count=n)
+        self.uncertain += int(uncertain.sum())
+        self.confidence_hist += np.histogram(np.clip(confidence, 0.0, 100.0), bins=CONFIDENCE_BINS)[0]
+        if not np.all(np.isnan(stamps)):
+            lo, hi = float(np.nanmin(stamps)), float(np.nanmax(stamps))
+            self.first_ts = lo if self.first_ts is None else min(self.first_ts, lo)
+            self.last_ts = hi if self.last_ts is None else max(self.last_ts, hi)
+        self.reported.update(e.get('prediction') for e in kept)
+        for e, unc in zip(kept, uncertain):
+            self.files.add(e.get('filename'), unc)
+
+        # raw_predictions as one (rows, classes) matrix; rows of the wrong length are skipped
+        valid = [i for i, e in enumerate(kept) if len(e.get('raw_predictions') or ()) == self.num_classes]
+        self.skipped += n - len(valid)
+        if valid:
+            raw = np.asarray([kept[i]['raw_predictions'] for i in valid], dtype='float32')
+            top1 = np.argmax(raw, axis=1)
+            self.class_counts += np.bincount(top1, minlength=self.num_classes)
+            ranked = -np.sort(-raw, axis=1)
+            # the margin always uses the top two, whatever --top-k asks for
+            margin = ranked[:, 0] - (ranked[:, 1] if self.num_classes > 1 else 0.0)
+            self.margin_hist += np.histogram(np.clip(margin, 0.0, 1.0), bins=MARGIN_BINS)[0]
+            self.margin_sum += float(margin.sum())
+            self.topk_mass_sum += float(ranked[:, :self.top_k].sum())
+            self.rows += len(valid)
+        else:
+            top1 = np.zeros(0, dtype='int64')
+
+        # per-endpoint breakdown
+        names = np.asarray([e.get('endpoint') or 'unknown' for e in kept])
+        valid_names = names[valid] if valid else names[:0]
+        for name in np.unique(names):
+            mask = names == name
+            ep = self.endpoints.get(name)
+            if ep is None:
+                ep = self.endpoints[name] = {'entries': 0, 'uncertain': 0, 'confidence_sum': 0.0,
+                                             'class_counts': np.zeros(self.num_classes, dtype='int64')}
+            ep['entries'] += int(mask.sum())
+            ep['uncertain'] += int(uncertain[mask].sum())
+            ep['confidence_sum'] += float(confidence[mask].sum())
+            ep['class_counts'] += np.bincount(top1[valid_names == name], minlength=self.num_classes)
+
+    def summary(self, top_files=20):
+        n = self.entries
+        labels = CLASS_LABELS if self.num_classes == len(CLASS_LABELS) else [str(i) for i in range(self.num_classes)]
+        return {
+            'entries': n,
+            'malformed_lines': self.malformed,
+            'entries_without_raw_predictions': self.skipped,
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'uncertain': self.uncertain,
+            'uncertain_rate': round(self.uncertain / n, 4) if n else None,
+            'top1_classes': {labels[i]: int(c) for i, c in enumerate(self.class_counts)},
+            'reported_predictions': dict(self.reported.most_common()),
+            'confidence_histogram': {'bins': CONFIDENCE_BINS.tolist(), 'counts': self.confidence_hist.tolist()},
+            'margin_histogram': {'bins': MARGIN_BINS.tolist(), 'counts': self.margin_hist.tolist()},
+            'mean_top1_top2_margin': round(self.margin_sum / self.rows, 4) if self.rows else None,
+            f'mean_top{self.top_k}_mass': round(self.topk_mass_sum / self.rows, 4) if self.rows else None,
+            'endpoints': {
+                name: {
+                    'entries': ep['entries'],
+                    'uncertain_rate': round(ep['uncertain'] / ep['entries'], 4),
+                    'mean_confidence': round(ep['confidence_sum'] / ep['entries'], 2),
+                    'top1_classes': {labels[i]: int(c) for i, c in enumerate(ep['class_counts']) if c},
+                }
+                for name, ep in sorted(self.endpoints.items())
+            },
+            'files': [{'filename': name, 'entries': c[0], 'uncertain': c[1]}
+                      for name, c in self.files.most_common(top_files)],
+            'file_counts_approximate': self.files.pruned,
+        }
+
+
+def analyze(paths, since=None, until=None, endpoints=None, chunk_lines=20000, top_k=3, top_files=1000):
+    agg = Aggregates(top_k=top_k, top_files=top_files)
+    for chunk in iter_chunks(paths, chunk_lines):
+        agg.add_chunk(chunk, since=since, until=until, endpoints=endpoints)
+    return agg
+
+
+def bar(count, total, width=30):
+    return '#' * int(round(width * count / total)) if total else ''
+
+
+def print_summary(s):
+    n = s['entries']
+    print(f'Total debug entries: {n}'
+          + (f" ({s['malformed_lines']} malformed lines skipped)" if s['malformed_lines'] else ''))
+    if not n:
+        return
+    if s['first_ts'] is not None:
+        fmt = '%Y-%m-%d %H:%M:%S'
+        print(f"Time range: {time.strftime(fmt, time.localtime(s['first_ts']))} .. "
+              f"{time.strftime(fmt, time.localtime(s['last_ts']))}")
+    print(f"Uncertain entries: {s['uncertain']} / {n} ({s['uncertain_rate']:.1%})")
+
+    print('\nTop-1 class from raw_predictions:')
+    for label, c in sorted(s['top1_classes'].items(), key=lambda kv: kv[1], reverse=True):
+        if c:
+            print(f' - {label:<24} {c:>8}')
+
+    print('\nConfidence histogram (%):')
+    hist = s['confidence_histogram']
+    total = sum(hist['counts'])
+    for lo, hi, c in zip(hist['bins'], hist['bins'][1:], hist['counts']):
+        print(f'  {lo:5.0f}-{hi:<4.0f} {c:>8} {bar(c, total)}')
+
+    print(f"\nTop-1 minus top-2 probability (mean {s['mean_top1_top2_margin']}):")
+    hist = s['margin_histogram']
+    for lo, hi, c in zip(hist['bins'], hist['bins'][1:], hist['counts']):
+        print(f'  {lo:4.2f}-{hi:<4.2f} {c:>8} {bar(c, total)}')
+
+    print('\nPer endpoint:')
+    for name, ep in s['endpoints'].items():
+        print(f" - {name}: {ep['entries']} entries, uncertain {ep['uncertain_rate']:.1%}, "
+              f"mean confidence {ep['mean_confidence']}")
+
+    print('\nMost logged files' + (' (approximate counts)' if s['file_counts_approximate'] else '') + ':')
+    for f in s['files']:
+        print(f" - {f['filename']}: {f['entries']} (uncertain {f['uncertain']})")
+
+    # Suggestions
+    print('\nSuggestions:')
+    print('- If many entries are "Uncertain", consider lowering CONF_THRESH or collecting more labeled training images.')
+    print('- If specific wrong classes dominate (e.g., Early_blight predicted often), examine training label distribution and class mapping.')
+    print('- Inspect the logged images to verify content and cropping: they are in the upload store '
+          f'({DEFAULT_ROOT}/<ab>/<cd>/<upload_id>.jpg), and `python annotate_debug.py <filename or upload_id>` '
+          'draws the logged prediction on one.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log', default=LOG, help=f'debug log to read (default {LOG})')
+    parser.add_argument('--rotated', action='store_true', help='also read rotated debug_logs.*.jsonl files')
+    parser.add_argument('--since', help="only entries at/after this time: '24h', '7d', epoch or ISO date")
+    parser.add_argument('--until', help='only entries before this time (same formats)')
+    parser.add_argument('--endpoint', action='append',
+                        help='only this endpoint (api/predict, api/predict/batch, web/upload); repeatable')
+    parser.add_argument('--top-k', type=int, default=3, help='report the mean probability mass of the top k classes')
+    parser.add_argument('--top-files', type=int, default=20, help='files to list in the per-file breakdown')
+    parser.add_argument('--chunk-lines', type=int, default=20000, help='lines parsed and vectorized at a time')
+    parser.add_argument('--json', help='also write the summary as JSON to this path')
+    args = parser.parse_args()
+
+    paths = log_paths(args.log, args.rotated)
+    if not paths:
+        print('No debug log found at', args.log)
+        raise SystemExit(1)
+
+    agg = analyze(paths, since=parse_time(args.since), until=parse_time(args.until),
+                  endpoints=set(args.endpoint or ()), chunk_lines=args.chunk_lines,
+                  top_k=args.top_k, top_files=max(1000, args.top_files))
+    summary = agg.summary(top_files=args.top_files)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print('\nWrote', args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import glob
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+class DebugWriter:
+    """
+    Background writer for the prediction debug log.
+
+    Request handlers call submit(), which only puts the entry on a bounded
+    queue; a daemon thread drains it in batches, appending all pending lines
+    with one write and hard-linking (rather than copying) the uploads into
+    the debug folder. When the queue is full the entry is dropped and
+    counted instead of slowing the request down.
+
+    The log is rotated to `debug_logs.<timestamp>-<pid>.jsonl` once it exceeds
+    `max_bytes` or its first entry is older than `max_age_s`. Lines keep the
+    existing JSONL format (plus a `ts` field), so debug_analysis.py and
+    annotate_debug.py read them unchanged.
+
+    Rotated logs are deleted once more than `keep_rotated` of them exist or
+    they are older than `retention_s` (0 disables either limit). Each one is
+    first renamed aside, so only one worker prunes it, and handed to
+    `on_prune(path)` (e.g. to release the uploads it references).
+    """
+
+    def __init__(self, log_path, debug_dir, max_queue=1000, flush_interval=0.5,
+                 max_batch=256, max_bytes=50 * 1024 * 1024, max_age_s=7 * 24 * 3600,
+                 keep_rotated=20, retention_s=30 * 24 * 3600, on_prune=None):
+        self.log_path = log_path
+        self.debug_dir = debug_dir
+        self.max_queue = max(1, int(max_queue))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.max_batch = max(1, int(max_batch))
+        self.max_bytes = int(max_bytes)
+        self.max_age_s = float(max_age_s)
+        self.keep_rotated = max(0, int(keep_rotated))
+        self.retention_s = max(0.0, float(retention_s))
+        self.on_prune = on_prune
+        self._pruned_pid = None
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._log_started = None
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.pruned = 0
+        self.linked = 0
+        self.copied = 0
+        self.errors = 0
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='debug-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, entry, src_path=None, dest_name=None):
+        """Queue a log entry and optionally an upload to keep in the debug folder.
+
+        Returns False if the queue was full and the entry was dropped.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((entry, src_path, dest_name))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """Block until everything submitted so far has been written (used by tests and at shutdown)."""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self.written + self.errors >= self.submitted:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # Give other requests a moment to pile up so they share one write
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(items)
+
+    def _write(self, items):
+        try:
+            if self._maybe_rotate() or self._pruned_pid != os.getpid():
+                self._pruned_pid = os.getpid()
+                self.prune()
+            lines = ''.join(json.dumps(entry) + '\n' for entry, _, _ in items)
+            with open(self.log_path, 'a', encoding='utf-8') as df:
+                df.write(lines)
+            if self._log_started is None:
+                self._log_started = items[0][0].get('ts', time.time())
+            for _, src, name in items:
+                if src:
+                    self._keep_file(src, name or os.path.basename(src))
+            with self._lock:
+                self.written += len(items)
+                self.flushes += 1
+        except Exception as e:
+            print(f"Failed to write debug info: {e}")
+            with self._lock:
+                self.errors += len(items)
+
+    def _keep_file(self, src, name):
+        dest = os.path.join(self.debug_dir, name)
+        tmp = f'{dest}.{os.getpid()}.tmp'
+        try:
+            # A hard link costs no data I/O; uploads are replaced (not rewritten
+            # in place), so the debug copy keeps the bytes that were predicted on.
+            os.link(src, tmp)
+            os.replace(tmp, dest)
+            with self._lock:
+                self.linked += 1
+        except OSError:
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                shutil.copy2(src, dest)
+                with self._lock:
+                    self.copied += 1
+            except OSError as e:
+                print(f"Failed to keep debug copy of {src}: {e}")
+
+    def _first_entry_ts(self):
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                first = f.readline()
+            return float(json.loads(first).get('ts')) if first.strip() else None
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None
+
+    def _maybe_rotate(self):
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            self._log_started = None
+            return False
+        if self._log_started is None:
+            self._log_started = self._first_entry_ts() or os.path.getmtime(self.log_path)
+        too_big = self.max_bytes > 0 and size >= self.max_bytes
+        too_old = self.max_age_s > 0 and time.time() - self._log_started >= self.max_age_s
+        if too_old:
+            # Another worker may already have rotated; re-check against the file on disk
+            self._log_started = self._first_entry_ts() or os.path.getmtime(self.log_path)
+            too_old = time.time() - self._log_started >= self.max_age_s
+        if not (too_big or too_old):
+            return False
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        root, ext = os.path.splitext(self.log_path)
+        target = f'{root}.{stamp}-{os.getpid()}{ext}'
+        n = 1
+        while os.path.exists(target):
+            target = f'{root}.{stamp}-{os.getpid()}-{n}{ext}'
+            n += 1
+        try:
+            os.replace(self.log_path, target)
+        except FileNotFoundError:
+            # another worker rotated it first; this batch goes to the fresh log
+            self._log_started = None
+            return False
+        self._log_started = None
+        with self._lock:
+            self.rotations += 1
+        return True
+
+    def rotated_logs(self):
+        """Rotated log files, oldest first."""
+        root, ext = os.path.splitext(self.log_path)
+        paths = [p for p in glob.glob(f'{glob.escape(root)}.*{ext}') if p != self.log_path]
+        return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+    def prune(self):
+        """Delete rotated logs past keep_rotated or retention_s; returns how many were removed."""
+        try:
+            paths = self.rotated_logs()
+        except OSError:
+            return 0
+        cutoff = time.time() - self.retention_s
+        excess = len(paths) - self.keep_rotated if self.keep_rotated else 0
+        removed = 0
+        for i, path in enumerate(paths):
+            try:
+                expired = self.retention_s > 0 and os.path.getmtime(path) < cutoff
+                if i >= excess and not expired:
+                    continue
+                claimed = f'{path}.{os.getpid()}.pruning'
+                os.rename(path, claimed)
+            except OSError:
+                continue  # already pruned by another worker
+            try:
+                if self.on_prune is not None:
+                    self.on_prune(claimed)
+                os.remove(claimed)
+                removed += 1
+            except Exception as e:
+                print(f"Failed to prune debug log {path}: {e}")
+        if removed:
+            with self._lock:
+                self.pruned += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'flushes': self.flushes,
+                'rotations': self.rotations,
+                'pruned': self.pruned,
+                'linked': self.linked,
+                'copied': self.copied,
+            }
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# One worker unless WEB_CONCURRENCY says otherwise (gunicorn's own default): each worker holds its own model
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+# Model loading happens before a worker accepts traffic, so allow it more than the default 30s
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+# With PRELOAD_MODELS=1 the app is imported once in the master so read-only
+# data (the .tflite flatbuffers) is shared copy-on-write by the forked workers.
+# TensorFlow/TFLite runtimes are not fork-safe, so the interpreters themselves
+# are built and warmed in each worker before it starts serving.
+preload_app = os.getenv('PRELOAD_MODELS', '0') == '1'
+
+
+def post_worker_init(worker):
+    if preload_app:
+        import app
+        app.warm_up_models()
+
+# Workers write metric snapshots to a shared directory so /metrics on any
+# worker reports totals for all of them.
+if workers > 1 and not os.getenv('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = os.path.join(os.getenv('TMPDIR', '/tmp'), f'tomato-metrics-{bind.rsplit(":", 1)[-1]}')
+
+
+# INFERENCE_BACKEND=remote: workers stay TensorFlow-free and call one shared
+# inference_server.py process, which the master starts unless
+# INFERENCE_SERVER_SPAWN=0 (e.g. when it runs as its own service).
+remote_inference = os.getenv('INFERENCE_BACKEND', '').lower() == 'remote'
+inference_server = None
+
+
+def on_starting(server):
+    global inference_server
+    if os.getenv('METRICS_DIR'):
+        from metrics import clear_collect_dir
+        clear_collect_dir(os.environ['METRICS_DIR'])
+    if remote_inference and os.getenv('INFERENCE_SERVER_SPAWN', '1') == '1':
+        socket_path = os.getenv('INFERENCE_SOCKET', '/tmp/tomato-inference.sock')
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        inference_server = subprocess.Popen([sys.executable, 'inference_server.py', '--socket', socket_path],
+                                            cwd=os.path.dirname(os.path.abspath(__file__)))
+        # Workers retry on every request until it is up, but starting them after it avoids 500s at boot
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(socket_path) and inference_server.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.2)
+        server.log.info(f"Inference server pid {inference_server.pid} on {socket_path}")
+
+
+def on_exit(server):
+    if inference_server is not None and inference_server.poll() is None:
+        inference_server.terminate()
+        inference_server.wait(10)
+
+
+def child_exit(server, worker):
+    if os.getenv('METRICS_DIR'):
+        from metrics import mark_process_dead
+        mark_process_dead(os.environ['METRICS_DIR'], worker.pid)
@@ -0,0 +1,71 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+# Longest side kept after decoding. Large enough for the green-mask overlay and
+# the HSV heuristic, far smaller than a 12 MP phone photo.
+WORKING_MAX_SIDE = int(os.getenv('WORKING_MAX_SIDE', 1024))
+
+
+class ImagePipeline:
+    """
+    Decode an uploaded image once, from memory, and derive every array the
+    prediction path needs from that single decode.
+
+    JPEGs are decoded in draft mode, which lets libjpeg downscale by 1/2, 1/4
+    or 1/8 while decoding, so a 4000x3000 photo never gets fully expanded.
+    Derived arrays are computed lazily and cached on the instance.
+
+    Parameters:
+    - data: raw uploaded file bytes
+    - max_side: longest side of the working image kept in memory
+    """
+
+    def __init__(self, data, max_side=WORKING_MAX_SIDE):
+        self.data = data
+        self.max_side = max_side
+        img = Image.open(io.BytesIO(data))
+        self.format = img.format
+        self.original_size = img.size
+        if img.format == 'JPEG':
+            # draft() picks the smallest DCT scale that still covers max_side
+            img.draft('RGB', (max_side, max_side))
+        img = img.convert('RGB')
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side))
+        self.image = img
+        self._hsv = None
+        self._tensors = {}
+
+    @classmethod
+    def from_path(cls, path, max_side=WORKING_MAX_SIDE):
+        with open(path, 'rb') as f:
+            return cls(f.read(), max_side=max_side)
+
+    def tensor(self, size):
+        """Return a (1, size, size, 3) float32 batch scaled to [0, 1]."""
+        if size not in self._tensors:
+            arr = np.asarray(self.image.resize((size, size)), dtype='float32') / 255.0
+            self._tensors[size] = np.expand_dims(arr, axis=0)
+        return self._tensors[size]
+
+    def detector_tensor(self):
+        """Input for the optional 128x128 leaf detector."""
+        return self.tensor(128)
+
+    def classifier_tensor(self):
+        """Input for the 224x224 disease classifier (same scaling as preprocess_image)."""
+        return self.tensor(224)
+
+    def crop_tensor(self, box, size=224):
+        """(1, size, size, 3) float32 batch of the working-image region `box` (x1, y1, x2, y2)."""
+        arr = np.asarray(self.image.crop(box).resize((size, size)), dtype='float32') / 255.0
+        return np.expand_dims(arr, axis=0)
+
+    def hsv_array(self):
+        """(H, W, 3) uint8 HSV array of the working image, used by the green heuristic and mask."""
+        if self._hsv is None:
+            self._hsv = np.asarray(self.image.convert('HSV'))
+        return self._hsv
@@ -0,0 +1,223 @@
+"""Local inference server: one process owns the models and serves every gunicorn worker.
+
+    INFERENCE_SERVER_BACKEND=tflite python inference_server.py [--socket /tmp/tomato-inference.sock]
+
+Web workers started with INFERENCE_BACKEND=remote never import TensorFlow;
+they preprocess uploads as usual and send the tensors here over a Unix
+socket. Single-row requests from all workers go through one MicroBatcher per
+model, so concurrent uploads share forward passes across processes.
+
+Wire format, in both directions: an 8-byte header (JSON length, payload
+length as little-endian uint32), a JSON object, then the raw array bytes.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+from batcher import MicroBatcher
+
+DEFAULT_SOCKET = os.getenv('INFERENCE_SOCKET', '/tmp/tomato-inference.sock')
+FRAME = struct.Struct('<II')
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:], n - got)
+        if k == 0:
+            raise ConnectionError('inference socket closed')
+        got += k
+    return buf
+
+
+def send_message(sock, header, array=None):
+    """Send a JSON header and an optional numpy array (shape and dtype go in the header)."""
+    payload = b''
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        header = {**header, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        payload = memoryview(array).cast('B')
+    body = json.dumps(header).encode('utf-8')
+    sock.sendall(FRAME.pack(len(body), len(payload)) + body)
+    if len(payload):
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """Receive one message; returns (header, array or None)."""
+    body_len, payload_len = FRAME.unpack(_recv_exact(sock, FRAME.size))
+    header = json.loads(bytes(_recv_exact(sock, body_len)).decode('utf-8'))
+    array = None
+    if payload_len:
+        array = np.frombuffer(_recv_exact(sock, payload_len), dtype=np.dtype(header['dtype']))
+        array = array.reshape(header['shape'])
+    return header, array
+
+
+class RemoteModel:
+    """
+    Keras-style `predict()` for a model owned by the inference server.
+
+    Each thread keeps its own connection (re-opened after a fork or a server
+    restart), so gunicorn worker threads never share a socket.
+
+    Parameters:
+    - socket_path: the server's Unix socket
+    - name: 'model' or 'leaf_detector'
+    - timeout: seconds to wait for a reply before giving up
+    """
+
+    def __init__(self, socket_path, name, timeout=30.0):
+        self.socket_path = socket_path
+        self.name = name
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        info = self.request({'op': 'info'})[0]
+        if name not in info['models']:
+            raise LookupError(f'inference server has no {name!r} model')
+        self.identity = info['models'][name]
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def request(self, header, array=None):
+        """One round trip. A reused connection the server has closed (e.g. it restarted) is re-opened
+        once; a timeout is raised as is, since the server may still be working on the request."""
+        while True:
+            reused = getattr(self._local, 'conn', None) is not None and self._local.pid == os.getpid()
+            try:
+                conn = self._connect()
+                send_message(conn, header, array)
+                reply, out = recv_message(conn)
+                break
+            except socket.timeout:
+                self._close()  # a late reply would be read as the answer to the next request
+                raise
+            except ConnectionError:
+                self._close()
+                if not reused:
+                    raise
+        if 'error' in reply:
+            raise RuntimeError(f"inference server: {reply['error']}")
+        return reply, out
+
+    def predict(self, batch, **kwargs):
+        return self.request({'op': 'predict', 'model': self.name}, np.asarray(batch, dtype='float32'))[1]
+
+    def stats(self):
+        return self.request({'op': 'stats'})[0]
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves predict requests for a dict of loaded models on a Unix socket.
+
+    Parameters:
+    - socket_path: where to listen (a stale socket file is replaced)
+    - models: name -> object with a Keras-style predict()
+    - identities: name -> JSON-friendly model identity, reported to clients for cache keys
+    - max_batch_size / max_wait_ms / max_queue: MicroBatcher settings for single-row requests
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, models, identities=None, max_batch_size=8, max_wait_ms=5.0,
+                 max_queue=256):
+        self.models = models
+        self.identities = identities or {name: None for name in models}
+        self.batchers = {name: MicroBatcher(m.predict, max_batch_size=max_batch_size,
+                                            max_wait_ms=max_wait_ms, max_queue=max_queue)
+                         for name, m in models.items()}
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def predict(self, name, batch):
+        # Multi-row batches (crops, /api/predict/batch) are already one forward pass
+        if batch.shape[0] == 1:
+            return self.batchers[name].predict(batch)
+        return np.asarray(self.models[name].predict(batch))
+
+    def dispatch(self, header, array):
+        op = header.get('op')
+        if op == 'predict':
+            if header.get('model') not in self.models:
+                return {'error': f"unknown model {header.get('model')!r}"}, None
+            return {}, np.asarray(self.predict(header['model'], array), dtype='float32')
+        if op == 'info':
+            return {'pid': os.getpid(), 'models': self.identities}, None
+        if op == 'stats':
+            return {name: b.stats() for name, b in self.batchers.items()}, None
+        return {'error': f'unknown op {op!r}'}, None
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                header, array = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply, out = self.server.dispatch(header, array)
+            except Exception as e:
+                reply, out = {'error': str(e)}, None
+            send_message(self.request, reply, out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--backend', default=os.getenv('INFERENCE_SERVER_BACKEND', 'keras'),
+                        choices=('keras', 'tflite'))
+    parser.add_argument('--batch-max-size', type=int, default=int(os.getenv('BATCH_MAX_SIZE', 8)))
+    parser.add_argument('--batch-max-wait-ms', type=float, default=float(os.getenv('BATCH_MAX_WAIT_MS', 5)))
+    args = parser.parse_args()
+
+    # Load the models with the app's own loaders (MODEL_URL download, TFLite pools, ...)
+    os.environ['INFERENCE_BACKEND'] = args.backend
+    import app as web
+    web.warm_up_models()
+    models = {name: m for name, m in (('model', web.get_model()), ('leaf_detector', web.get_leaf_detector()))
+              if m is not None}
+    if 'model' not in models:
+        raise SystemExit('No classifier model found; nothing to serve.')
+    identities = {name: web.model_files_identity() for name in models}
+    server = InferenceServer(args.socket, models, identities,
+                             max_batch_size=args.batch_max_size, max_wait_ms=args.batch_max_wait_ms)
+    web.logger.info(f"Inference server ({args.backend}) serving {sorted(models)} on {args.socket}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
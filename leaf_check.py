@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from mask_overlay import green_mask
+
+# Rows of the sample grid are visited in this interleaved order, so every
+# pass covers the whole image evenly and an early exit never sees only the top.
+_ROW_PHASES = (0, 4, 2, 6, 1, 5, 3, 7)
+
+
+def green_proportion(hsv, thresholds):
+    """Exact proportion of pixels in an (H, W, 3) HSV array that fall in the green range."""
+    if hsv.size == 0:
+        return 0.0
+    return np.count_nonzero(green_mask(hsv, thresholds)) / float(hsv.shape[0] * hsv.shape[1])
+
+
+def sample_grid(image, max_side=256):
+    """HSV array of a regular grid of real pixels from `image` (nearest-neighbour, no blending).
+
+    Averaging filters would mix green and non-green pixels into new colours; a
+    nearest-neighbour grid is a stratified sample of the original pixels.
+    """
+    if max(image.size) > max_side:
+        scale = max_side / float(max(image.size))
+        size = (max(1, int(round(image.size[0] * scale))), max(1, int(round(image.size[1] * scale))))
+        image = image.resize(size, Image.NEAREST)
+    return np.asarray(image.convert('HSV'))
+
+
+def fast_leaf_check(image, thresholds, max_side=256, z=3.0):
+    """
+    Sampled green-proportion check with early exit.
+
+    Works on a nearest-neighbour grid of at most max_side pixels per side and
+    visits its rows in interleaved passes. Pixels within a row are strongly
+    correlated, so rows are the sampling unit: after each pass the mean of the
+    per-row proportions gets a band of `z` standard errors (from the spread
+    between rows, with a finite-population correction). Once the band lies
+    entirely above or below GREEN_PROP_THRESH the decision is returned
+    without looking at the remaining rows.
+
+    Returns (is_leaf, estimated_proportion, pixels_examined).
+    """
+    hsv = sample_grid(image, max_side)
+    thresh = thresholds['GREEN_PROP_THRESH']
+    if hsv.size == 0:
+        return False, 0.0, 0
+    total_rows = hsv.shape[0]
+    width = hsv.shape[1]
+    props = np.empty(0, dtype='float64')
+    for phase in _ROW_PHASES:
+        block = hsv[phase::len(_ROW_PHASES)]
+        if block.shape[0] == 0:
+            continue
+        props = np.concatenate((props, green_mask(block, thresholds).mean(axis=1)))
+        k = props.size
+        prop = float(props.mean())
+        if k >= total_rows:
+            break
+        # Floor the variance so a pass that happens to see no green rows cannot
+        # rule out a thin green band between the rows sampled so far.
+        var = max(float(props.var(ddof=1)) if k > 1 else 0.0, 1.0 / k)
+        margin = z * math.sqrt(var / k * (1.0 - k / float(total_rows)))
+        if prop - margin >= thresh:
+            return True, prop, k * width
+        if prop + margin < thresh:
+            return False, prop, k * width
+    return prop >= thresh, prop, props.size * width
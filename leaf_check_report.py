@@ -0,0 +1,112 @@
+"""Compare the fast (sampled) HSV leaf check against the exact full-resolution check.
+
+Runs both paths over every stored upload (or the images in --dir) and reports
+decision agreement, the images where they disagree and per-image latency,
+so LEAF_CHECK_MODE=fast can be switched on with evidence.
+
+    python leaf_check_report.py [--dir static/uploads/store] [--json report.json]
+"""
+import argparse
+import io
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_pipeline import ImagePipeline
+from leaf_check import fast_leaf_check, green_proportion
+from upload_store import DEFAULT_ROOT, find_upload_images
+
+DEFAULT_DIR = DEFAULT_ROOT
+
+
+def load_thresholds():
+    """Thresholds in effect for the app: env defaults overridden by config.json, like app.py."""
+    from app import current_thresholds
+    return current_thresholds()
+
+
+def exact_check(data, thresholds):
+    img = Image.open(io.BytesIO(data)).convert('HSV')
+    prop = green_proportion(np.asarray(img), thresholds)
+    return prop >= thresholds['GREEN_PROP_THRESH'], prop
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='upload store or folder of images to check')
+    parser.add_argument('--max-side', type=int, default=int(os.getenv('LEAF_CHECK_MAX_SIDE', 256)),
+                        help='sample grid size for the fast path')
+    parser.add_argument('--json', help='also write the report as JSON to this path')
+    args = parser.parse_args()
+
+    thresholds = load_thresholds()
+    paths = find_upload_images(args.dir)
+    if not paths:
+        print('No images found in', args.dir)
+        raise SystemExit(1)
+
+    exact_ms, fast_ms, mismatches, rows = [], [], [], []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            t0 = time.perf_counter()
+            exact, exact_prop = exact_check(data, thresholds)
+            t1 = time.perf_counter()
+            # fast path end to end: draft-mode decode plus sampled check
+            fast, fast_prop, seen = fast_leaf_check(ImagePipeline(data).image, thresholds, max_side=args.max_side)
+            t2 = time.perf_counter()
+        except Exception as e:
+            print('skip', path, e)
+            continue
+        exact_ms.append((t1 - t0) * 1000.0)
+        fast_ms.append((t2 - t1) * 1000.0)
+        row = {
+            'file': os.path.basename(path),
+            'exact': exact,
+            'fast': fast,
+            'exact_prop': round(exact_prop, 5),
+            'fast_prop': round(fast_prop, 5),
+            'pixels_sampled': seen,
+        }
+        rows.append(row)
+        if exact != fast:
+            mismatches.append(row)
+
+    n = len(rows)
+    report = {
+        'images': n,
+        'thresholds': thresholds,
+        'max_side': args.max_side,
+        'agreement': round((n - len(mismatches)) / n, 5) if n else None,
+        'mismatches': mismatches,
+        'exact_ms': {'mean': round(float(np.mean(exact_ms)), 3) if n else None,
+                     'p50': percentile(exact_ms, 50), 'p95': percentile(exact_ms, 95)},
+        'fast_ms': {'mean': round(float(np.mean(fast_ms)), 3) if n else None,
+                    'p50': percentile(fast_ms, 50), 'p95': percentile(fast_ms, 95)},
+        'speedup': round(float(np.sum(exact_ms) / np.sum(fast_ms)), 2) if n and np.sum(fast_ms) else None,
+    }
+
+    print(f"Images checked: {n}")
+    print(f"Decision agreement: {report['agreement']} ({len(mismatches)} mismatches)")
+    for m in mismatches:
+        print(f" - {m['file']}: exact={m['exact']} ({m['exact_prop']}) fast={m['fast']} ({m['fast_prop']})")
+    print(f"Exact full-resolution: mean {report['exact_ms']['mean']} ms, p95 {report['exact_ms']['p95']} ms")
+    print(f"Fast sampled:          mean {report['fast_ms']['mean']} ms, p95 {report['fast_ms']['p95']} ms")
+    print(f"Speedup: {report['speedup']}x")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({**report, 'rows': rows}, f, indent=2)
+        print('Wrote', args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,44 @@
+"""Train the leaf / nonleaf detector used to screen uploads.
+
+    python train_detector.py                 # fine-tune the head with on-the-fly augmentation
+    python train_detector.py --mode cached   # train the head on cached backbone features (much faster on CPU)
+
+Both modes save the same kind of model (frozen MobileNetV2 + Dense head) to
+LEAF_DETECTOR_OUT, outputting the probability that an image is a leaf.
+"""
+import argparse
+import hashlib
+import json
 import os
+
+import numpy as np
+import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras import layers, models, optimizers
 
 DATA_DIR = os.getenv('LEAF_DETECTOR_DATA', 'leaf_detector_data')
 SAVE_PATH = os.getenv('LEAF_DETECTOR_OUT', '../models/leaf_detector.h5')
+CACHE_DIR = os.getenv('LEAF_DETECTOR_CACHE', 'leaf_detector_cache')
+INPUT_SIZE = 128
+# Index 1 is the positive class: the app reads the sigmoid output as P(leaf)
+CLASSES = ['nonleaf', 'leaf']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Fixed augmentations whose embeddings are cached next to the original's;
+# they cover the ranges ImageDataGenerator samples from in full mode
+# (horizontal flip, +-20 degrees rotation, 20% zoom).
+AUGMENTATIONS = (
+    {},
+    {'flip': True},
+    {'rotate': 20},
+    {'rotate': -20},
+    {'zoom': 0.8},
+    {'flip': True, 'rotate': 10, 'zoom': 0.9},
+    {'rotate': -10, 'zoom': 0.85},
+    {'flip': True, 'rotate': -20},
+)
+
 
 def build_model(input_shape=(128,128,3)):
     base = MobileNetV2(weights='imagenet', include_top=False, input_shape=input_shape)
@@ -17,6 +51,188 @@ def build_model(input_shape=(128,128,3)):
     model.compile(optimizer=optimizers.Adam(1e-4), loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
+
+def build_backbone(input_shape=(128,128,3)):
+    """The frozen feature extractor of build_model(): MobileNetV2 with global average pooling."""
+    base = MobileNetV2(weights='imagenet', include_top=False, input_shape=input_shape)
+    base.trainable = False
+    return models.Model(base.input, layers.GlobalAveragePooling2D()(base.output))
+
+
+def build_head(feature_dim, lr=1e-3):
+    """The trainable part of build_model(), taking pooled backbone features."""
+    inputs = layers.Input(shape=(feature_dim,))
+    x = layers.Dense(128, activation='relu')(inputs)
+    x = layers.Dropout(0.3)(x)
+    out = layers.Dense(1, activation='sigmoid')(x)
+    head = models.Model(inputs, out)
+    head.compile(optimizer=optimizers.Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
+    return head
+
+
+def attach_head(backbone, head):
+    """Full image -> P(leaf) model, as loaded by the app."""
+    return models.Model(backbone.input, head(backbone.output))
+
+
+def list_images(split_dir):
+    """(paths, labels) for <split_dir>/<class>/*, labelled by CLASSES."""
+    paths, labels = [], []
+    for label, cls in enumerate(CLASSES):
+        cls_dir = os.path.join(split_dir, cls)
+        if not os.path.isdir(cls_dir):
+            continue
+        for name in sorted(os.listdir(cls_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(cls_dir, name))
+                labels.append(label)
+    return paths, np.asarray(labels, dtype='float32')
+
+
+def load_image(path, size=INPUT_SIZE):
+    """Decode and resize one file to a [0, 1] float tensor, matching ImagePipeline.detector_tensor()."""
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    img = tf.image.resize(img, (size, size), method='bicubic', antialias=True)
+    return tf.clip_by_value(img / 255.0, 0.0, 1.0)
+
+
+def rotate(images, degrees):
+    """Rotate a (N, H, W, C) batch about its centre, reflecting at the borders."""
+    height = tf.cast(tf.shape(images)[1], tf.float32)
+    width = tf.cast(tf.shape(images)[2], tf.float32)
+    theta = np.deg2rad(degrees)
+    cos, sin = float(np.cos(theta)), float(np.sin(theta))
+    # output -> input pixel mapping: rotation about (cx, cy)
+    cx, cy = (width - 1) / 2.0, (height - 1) / 2.0
+    transform = [cos, -sin, cx - cos * cx + sin * cy, sin, cos, cy - sin * cx - cos * cy, 0.0, 0.0]
+    transforms = tf.tile(tf.reshape(tf.stack(transform), (1, 8)), (tf.shape(images)[0], 1))
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=tf.shape(images)[1:3],
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='REFLECT')
+
+
+def augment(images, flip=False, rotate_deg=0, zoom=1.0):
+    """Apply one fixed augmentation to a [0, 1] image batch."""
+    if flip:
+        images = tf.image.flip_left_right(images)
+    if rotate_deg:
+        images = rotate(images, rotate_deg)
+    if zoom < 1.0:
+        size = tf.shape(images)[1:3]
+        images = tf.image.resize(tf.image.central_crop(images, zoom), size, method='bilinear')
+    return images
+
+
+def image_dataset(paths, batch_size=32, size=INPUT_SIZE):
+    """Parallel decode, batched and prefetched, in file order."""
+    ds = tf.data.Dataset.from_tensor_slices(paths)
+    ds = ds.map(lambda p: load_image(p, size), num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def cache_key(paths, augmentations, backbone_name):
+    """Changes when a file is added, removed or modified, or the augmentations or backbone change."""
+    h = hashlib.sha1(json.dumps([list(augmentations), backbone_name]).encode('utf-8'))
+    for p in paths:
+        st = os.stat(p)
+        h.update(f'{p}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def extract_features(paths, backbone, cache_path, augmentations=AUGMENTATIONS, batch_size=32,
+                     backbone_name='mobilenetv2'):
+    """
+    Backbone embeddings for every image under every augmentation, cached as a memory-mapped .npy.
+
+    Row v * len(paths) + i holds image i under augmentations[v], stored as
+    float16. Each file is decoded once and all of its views are embedded
+    from that decode. If the cache's key (file list,
+    sizes, mtimes, augmentations, backbone) matches, nothing is recomputed.
+
+    Returns a read-only (len(augmentations) * len(paths), feature_dim) memmap.
+    """
+    key = cache_key(paths, augmentations, backbone_name)
+    meta_path = cache_path + '.json'
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get('key') == key:
+                return np.load(cache_path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+
+    n, feature_dim = len(paths), int(backbone.output_shape[-1])
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp_path = cache_path + '.part.npy'
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float16',
+                                    shape=(len(augmentations) * n, feature_dim))
+    embed = tf.function(lambda images: backbone(images, training=False), reduce_retracing=True)
+    start = 0
+    for images in image_dataset(paths, batch_size):
+        count = int(images.shape[0])
+        for v, a in enumerate(augmentations):
+            view = augment(images, a.get('flip', False), a.get('rotate', 0), a.get('zoom', 1.0))
+            out[v * n + start:v * n + start + count] = embed(view).numpy()
+        start += count
+        print(f'  embedded {start}/{n} images x {len(augmentations)} views', end='\r', flush=True)
+    print()
+    out.flush()
+    del out
+    os.replace(tmp_path, cache_path)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'key': key, 'images': n, 'augmentations': list(augmentations)}, f)
+    return np.load(cache_path, mmap_mode='r')
+
+
+def feature_dataset(features, labels, batch_size=256, shuffle=True, seed=0):
+    """tf.data pipeline over a memmapped feature array: shuffled indices, parallel row gathers, prefetch."""
+    repeats = len(features) // len(labels)
+    all_labels = np.tile(labels, repeats).astype('float32')
+
+    def gather(idx):
+        idx = np.sort(idx)  # sequential reads from the memmap
+        return features[idx].astype('float32'), all_labels[idx]
+
+    ds = tf.data.Dataset.range(len(features))
+    if shuffle:
+        ds = ds.shuffle(len(features), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(lambda idx: tf.numpy_function(gather, [idx], (tf.float32, tf.float32)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+    dim = features.shape[1]
+    ds = ds.map(lambda x, y: (tf.ensure_shape(x, (None, dim)), tf.ensure_shape(y, (None,))))
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def train_cached(train_dir, val_dir, epochs=30, batch_size=256, augmentations=len(AUGMENTATIONS),
+                 cache_dir=CACHE_DIR, backbone=None, save_path=SAVE_PATH):
+    """Embed train/val images once (train with fixed augmentations), fit the head on the cache, save the full model."""
+    backbone = backbone or build_backbone((INPUT_SIZE, INPUT_SIZE, 3))
+    augs = AUGMENTATIONS[:max(1, augmentations)]
+    train_paths, train_labels = list_images(train_dir)
+    if not train_paths:
+        raise SystemExit(f"No images found under {train_dir}/{{{','.join(CLASSES)}}}.")
+    print(f'Embedding {len(train_paths)} training images x {len(augs)} views')
+    train_feats = extract_features(train_paths, backbone, os.path.join(cache_dir, 'train_features.npy'),
+                                   augmentations=augs, backbone_name=backbone.name)
+
+    val_data = None
+    val_paths, val_labels = list_images(val_dir)
+    if val_paths:
+        val_feats = extract_features(val_paths, backbone, os.path.join(cache_dir, 'val_features.npy'),
+                                     augmentations=AUGMENTATIONS[:1], backbone_name=backbone.name)
+        val_data = feature_dataset(val_feats, val_labels, batch_size, shuffle=False)
+
+    head = build_head(train_feats.shape[1])
+    head.fit(feature_dataset(train_feats, train_labels, batch_size), validation_data=val_data, epochs=epochs)
+    model = attach_head(backbone, head)
+    model.compile(optimizer=optimizers.Adam(1e-4), loss='binary_crossentropy', metrics=['accuracy'])
+    if save_path:
+        os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+        model.save(save_path)
+        print(f"Saved leaf detector to {save_path}")
+    return model
+
+
 def train():
     # Expect DATA_DIR to have two subfolders: 'leaf' and 'nonleaf'
     train_dir = os.path.join(DATA_DIR, 'train')
@@ -26,8 +242,10 @@ def train():
         raise SystemExit(f"Training data not found at {train_dir}. Create '{DATA_DIR}/train/leaf' and '{DATA_DIR}/train/nonleaf'.")
 
     img_gen = ImageDataGenerator(rescale=1./255, horizontal_flip=True, rotation_range=20, zoom_range=0.2)
-    train_gen = img_gen.flow_from_directory(train_dir, target_size=(128,128), batch_size=32, class_mode='binary')
-    val_gen = ImageDataGenerator(rescale=1./255).flow_from_directory(val_dir, target_size=(128,128), batch_size=32, class_mode='binary')
+    train_gen = img_gen.flow_from_directory(train_dir, target_size=(128,128), batch_size=32, class_mode='binary',
+                                            classes=CLASSES)
+    val_gen = ImageDataGenerator(rescale=1./255).flow_from_directory(val_dir, target_size=(128,128), batch_size=32,
+                                                                     class_mode='binary', classes=CLASSES)
 
     model = build_model((128,128,3))
     model.fit(train_gen, validation_data=val_gen, epochs=10)
@@ -35,5 +253,25 @@ def train():
     model.save(SAVE_PATH)
     print(f"Saved leaf detector to {SAVE_PATH}")
 
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('full', 'cached'), default=os.getenv('LEAF_DETECTOR_MODE', 'full'))
+    parser.add_argument('--epochs', type=int, default=30, help='head epochs in cached mode')
+    parser.add_argument('--batch-size', type=int, default=256, help='head batch size in cached mode')
+    parser.add_argument('--augmentations', type=int, default=len(AUGMENTATIONS),
+                        help=f'cached views per training image, original included (max {len(AUGMENTATIONS)})')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+    if args.mode == 'full':
+        train()
+        return
+    train_dir = os.path.join(DATA_DIR, 'train')
+    if not os.path.exists(train_dir):
+        raise SystemExit(f"Training data not found at {train_dir}. Create '{DATA_DIR}/train/leaf' and '{DATA_DIR}/train/nonleaf'.")
+    train_cached(train_dir, os.path.join(DATA_DIR, 'val'), epochs=args.epochs, batch_size=args.batch_size,
+                 augmentations=args.augmentations, cache_dir=args.cache_dir)
+
+
 if __name__ == '__main__':
-    train()
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+
+from mask_overlay import downscale, green_mask
+
+# Window sides as fractions of the shorter image side; the stride is half a window
+DEFAULT_SCALES = (0.08, 0.16, 0.32)
+# Broad green range of the fallback mask (S_MIN comes from the s_min argument)
+FALLBACK_GREEN = {'GREEN_H_MIN': 25, 'GREEN_H_MAX': 100, 'V_MIN': 0}
+
+
+def lesion_mask(hsv, s_min=40, dark_ratio=0.6):
+    """Dark, reasonably saturated pixels: V below dark_ratio x the median V, S >= s_min."""
+    s = hsv[:, :, 1]
+    v = hsv[:, :, 2]
+    return (v < int(np.median(v) * dark_ratio)) & (s >= s_min)
+
+
+def summed_area_table(mask):
+    """(H+1, W+1) integral image: sat[y, x] is the number of set pixels above and left of (y, x)."""
+    sat = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype='int64')
+    np.cumsum(np.cumsum(mask, axis=0, dtype='int64'), axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def window_scores(sat, win_w, win_h, stride):
+    """Fraction of set pixels in every win_w x win_h window on a `stride` grid, from four table lookups each.
+
+    Returns (scores, xs, ys) with scores shaped (len(ys), len(xs)).
+    """
+    height, width = sat.shape[0] - 1, sat.shape[1] - 1
+    win_w, win_h = min(win_w, width), min(win_h, height)
+    ys = np.arange(0, height - win_h + 1, stride)
+    xs = np.arange(0, width - win_w + 1, stride)
+    y0, x0 = ys[:, np.newaxis], xs[np.newaxis, :]
+    y1, x1 = y0 + win_h, x0 + win_w
+    counts = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    return counts / float(win_w * win_h), xs, ys
+
+
+def nms(boxes, scores, iou_thresh=0.3, max_boxes=4):
+    """Greedy non-max suppression over (N, 4) x1, y1, x2, y2 boxes; each step is one vectorized IoU.
+
+    Returns the indices kept, best first.
+    """
+    order = np.argsort(-scores, kind='stable')
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < max_boxes:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = w * h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_thresh]
+    return keep
+
+
+def candidate_boxes(mask, scales=DEFAULT_SCALES, min_score=0.0):
+    """Score windows of every scale over `mask`; returns (boxes (N, 4), scores (N,), window sides (N,))."""
+    sat = summed_area_table(mask)
+    short = min(mask.shape)
+    all_boxes, all_scores, all_sides = [], [], []
+    for scale in scales:
+        side = max(4, int(round(short * scale)))
+        scores, xs, ys = window_scores(sat, side, side, max(1, side // 2))
+        iy, ix = np.nonzero(scores > min_score)
+        if iy.size == 0:
+            continue
+        x0, y0 = xs[ix], ys[iy]
+        win = min(side, mask.shape[1]), min(side, mask.shape[0])
+        all_boxes.append(np.stack([x0, y0, x0 + win[0], y0 + win[1]], axis=1))
+        all_scores.append(scores[iy, ix])
+        all_sides.append(np.full(iy.size, side))
+    if not all_boxes:
+        return np.zeros((0, 4), dtype='int64'), np.zeros(0), np.zeros(0, dtype='int64')
+    return np.concatenate(all_boxes), np.concatenate(all_scores), np.concatenate(all_sides)
+
+
+def context_box(box, image_size, context=2.0):
+    """Square (x1, y1, x2, y2) crop around a localize_lesions() box, `context` times its size, kept inside the image."""
+    width, height = image_size
+    side = min(max(box['w'], box['h']) * context, width, height)
+    cx, cy = box['x'] + box['w'] / 2.0, box['y'] + box['h'] / 2.0
+    x1 = int(round(min(max(cx - side / 2.0, 0), width - side)))
+    y1 = int(round(min(max(cy - side / 2.0, 0), height - side)))
+    return x1, y1, x1 + int(round(side)), y1 + int(round(side))
+
+
+def localize_lesions(image, max_side=512, scales=DEFAULT_SCALES, max_boxes=4, iou_thresh=0.3,
+                     s_min=40, dark_ratio=0.6, size=None):
+    """
+    Find likely lesion regions in an RGB PIL image.
+
+    The image is downscaled to at most max_side, dark saturated pixels are
+    masked, and windows of every scale are scored at all grid positions at
+    once from a summed-area table, then reduced with NMS. If nothing dark is
+    found the densest green windows are returned instead (source 'green'),
+    like auto_crop_debug.py always did.
+
+    Parameters:
+    - image: RGB PIL image (e.g. ImagePipeline.image)
+    - size: (width, height) to report boxes in; defaults to image.size
+    - scales: window sides as fractions of the shorter side
+
+    Returns a list of {'x', 'y', 'w', 'h', 'score', 'source'} dicts, best first.
+    """
+    small = downscale(image, max_side)
+    hsv = np.asarray(small.convert('HSV'))
+    if hsv.size == 0:
+        return []
+    source = 'dark'
+    boxes, scores, _ = candidate_boxes(lesion_mask(hsv, s_min, dark_ratio), scales, min_score=0.0)
+    if scores.size == 0:
+        source = 'green'
+        boxes, scores, _ = candidate_boxes(green_mask(hsv, {**FALLBACK_GREEN, 'S_MIN': s_min}), scales, min_score=0.01)
+    if scores.size == 0:
+        return []
+
+    keep = nms(boxes.astype('float64'), scores, iou_thresh=iou_thresh, max_boxes=max_boxes)
+    width, height = size or image.size
+    sx, sy = width / float(small.size[0]), height / float(small.size[1])
+    out = []
+    for i in keep:
+        x1, y1, x2, y2 = boxes[i]
+        out.append({
+            'x': int(round(x1 * sx)),
+            'y': int(round(y1 * sy)),
+            'w': int(round((x2 - x1) * sx)),
+            'h': int(round((y2 - y1) * sy)),
+            'score': round(float(scores[i]), 4),
+            'source': source,
+        })
+    return out
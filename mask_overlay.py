@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+import numpy as np
+from PIL import Image
+
+# HSV thresholds that change what the mask looks like (and therefore its cache key)
+MASK_THRESHOLD_KEYS = ('GREEN_H_MIN', 'GREEN_H_MAX', 'S_MIN', 'V_MIN')
+# Same look as the original alpha_composite overlay: green at alpha 120/255
+OVERLAY_COLOR = np.array([0, 255, 0], dtype='uint16')
+OVERLAY_ALPHA = 120
+
+
+def mask_key(thresholds):
+    """Short stable hash of the mask-relevant thresholds, used in overlay filenames and ETags."""
+    values = {k: thresholds[k] for k in MASK_THRESHOLD_KEYS}
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+
+
+def green_mask(hsv, thresholds):
+    """Boolean (H, W) mask of pixels inside the green HSV range."""
+    h = hsv[:, :, 0]
+    s = hsv[:, :, 1]
+    v = hsv[:, :, 2]
+    return ((h >= thresholds['GREEN_H_MIN']) & (h <= thresholds['GREEN_H_MAX'])
+            & (s >= thresholds['S_MIN']) & (v >= thresholds['V_MIN']))
+
+
+def downscale(image, max_side):
+    """Return `image` (RGB) shrunk so its longest side is at most max_side."""
+    if max(image.size) <= max_side:
+        return image
+    small = image.copy()
+    small.thumbnail((max_side, max_side))
+    return small
+
+
+def render_mask_overlay(image, thresholds, max_side=512):
+    """Blend the green mask over a downscaled copy of `image` with NumPy and return an RGB Image."""
+    small = downscale(image, max_side)
+    rgb = np.asarray(small)
+    mask = green_mask(np.asarray(small.convert('HSV')), thresholds)
+    # integer "over" blend with rounding, like Pillow's alpha_composite
+    blended = (rgb.astype('uint16') * (255 - OVERLAY_ALPHA) + OVERLAY_COLOR * OVERLAY_ALPHA + 127) // 255
+    out = np.where(mask[:, :, np.newaxis], blended.astype('uint8'), rgb)
+    return Image.fromarray(out, 'RGB')
+
+
+def rle_encode(mask):
+    """Compact run-length encoding of a boolean mask, row-major, starting with a run of False."""
+    flat = np.asarray(mask, dtype=bool).ravel()
+    if flat.size == 0:
+        return {'shape': list(mask.shape), 'counts': []}
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat[0]:
+        counts = [0] + counts
+    return {'shape': list(mask.shape), 'counts': counts}
+
+
+def rle_decode(rle):
+    """Inverse of rle_encode()."""
+    values = np.zeros(len(rle['counts']), dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, rle['counts'])
+    return flat.reshape(rle['shape'])
@@ -0,0 +1,258 @@
+import glob
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; fine enough for the sub-millisecond stages, wide enough for cold model loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Each process records into its own in-memory tables (one lock, a few dict
+    updates per call, so it is cheap enough for the request path). With
+    `collect_dir` set, a daemon thread snapshots the tables to
+    `<collect_dir>/metrics_<pid>.json` every `flush_interval` seconds and
+    render() merges the snapshots of every worker: counters and histograms
+    are summed, gauges are summed or maxed as declared. Snapshots of exited
+    workers keep contributing their counters, so totals never go backwards
+    when gunicorn recycles a worker; mark_process_dead() drops their gauges.
+
+    Parameters:
+    - collect_dir: shared directory for per-worker snapshots (None: this process only)
+    - flush_interval: seconds between snapshots
+    - prefix: prepended to every metric name
+    """
+
+    def __init__(self, collect_dir=None, flush_interval=1.0, prefix='tomato_'):
+        self.collect_dir = collect_dir or None
+        self.flush_interval = max(0.05, float(flush_interval))
+        self.prefix = prefix
+        self._meta = {}
+        self._counters = {}
+        self._gauges = {}
+        self._hists = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if self.collect_dir:
+            os.makedirs(self.collect_dir, exist_ok=True)
+
+    def counter(self, name, help_text):
+        self._meta[self.prefix + name] = {'type': 'counter', 'help': help_text}
+
+    def gauge(self, name, help_text, aggregate='sum'):
+        """Declare a gauge; `aggregate` ('sum' or 'max') says how worker values combine."""
+        self._meta[self.prefix + name] = {'type': 'gauge', 'help': help_text, 'aggregate': aggregate}
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._meta[self.prefix + name] = {'type': 'histogram', 'help': help_text,
+                                          'buckets': sorted(float(b) for b in buckets)}
+
+    def add_collector(self, fn):
+        """Register fn(metrics), called before every snapshot to refresh gauges (queue depth etc.)."""
+        self._collectors.append(fn)
+
+    def inc(self, name, amount=1, **labels):
+        key = (self.prefix + name, _label_key(labels))
+        self._ensure_flusher()
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (self.prefix + name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = float(value)
+
+    def observe(self, name, value, **labels):
+        full = self.prefix + name
+        key = (full, _label_key(labels))
+        buckets = self._meta[full]['buckets']
+        self._ensure_flusher()
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            i = 0
+            while i < len(buckets) and value > buckets[i]:
+                i += 1
+            hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the wall time of the with-block in seconds."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def snapshot(self):
+        """JSON-serializable copy of this process's tables (collectors refreshed first)."""
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception:
+                pass
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[n, list(k), v] for (n, k), v in self._counters.items()],
+                'gauges': [[n, list(k), v] for (n, k), v in self._gauges.items()],
+                'hists': [[n, list(k), list(h[0]), h[1], h[2]] for (n, k), h in self._hists.items()],
+            }
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.collect_dir, f'metrics_{pid or os.getpid()}.json')
+
+    def flush(self):
+        """Write this process's snapshot to collect_dir (temp file + rename, so readers never see half a file)."""
+        if not self.collect_dir:
+            return
+        data = json.dumps(self.snapshot())
+        fd, tmp = tempfile.mkstemp(dir=self.collect_dir, suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, self._snapshot_path())
+
+    def _ensure_flusher(self):
+        # Same fork-awareness as MicroBatcher: each gunicorn worker needs its own thread
+        if not self.collect_dir:
+            return
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid is not None and self._pid != pid:
+                # Counts inherited from the parent already live in the parent's snapshot
+                self._counters, self._gauges, self._hists = {}, {}, {}
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def _load_snapshots(self):
+        if not self.collect_dir:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.collect_dir, 'metrics_*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def merged(self):
+        """(counters, gauges, hists) summed over all workers, keyed by (name, labels)."""
+        counters, gauges, hists = {}, {}, {}
+        for snap in self._load_snapshots():
+            for name, key, value in snap.get('counters', []):
+                k = (name, tuple(tuple(p) for p in key))
+                counters[k] = counters.get(k, 0) + value
+            for name, key, value in snap.get('gauges', []):
+                k = (name, tuple(tuple(p) for p in key))
+                if self._meta.get(name, {}).get('aggregate') == 'max':
+                    gauges[k] = max(gauges.get(k, value), value)
+                else:
+                    gauges[k] = gauges.get(k, 0.0) + value
+            for name, key, counts, total, count in snap.get('hists', []):
+                k = (name, tuple(tuple(p) for p in key))
+                h = hists.get(k)
+                if h is None or len(h[0]) != len(counts):
+                    hists[k] = [list(counts), total, count]
+                else:
+                    h[0] = [a + b for a, b in zip(h[0], counts)]
+                    h[1] += total
+                    h[2] += count
+        return counters, gauges, hists
+
+    def render(self):
+        """All metrics, merged across workers, in the Prometheus text exposition format."""
+        counters, gauges, hists = self.merged()
+        series = {}
+        for table in (counters, gauges, hists):
+            for (name, key), value in table.items():
+                series.setdefault(name, []).append((key, value))
+        lines = []
+        for name in sorted(set(self._meta) | set(series)):
+            meta = self._meta.get(name, {'type': 'untyped', 'help': ''})
+            lines.append(f'# HELP {name} {meta["help"]}')
+            lines.append(f'# TYPE {name} {meta["type"]}')
+            for key, value in sorted(series.get(name, [])):
+                if meta['type'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, c in zip(list(meta['buckets']) + [math.inf], counts):
+                    cumulative += c
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def mark_process_dead(collect_dir, pid):
+    """Drop the gauges from an exited worker's snapshot (its counters keep counting towards totals)."""
+    path = os.path.join(collect_dir, f'metrics_{pid}.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return
+    snap['gauges'] = []
+    fd, tmp = tempfile.mkstemp(dir=collect_dir, suffix='.part')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(snap, f)
+    os.replace(tmp, path)
+
+
+def clear_collect_dir(collect_dir):
+    """Remove snapshots left over from a previous server run."""
+    for path in glob.glob(os.path.join(collect_dir, 'metrics_*.json')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -78,7 +78,9 @@ export default function App() {
         Alert.alert('Error', data.error || 'Prediction failed');
       } else {
         setResult(data);
-        if (data.mask) {
+        if (data.mask_url) {
+          setMaskUrl(`${BACKEND_URL}${data.mask_url}`);
+        } else if (data.mask) {
           setMaskUrl(`${BACKEND_URL}/static/uploads/${data.mask}`);
         }
       }
@@ -0,0 +1,345 @@
+"""Perceptual-hash index of past predictions, for near-duplicate lookups.
+
+    python perceptual_index.py --build       # (re)build the index from the debug logs and stored uploads
+    python perceptual_index.py --clusters    # report groups of near-identical images in the debug corpus
+
+Images that were recompressed or resized on the way (WhatsApp forwards)
+never match the prediction cache byte-for-byte, but their 64-bit dHash stays
+within a few bits. The index answers "is there a past prediction within
+Hamming distance r?" with multi-index hashing: the hash is cut into r + 1
+chunks, and by the pigeonhole principle any hash within distance r agrees
+exactly with the query on at least one chunk, so only entries sharing a
+chunk value are compared.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows dev servers run a single process anyway
+    fcntl = None
+
+HASH_BITS = 64
+# Flat or low-texture images (a plain wall, a solid colour) hash to nearly all 0s or 1s and would all
+# match each other; hashes with fewer set (or unset) bits than this are neither stored nor looked up
+MIN_SET_BITS = 8
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of a PIL image: brightness gradients along each row of a 9x8 grayscale thumbnail."""
+    small = np.asarray(image.convert('L').resize((size + 1, size), Image.BILINEAR), dtype='int16')
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def is_distinctive(h):
+    """True if a dHash carries enough gradient structure to identify an image."""
+    return MIN_SET_BITS <= bin(h).count('1') <= HASH_BITS - MIN_SET_BITS
+
+
+class MultiIndexHash:
+    """
+    Hamming-radius search over 64-bit hashes by multi-index hashing.
+
+    Parameters:
+    - max_distance: largest radius search() supports; the hash is split into max_distance + 1 chunks
+    """
+
+    def __init__(self, max_distance=4):
+        self.max_distance = max(0, int(max_distance))
+        chunks = min(self.max_distance + 1, HASH_BITS)
+        bounds = np.linspace(0, HASH_BITS, chunks + 1).astype(int)
+        self._chunks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self._tables = [{} for _ in self._chunks]
+        self.hashes = []
+        self.items = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, h, item):
+        idx = len(self.hashes)
+        self.hashes.append(h)
+        self.items.append(item)
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            table.setdefault((h >> shift) & mask, []).append(idx)
+        return idx
+
+    def search(self, h, max_distance=None):
+        """[(distance, index)] of stored hashes within max_distance of h, nearest (then oldest) first."""
+        r = self.max_distance if max_distance is None else min(int(max_distance), self.max_distance)
+        candidates = set()
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            candidates.update(table.get((h >> shift) & mask, ()))
+        found = [(hamming(h, self.hashes[i]), i) for i in candidates]
+        return sorted((d, i) for d, i in found if d <= r)
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate index of past predictions, shared by workers through an append-only JSONL file.
+
+    Each line is one prediction: its dHash, a `context` string (model and
+    thresholds, as in PredictionCache keys, so a retrained model or new
+    thresholds never reuse old answers), the upload it came from and the
+    result. add() appends a line; every worker picks up lines written by the
+    others the next time it searches.
+
+    Once the file holds a quarter more than `max_entries` lines, the worker
+    that notices rewrites it with the newest `max_entries` (under an flock
+    on `<path>.lock`, which appends hold shared) and swaps it in with a
+    rename; the others see the new inode and reload.
+
+    Parameters:
+    - path: the JSONL file (None keeps the index in memory only)
+    - max_distance: Hamming radius for lookup() and clusters()
+    - max_entries: entries kept after compaction (0 = unbounded)
+    """
+
+    def __init__(self, path=None, max_distance=4, max_entries=0):
+        self.path = path
+        self.max_distance = int(max_distance)
+        self.max_entries = max(0, int(max_entries))
+        self._lock = threading.Lock()
+        self._index = MultiIndexHash(self.max_distance)
+        self._offset = 0
+        self._inode = None
+        self.compactions = 0
+        self.hits = 0
+        self.misses = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __len__(self):
+        return len(self._index)
+
+    def refresh(self):
+        """Load lines appended since the last call (by any worker), or reload a compacted file."""
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if st.st_ino == self._inode and st.st_size <= self._offset:
+            return
+        with self._lock:
+            try:
+                f = open(self.path, 'rb')
+            except OSError:
+                return
+            with f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._inode or st.st_size < self._offset:
+                    # first load, or the file was compacted or rebuilt under us
+                    self._index = MultiIndexHash(self.max_distance)
+                    self._offset, self._inode = 0, st.st_ino
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # a line still being written; read it next time
+                    self._offset += len(line)
+                    try:
+                        record = json.loads(line)
+                        h = int(record['hash'], 16)
+                        if is_distinctive(h):  # written before flat hashes were excluded
+                            self._index.add(h, record)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+    @contextmanager
+    def _file_lock(self, exclusive=False):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _over_limit(self):
+        return self.max_entries and len(self._index) > self.max_entries + self.max_entries // 4
+
+    def add(self, h, context, result, upload_id=None, filename=None, ts=None):
+        """Record a prediction under its dHash; returns the record, or None for a non-distinctive hash."""
+        if not is_distinctive(h):
+            return None
+        record = {'hash': f'{h:016x}', 'context': context, 'upload_id': upload_id, 'filename': filename,
+                  'ts': round(ts or time.time(), 3), 'result': result}
+        if not self.path:
+            with self._lock:
+                self._index.add(h, record)
+                if self._over_limit():
+                    newest = MultiIndexHash(self.max_distance)
+                    for kept_h, kept in zip(self._index.hashes[-self.max_entries:],
+                                            self._index.items[-self.max_entries:]):
+                        newest.add(kept_h, kept)
+                    self._index = newest
+                    self.compactions += 1
+            return record
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._file_lock():
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        self.refresh()
+        if self._over_limit():
+            self.compact()
+        return record
+
+    def compact(self):
+        """Rewrite the index file with its newest max_entries lines; returns how many were dropped."""
+        with self._file_lock(exclusive=True):
+            try:
+                with open(self.path, 'rb') as f:
+                    lines = [line for line in f if line.endswith(b'\n')]
+            except OSError:
+                return 0
+            if len(lines) <= self.max_entries:
+                return 0  # another worker compacted it already
+            keep = lines[-self.max_entries:]
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                f.writelines(keep)
+            os.replace(tmp, self.path)
+        self.compactions += 1
+        self.refresh()
+        return len(lines) - len(keep)
+
+    def lookup(self, h, context, max_distance=None):
+        """Nearest past prediction under `context` as (distance, record), or None."""
+        if not is_distinctive(h):
+            with self._lock:
+                self.misses += 1
+            return None
+        self.refresh()
+        with self._lock:
+            for distance, i in self._index.search(h, max_distance):
+                record = self._index.items[i]
+                if record.get('context') == context:
+                    self.hits += 1
+                    return distance, record
+            self.misses += 1
+        return None
+
+    def clusters(self, max_distance=None, min_size=2):
+        """Groups of entries whose hashes are chained within max_distance (union-find), largest first."""
+        self.refresh()
+        # cluster a snapshot so lookups from request threads are not blocked meanwhile
+        with self._lock:
+            hashes, items = list(self._index.hashes), list(self._index.items)
+        index = MultiIndexHash(self.max_distance)
+        for h, item in zip(hashes, items):
+            index.add(h, item)
+        n = len(index)
+        parent = list(range(n))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, h in enumerate(index.hashes):
+            for _, j in index.search(h, max_distance):
+                ri, rj = find(i), find(j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+        groups = {}
+        for i in range(n):
+            groups.setdefault(find(i), []).append(index.items[i])
+        out = [g for g in groups.values() if len(g) >= min_size]
+        return sorted(out, key=len, reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._index), 'max_entries': self.max_entries, 'max_distance': self.max_distance,
+                    'compactions': self.compactions, 'hits': self.hits, 'misses': self.misses}
+
+
+def build(index_path, log_path, store, debug_dir, context, max_side=256, max_entries=0):
+    """Rebuild the index file from the debug-log predictions made under `context` whose image is still on disk.
+
+    Entries logged by another model or threshold set (or before the log recorded a context) are skipped:
+    their results would otherwise be served as if the current model had produced them.
+    """
+    from debug_analysis import iter_chunks, log_paths
+    from image_pipeline import ImagePipeline
+
+    tmp_path = index_path + '.part'
+    open(tmp_path, 'w').close()
+    index = PerceptualIndex(tmp_path, max_distance=0, max_entries=max_entries)
+    seen, missing, other_context = set(), 0, 0
+    for chunk in iter_chunks(log_paths(log_path, rotated=True)):
+        for entry in chunk:
+            if not entry or 'prediction' not in entry:
+                continue
+            if entry.get('context') != context:
+                other_context += 1
+                continue
+            upload_id, filename = entry.get('upload_id'), entry.get('filename')
+            image_path = store.path(upload_id) if upload_id else os.path.join(debug_dir, filename or '')
+            if (upload_id or filename) in seen:
+                continue
+            try:
+                image = ImagePipeline.from_path(image_path, max_side=max_side).image
+            except (OSError, ValueError):
+                missing += 1
+                continue
+            seen.add(upload_id or filename)
+            result = {k: entry[k] for k in ('prediction', 'confidence', 'uncertain', 'raw_predictions')
+                      if k in entry}
+            index.add(dhash(image), context, {'leaf': True, **result}, upload_id=upload_id,
+                      filename=filename, ts=entry.get('ts'))
+    os.replace(tmp_path, index_path)
+    if os.path.exists(tmp_path + '.lock'):
+        os.remove(tmp_path + '.lock')
+    return {'entries': len(index), 'missing_images': missing, 'other_context': other_context}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--build', action='store_true', help='rebuild the index from the debug logs')
+    parser.add_argument('--clusters', action='store_true', help='print near-duplicate clusters')
+    parser.add_argument('--max-distance', type=int, help='Hamming radius (default PHASH_MAX_DISTANCE)')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    import app
+    max_distance = app.PHASH_MAX_DISTANCE if args.max_distance is None else args.max_distance
+    if args.build:
+        summary = build(app.PHASH_INDEX_PATH, app.DEBUG_LOG, app.upload_store, app.DEBUG_DIR, app.phash_context(),
+                        max_entries=app.PHASH_MAX_ENTRIES)
+        print(f"Indexed {summary['entries']} past predictions ({summary['missing_images']} images missing, "
+              f"{summary['other_context']} from another model or thresholds) into {app.PHASH_INDEX_PATH}")
+    if args.clusters:
+        groups = PerceptualIndex(app.PHASH_INDEX_PATH, max_distance).clusters()
+        if args.json:
+            print(json.dumps(groups, indent=2))
+            return
+        for n, group in enumerate(groups, 1):
+            labels = sorted({r['result'].get('prediction') for r in group})
+            print(f"Cluster {n}: {len(group)} images, predictions {', '.join(map(str, labels))}")
+            for r in group:
+                print(f"  {r['hash']}  {r.get('filename') or '-'}  {r.get('upload_id') or '-'}")
+        print(f"{len(groups)} clusters within distance {max_distance}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of prediction results.
+
+    Keys combine the SHA-256 of the uploaded bytes with the identity of the
+    model files and the decision thresholds, so a retrained model or an admin
+    threshold change never serves a stale answer. Entries live in a bounded
+    in-memory LRU and, when `disk_dir` is set, also as small JSON files that
+    every gunicorn worker sharing the directory can read.
+
+    Parameters:
+    - max_entries: in-memory LRU size (0 disables the memory tier)
+    - disk_dir: optional directory for the shared on-disk tier
+    """
+
+    def __init__(self, max_entries=512, disk_dir=None):
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or bool(self.disk_dir)
+
+    @staticmethod
+    def make_key(data, model_id, thresholds):
+        """Key for `data` (upload bytes) under a given model identity and threshold set."""
+        h = hashlib.sha256(data)
+        h.update(json.dumps([model_id, thresholds], sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f'{key}.json')
+
+    def get(self, key):
+        """Return the cached result for `key`, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = None
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+            except (OSError, ValueError):
+                value = None
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # write-then-rename so other workers never read a half-written file
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(value, f)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"Prediction cache write failed: {e}")
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop the in-memory tier. On-disk entries are keyed by thresholds and model, so they
+        simply stop matching once either changes."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'max_entries': self.max_entries,
+                'entries': len(self._entries),
+                'disk_dir': self.disk_dir,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
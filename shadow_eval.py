@@ -0,0 +1,390 @@
+"""Shadow evaluation of a candidate classifier against the primary one.
+
+    python shadow_eval.py --report                                  # summarize the live shadow log
+    python shadow_eval.py --replay --candidate models/candidate.h5  # same report over the debug corpus
+
+Live: with SHADOW_MODEL_PATH set to a .tflite model, a sampled SHADOW_SAMPLE_RATE of classified
+uploads is queued (after the primary prediction, with its tensors) for a
+background thread that runs the candidate, compares the two and appends one
+line per upload to SHADOW_LOG. The thread is throttled to SHADOW_CPU_SHARE of
+wall time and the queue is bounded, so the candidate can fall behind (and
+drop samples) but never holds up a request.
+
+Replay: every logged prediction whose upload is still in the store is scored
+by both models on the same tensors, and the records are written and reported
+in the same format.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+
+def compare(primary_row, candidate_row, labels, conf_thresh):
+    """One shadow record: top-1 agreement, confidence deltas and the Uncertain decision of both models."""
+    p, c = int(np.argmax(primary_row)), int(np.argmax(candidate_row))
+    p_conf, c_conf = float(primary_row[p]), float(candidate_row[c])
+    return {
+        'primary': labels[p],
+        'candidate': labels[c],
+        'agree': p == c,
+        'primary_confidence': round(p_conf * 100, 2),
+        'candidate_confidence': round(c_conf * 100, 2),
+        # top-1 confidence of each model, and how the candidate scores the primary's class
+        'confidence_delta': round((c_conf - p_conf) * 100, 2),
+        'primary_class_delta': round((float(candidate_row[p]) - p_conf) * 100, 2),
+        'primary_uncertain': p_conf < conf_thresh,
+        'candidate_uncertain': c_conf < conf_thresh,
+    }
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    if not values:
+        return {f'p{q}': None for q in qs}
+    return {f'p{q}': round(float(v), 2) for q, v in zip(qs, np.percentile(values, qs))}
+
+
+class ShadowReport:
+    """
+    Running summary of shadow records: agreement, confidence deltas, latency and the commonest disagreements.
+
+    Parameters:
+    - max_samples: latency and delta samples kept for percentiles (most recent; None keeps all)
+    """
+
+    def __init__(self, max_samples=10000):
+        self.n = 0
+        self.agree = 0
+        self.uncertain_flips = Counter()
+        self.disagreements = Counter()
+        self.delta_sum = 0.0
+        self.abs_delta_sum = 0.0
+        self.primary_class_delta_sum = 0.0
+        self.deltas = deque(maxlen=max_samples)
+        self.primary_ms = deque(maxlen=max_samples)
+        self.candidate_ms = deque(maxlen=max_samples)
+
+    def add(self, record):
+        self.n += 1
+        self.agree += int(record['agree'])
+        if not record['agree']:
+            self.disagreements[(record['primary'], record['candidate'])] += 1
+        if record['primary_uncertain'] != record['candidate_uncertain']:
+            self.uncertain_flips['to_uncertain' if record['candidate_uncertain'] else 'to_confident'] += 1
+        self.delta_sum += record['confidence_delta']
+        self.abs_delta_sum += abs(record['confidence_delta'])
+        self.primary_class_delta_sum += record['primary_class_delta']
+        self.deltas.append(record['confidence_delta'])
+        if record.get('primary_ms') is not None:
+            self.primary_ms.append(record['primary_ms'])
+        if record.get('candidate_ms') is not None:
+            self.candidate_ms.append(record['candidate_ms'])
+
+    def summary(self, top=5):
+        n = self.n or 1
+        return {
+            'compared': self.n,
+            'agreement': round(self.agree / n, 4) if self.n else None,
+            'uncertain_flips': dict(self.uncertain_flips),
+            'confidence_delta_mean': round(self.delta_sum / n, 2),
+            'confidence_delta_abs_mean': round(self.abs_delta_sum / n, 2),
+            'primary_class_delta_mean': round(self.primary_class_delta_sum / n, 2),
+            'confidence_delta': percentiles(self.deltas, (5, 50, 95)),
+            'primary_ms': percentiles(self.primary_ms),
+            'candidate_ms': percentiles(self.candidate_ms),
+            'top_disagreements': [{'primary': p, 'candidate': c, 'count': k}
+                                  for (p, c), k in self.disagreements.most_common(top)],
+        }
+
+
+def append_records(path, records):
+    """Append records as JSONL with one O_APPEND write, so several workers can share the file."""
+    data = ''.join(json.dumps(r) + '\n' for r in records).encode('utf-8')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class ShadowEvaluator:
+    """
+    Runs a candidate model on a sample of live uploads, off the request path.
+
+    Request handlers call should_sample() and then submit(), which only puts
+    the already-computed classifier inputs and the primary's probability row
+    on a bounded queue. A daemon thread (one per worker process, started on
+    first use) loads the candidate, runs it, and appends a compare() record to
+    `log_path`. After each candidate call the thread sleeps long enough that
+    it is busy at most `cpu_share` of the time; when it falls behind, new
+    samples are dropped and counted.
+
+    Parameters:
+    - load_candidate: callable returning an object with predict(), or None if the candidate is missing
+    - aggregate: turns the candidate's rows for one upload (full frame + crops) into one row
+    - labels / conf_thresh: class names and the Uncertain threshold used in the records
+    - log_path: JSONL file for the records (None keeps them in memory only)
+    - sample_rate: fraction of classified uploads sent to the candidate
+    - cpu_share: largest fraction of wall time the shadow thread may spend predicting
+    - max_queue: samples waiting for the candidate before new ones are dropped
+    """
+
+    def __init__(self, load_candidate, aggregate, labels, conf_thresh, log_path=None, sample_rate=0.1,
+                 cpu_share=0.25, max_queue=16):
+        self.load_candidate = load_candidate
+        self.aggregate = aggregate
+        self.labels = labels
+        self.conf_thresh = conf_thresh
+        self.log_path = log_path
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.cpu_share = min(max(float(cpu_share), 0.01), 1.0)
+        self.max_queue = max(1, int(max_queue))
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._candidate = None
+        self.load_error = None
+        self.report = ShadowReport()
+        self.submitted = 0
+        self.dropped = 0
+        self.errors = 0
+        self.throttled_s = 0.0
+
+    def should_sample(self):
+        return self.sample_rate > 0 and self.load_error is None and random.random() < self.sample_rate
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._candidate = None
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='shadow-eval', daemon=True)
+            self._thread.start()
+
+    def submit(self, inputs, primary_row, primary_ms=None, upload_id=None, endpoint=None):
+        """Queue one classified upload for the candidate; returns False if it was dropped."""
+        self._ensure_worker()
+        item = {'inputs': inputs, 'primary_row': np.asarray(primary_row, dtype='float32'),
+                'primary_ms': primary_ms, 'upload_id': upload_id, 'endpoint': endpoint, 'ts': time.time()}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """Block until every submitted sample has been evaluated (used by tests)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self.report.n + self.errors >= self.submitted:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def _run(self):
+        _lower_thread_priority()
+        while True:
+            item = self._queue.get()
+            busy = self._evaluate(item)
+            # Duty cycle: `busy` seconds of work buys busy * (1/share - 1) seconds of rest
+            rest = busy * (1.0 / self.cpu_share - 1.0)
+            if rest > 0:
+                time.sleep(rest)
+                with self._lock:
+                    self.throttled_s += rest
+
+    def _evaluate(self, item):
+        t0 = time.perf_counter()
+        try:
+            if self._candidate is None:
+                self._candidate = self.load_candidate()
+                if self._candidate is None:
+                    raise RuntimeError('candidate model could not be loaded')
+            t1 = time.perf_counter()
+            row = self.aggregate(np.asarray(self._candidate.predict(item['inputs'])))
+            candidate_ms = (time.perf_counter() - t1) * 1000.0
+            record = {
+                'ts': round(item['ts'], 3),
+                'endpoint': item['endpoint'],
+                'upload_id': item['upload_id'],
+                **compare(item['primary_row'], row, self.labels, self.conf_thresh),
+                'primary_ms': None if item['primary_ms'] is None else round(item['primary_ms'], 2),
+                'candidate_ms': round(candidate_ms, 2),
+            }
+            if self.log_path:
+                append_records(self.log_path, [record])
+            with self._lock:
+                self.report.add(record)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                if self._candidate is None and self.load_error is None:
+                    self.load_error = str(e)
+                    print(f"Shadow model disabled: {e}")
+                elif self.load_error is None:
+                    print(f"Shadow evaluation failed: {e}")
+        return time.perf_counter() - t0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'cpu_share': self.cpu_share,
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'load_error': self.load_error,
+                'throttled_s': round(self.throttled_s, 2),
+                **self.report.summary(),
+            }
+
+
+def _lower_thread_priority():
+    """Best effort: run the calling thread at the lowest CPU priority (Linux only).
+
+    Only this thread is affected. The candidate's TFLite interpreter runs on the same thread with
+    num_threads=1; threads from other pools (e.g. TensorFlow's intra-op pool) keep their priority.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+def replay(app, candidate, log_path, store, limit=None, out=None):
+    """Score every logged upload still in the store with both models; returns a ShadowReport."""
+    from debug_analysis import iter_chunks, log_paths
+    from image_pipeline import ImagePipeline
+
+    primary = app.get_model()
+    report = ShadowReport()
+    seen = set()
+    records = []
+    for chunk in iter_chunks(log_paths(log_path, rotated=True)):
+        for entry in chunk:
+            upload_id = (entry or {}).get('upload_id')
+            if not upload_id or upload_id in seen or 'prediction' not in entry:
+                continue
+            seen.add(upload_id)
+            try:
+                inputs = app.classifier_inputs(ImagePipeline.from_path(store.path(upload_id)))
+            except (OSError, ValueError):
+                continue
+            t0 = time.perf_counter()
+            primary_row = app.aggregate_crops(np.asarray(primary.predict(inputs)))
+            t1 = time.perf_counter()
+            candidate_row = app.aggregate_crops(np.asarray(candidate.predict(inputs)))
+            t2 = time.perf_counter()
+            record = {
+                'ts': entry.get('ts'),
+                'endpoint': 'replay',
+                'upload_id': upload_id,
+                **compare(primary_row, candidate_row, app.class_labels, app.CONF_THRESH),
+                'primary_ms': round((t1 - t0) * 1000.0, 2),
+                'candidate_ms': round((t2 - t1) * 1000.0, 2),
+            }
+            report.add(record)
+            records.append(record)
+            if out and len(records) >= 256:
+                append_records(out, records)
+                records = []
+            if limit and report.n >= limit:
+                break
+        if limit and report.n >= limit:
+            break
+    if out and records:
+        append_records(out, records)
+    return report
+
+
+def print_report(s, title):
+    print(title)
+    if not s['compared']:
+        print('  nothing compared yet')
+        return
+    print(f"  compared: {s['compared']}, top-1 agreement: {s['agreement'] * 100:.1f}%")
+    flips = s['uncertain_flips']
+    print(f"  Uncertain flips: {flips.get('to_uncertain', 0)} became uncertain, "
+          f"{flips.get('to_confident', 0)} became confident")
+    d = s['confidence_delta']
+    print(f"  confidence delta (candidate - primary, points): mean {s['confidence_delta_mean']:+.2f}, "
+          f"mean |delta| {s['confidence_delta_abs_mean']:.2f}, p5/p50/p95 {d['p5']}/{d['p50']}/{d['p95']}")
+    print(f"  candidate on the primary's class: mean {s['primary_class_delta_mean']:+.2f} points")
+    for name in ('primary_ms', 'candidate_ms'):
+        p = s[name]
+        print(f"  {name.replace('_ms', '')} latency ms p50/p95/p99: {p['p50']}/{p['p95']}/{p['p99']}")
+    for row in s['top_disagreements']:
+        print(f"  {row['count']:6d}  {row['primary']} -> {row['candidate']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--report', nargs='?', const='', metavar='LOG',
+                        help='summarize a shadow log (default SHADOW_LOG)')
+    parser.add_argument('--replay', action='store_true', help='score the debug corpus with both models')
+    parser.add_argument('--candidate', help='candidate model for --replay (default SHADOW_MODEL_PATH)')
+    parser.add_argument('--limit', type=int, help='compare at most N uploads')
+    parser.add_argument('--out', help='also write the replay records to this JSONL file')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+    if args.report is None and not args.replay:
+        parser.error('choose --report or --replay')
+
+    import app
+    if args.replay:
+        path = args.candidate or app.SHADOW_MODEL_PATH
+        if not path:
+            parser.error('--replay needs --candidate or SHADOW_MODEL_PATH')
+        if app.get_model() is None:
+            raise SystemExit('Primary model not found.')
+        candidate = app.load_shadow_model(path)
+        if candidate is None:
+            raise SystemExit(f'Candidate model not found: {path}')
+        summary = replay(app, candidate, app.DEBUG_LOG, app.upload_store, limit=args.limit, out=args.out).summary()
+        title = f'Replay of the debug corpus: {app.MODEL_PATH} vs {path}'
+    else:
+        log = args.report or app.SHADOW_LOG
+        report = ShadowReport(max_samples=None)
+        if os.path.exists(log):
+            for record in read_records(log):
+                report.add(record)
+        summary = report.summary()
+        title = f'Shadow log {log}'
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary, title)
+
+
+if __name__ == '__main__':
+    main()
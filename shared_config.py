@@ -0,0 +1,117 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev servers run a single process anyway
+    fcntl = None
+
+# An immutable view of the thresholds: a request that holds one never sees a half-applied update
+ConfigSnapshot = namedtuple('ConfigSnapshot', ['version', 'values'])
+
+_GEN = struct.Struct('<Q')
+
+
+class SharedConfig:
+    """
+    Admin-tunable settings shared by every worker process on the host.
+
+    The values persist in `path` as JSON (written to a temp file and renamed,
+    with a `config_version` field). A sibling `<path>.gen` file holds an
+    8-byte generation counter that every worker memory-maps, so checking for
+    a change is one read from shared memory, with no stat or JSON parse. Only
+    when the counter moves does a worker re-read the JSON and swap in a new
+    ConfigSnapshot.
+
+    Parameters:
+    - path: JSON file the values are persisted to (e.g. config.json)
+    - defaults: {name: default value}; each value's type (int/float) is used to coerce updates
+    """
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.gen_path = path + '.gen'
+        self.defaults = dict(defaults)
+        self._lock = threading.Lock()
+        self._fd = os.open(self.gen_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < _GEN.size:
+            os.ftruncate(self._fd, _GEN.size)
+        self._mm = mmap.mmap(self._fd, _GEN.size)
+        # (generation seen, snapshot) swapped as one object
+        self._state = (None, None)
+
+    def generation(self):
+        return _GEN.unpack_from(self._mm, 0)[0]
+
+    def current(self):
+        """The latest ConfigSnapshot; re-reads the JSON only if another process bumped the generation."""
+        gen = self.generation()
+        seen, snapshot = self._state
+        if snapshot is not None and seen == gen:
+            return snapshot
+        with self._lock:
+            seen, snapshot = self._state
+            if snapshot is None or seen != gen:
+                snapshot = self._load()
+                self._state = (gen, snapshot)
+            return snapshot
+
+    def _coerce(self, name, value):
+        return type(self.defaults[name])(value)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cfg = json.load(f)
+        except (OSError, ValueError):
+            cfg = {}
+        values = {}
+        for name, default in self.defaults.items():
+            try:
+                values[name] = self._coerce(name, cfg.get(name, default))
+            except (TypeError, ValueError):
+                values[name] = default
+        return ConfigSnapshot(int(cfg.get('config_version', 0)), values)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        # A fresh open file description per call: forked workers share self._fd's, and flock
+        # does not exclude processes holding the same description
+        fd = os.open(self.gen_path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def update(self, changes):
+        """Apply `changes` (unknown keys ignored), persist them and publish a new generation.
+
+        Raises ValueError if a value cannot be coerced; nothing is written in that case.
+        """
+        with self._lock, self._file_lock():
+            current = self._load()
+            values = dict(current.values)
+            for name, value in changes.items():
+                if name in self.defaults:
+                    values[name] = self._coerce(name, value)
+            version = max(current.version, self.generation()) + 1
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.part')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({**values, 'config_version': version}, f)
+            os.replace(tmp, self.path)
+            # Publish only after the file is in place, so a worker that sees the
+            # new generation always reads the new values
+            _GEN.pack_into(self._mm, 0, version)
+            snapshot = ConfigSnapshot(version, values)
+            self._state = (version, snapshot)
+            return snapshot
@@ -0,0 +1,61 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeModel:
+    """Stand-in for a Keras model: records input shapes and returns fixed rows."""
+
+    def __init__(self, row):
+        self.row = np.asarray(row, dtype='float32')
+        self.calls = []
+
+    def predict(self, batch, **kwargs):
+        self.calls.append(batch.shape)
+        return np.tile(self.row, (batch.shape[0], 1))
+
+
+def make_image_bytes(size=(640, 480), color=(40, 160, 40), fmt='JPEG'):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    """The app module with uploads/debug redirected to tmp_path and no models loaded."""
+    import app as app_module
+    uploads = tmp_path / 'uploads'
+    debug = uploads / 'debug'
+    debug.mkdir(parents=True)
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(uploads))
+    monkeypatch.setattr(app_module, 'DEBUG_DIR', str(debug))
+    monkeypatch.setattr(app_module, 'DEBUG_LOG', str(debug / 'debug_logs.jsonl'))
+    monkeypatch.setattr(app_module, 'debug_writer',
+                        app_module.DebugWriter(str(debug / 'debug_logs.jsonl'), str(debug), flush_interval=0))
+    monkeypatch.setattr(app_module, 'upload_store', app_module.UploadStore(str(uploads / 'store')))
+    monkeypatch.setattr(app_module, 'phash_index', app_module.PerceptualIndex(str(debug / 'phash_index.jsonl')))
+    monkeypatch.setattr(app_module, 'model', None)
+    monkeypatch.setattr(app_module, 'leaf_detector', None)
+    monkeypatch.setattr(app_module, 'load_leaf_detector', lambda: None)
+    monkeypatch.setattr(app_module, 'prediction_cache', app_module.PredictionCache(max_entries=16))
+    monkeypatch.setattr(app_module, 'shared_config',
+                        app_module.SharedConfig(str(tmp_path / 'config.json'), app_module.shared_config.defaults))
+    monkeypatch.setattr(app_module, 'metrics', app_module.create_metrics())
+    return app_module
+
+
+@pytest.fixture
+def classifier(app_module, monkeypatch):
+    """A fake 10-class classifier that is confident in class 1 (Early_blight)."""
+    row = np.full(10, 0.01, dtype='float32')
+    row[1] = 0.91
+    fake = FakeModel(row)
+    monkeypatch.setattr(app_module, 'load_model', lambda: fake)
+    return fake
@@ -0,0 +1,30 @@
+import io
+import os
+
+from conftest import make_image_bytes
+
+
+def post_image(client, data, name='leaf.jpg', url='/api/predict'):
+    return client.post(url, data={'file': (io.BytesIO(data), name)},
+                       content_type='multipart/form-data')
+
+
+def test_predict_returns_top_class_and_saves_upload(app_module, classifier):
+    client = app_module.app.test_client()
+    resp = post_image(client, make_image_bytes((2000, 1500)))
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['prediction'] == 'Early_blight'
+    assert data['confidence'] == 91.0
+    assert classifier.calls == [(1, 224, 224, 3)]
+    assert data['filename'] == 'leaf.jpg'
+    assert os.path.exists(app_module.upload_store.path(data['upload_id']))
+
+
+def test_non_leaf_upload_is_rejected_without_touching_disk(app_module, classifier):
+    client = app_module.app.test_client()
+    resp = post_image(client, make_image_bytes(color=(200, 30, 200)), name='sofa.jpg')
+    assert resp.status_code == 400
+    assert 'tomato leaf' in resp.get_json()['error']
+    assert classifier.calls == []
+    assert app_module.upload_store.stats()['uploads'] == 0
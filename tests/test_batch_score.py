@@ -0,0 +1,68 @@
+import csv
+import json
+
+import pytest
+
+import batch_score
+from conftest import make_image_bytes
+
+
+@pytest.fixture
+def photos(tmp_path):
+    root = tmp_path / 'photos'
+    (root / 'b').mkdir(parents=True)
+    (root / 'a.jpg').write_bytes(make_image_bytes())
+    (root / 'b' / 'c.jpg').write_bytes(make_image_bytes(color=(200, 40, 40)))
+    (root / 'b' / 'd.png').write_bytes(make_image_bytes(fmt='PNG'))
+    (root / 'broken.jpg').write_bytes(b'not an image')
+    (root / 'notes.txt').write_text('skip me')
+    return root
+
+
+@pytest.fixture
+def scorer(app_module, classifier, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'INFERENCE_BACKEND', 'keras')
+    monkeypatch.setattr(app_module, 'LEAF_DETECTOR_PATH', str(tmp_path / 'missing.h5'))
+    monkeypatch.setattr(app_module, 'is_leaf_pipeline', lambda p: p.image.getpixel((0, 0))[1] > 100)
+    return classifier
+
+
+def read_jsonl(path):
+    return [json.loads(line) for line in open(path)]
+
+
+def test_scores_every_image_in_batches(scorer, photos, tmp_path):
+    out = str(tmp_path / 'scores.jsonl')
+    summary = batch_score.run(str(photos), out, workers=1, batch_size=2, progress_every=0)
+
+    rows = {r['path'].replace(str(photos), ''): r for r in read_jsonl(out)}
+    assert sorted(rows) == ['/a.jpg', '/b/c.jpg', '/b/d.png', '/broken.jpg']
+    assert rows['/a.jpg']['prediction'] == 'Early_blight'
+    assert rows['/b/c.jpg'] == {'path': str(photos / 'b' / 'c.jpg'), 'leaf': False}
+    assert 'readable image' in rows['/broken.jpg']['error']
+    assert (summary['scored'], summary['not_leaf'], summary['errors']) == (2, 1, 1)
+    assert len(scorer.calls) == 2
+
+
+def test_resume_skips_scored_images_and_drops_a_partial_line(scorer, photos, tmp_path):
+    out = tmp_path / 'scores.jsonl'
+    batch_score.run(str(photos), str(out), workers=1, batch_size=8, limit=2, progress_every=0)
+    with open(out, 'a') as f:
+        f.write('{"path": "half-writ')
+
+    summary = batch_score.run(str(photos), str(out), workers=1, batch_size=8, progress_every=0)
+    assert summary['skipped_already_scored'] == 2
+    assert summary['processed'] == 2 == summary['scored'] + summary['errors'] + summary['not_leaf']
+    paths = [r['path'] for r in read_jsonl(out)]
+    assert len(paths) == len(set(paths)) == 4
+
+
+def test_csv_output(scorer, photos, tmp_path):
+    out = str(tmp_path / 'scores.csv')
+    batch_score.run(str(photos), out, workers=1, progress_every=0)
+    rows = list(csv.DictReader(open(out, newline='')))
+    assert len(rows) == 4
+    assert rows[0]['path'].endswith('a.jpg') and rows[0]['prediction'] == 'Early_blight'
+
+    summary = batch_score.run(str(photos), out, workers=1, progress_every=0)
+    assert summary['processed'] == 0
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+
+from batcher import MicroBatcher
+
+
+def test_concurrent_requests_share_a_forward_pass():
+    calls = []
+
+    def predict(batch):
+        calls.append(len(batch))
+        # echo each row's mean so callers can check they got their own row
+        return batch.reshape(len(batch), -1).mean(axis=1, keepdims=True)
+
+    b = MicroBatcher(predict, max_batch_size=4, max_wait_ms=50)
+    results = {}
+
+    def worker(i):
+        x = np.full((1, 2, 2, 3), float(i), dtype='float32')
+        results[i] = b.predict(x)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(4):
+        assert results[i].shape == (1, 1)
+        assert results[i][0][0] == float(i)
+    assert sum(calls) == 4
+    assert len(calls) < 4
+    stats = b.stats()
+    assert stats['requests'] == 4
+    assert stats['batches'] == len(calls)
+
+
+def test_errors_are_returned_to_every_caller():
+    def predict(batch):
+        raise ValueError('boom')
+
+    b = MicroBatcher(predict, max_batch_size=2, max_wait_ms=1)
+    try:
+        b.predict(np.zeros((1, 3), dtype='float32'))
+    except ValueError as e:
+        assert str(e) == 'boom'
+    else:
+        raise AssertionError('expected the model error to propagate')
+
+
+def test_concurrent_first_requests_create_one_batcher(monkeypatch):
+    import app as app_module
+    created = []
+
+    class CountingBatcher(MicroBatcher):
+        def __init__(self, *args, **kwargs):
+            created.append(self)
+            threading.Event().wait(0.05)  # widen the window between the check and the assignment
+            super().__init__(*args, **kwargs)
+
+    class FakeModel:
+        def predict(self, batch):
+            return np.zeros((len(batch), 10), dtype='float32')
+
+    monkeypatch.setattr(app_module, 'BATCH_ENABLED', True)
+    monkeypatch.setattr(app_module, 'MicroBatcher', CountingBatcher)
+    monkeypatch.setattr(app_module, 'batcher', None)
+    monkeypatch.setattr(app_module, 'model', FakeModel())
+    x = np.zeros((1, 224, 224, 3), dtype='float32')
+    threads = [threading.Thread(target=app_module.run_classifier, args=(x,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 1 and app_module.batcher is created[0]
+
+
+def test_full_queue_runs_the_call_directly_instead_of_waiting():
+    release = threading.Event()
+    calls = []
+
+    def predict(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            release.wait(5)
+        return np.zeros((len(batch), 2))
+
+    b = MicroBatcher(predict, max_batch_size=1, max_wait_ms=0, max_queue=1)
+    x = np.zeros((1, 2), dtype='float32')
+    first = threading.Thread(target=b.predict, args=(x,))
+    first.start()
+    while not calls:
+        time.sleep(0.005)
+    queued = threading.Thread(target=b.predict, args=(x,))  # fills the queue
+    queued.start()
+    while b.stats()['queue_depth'] < 1:
+        time.sleep(0.005)
+    t0 = time.perf_counter()
+    assert b.predict(x).shape == (1, 2)
+    assert time.perf_counter() - t0 < 1.0
+    assert b.stats()['bypassed'] == 1
+    release.set()
+    first.join()
+    queued.join()
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from compress_images import compact
+
+
+def noisy_jpeg(path, size=(1600, 1200)):
+    arr = np.random.RandomState(0).randint(0, 255, (size[1], size[0], 3), dtype='uint8')
+    Image.fromarray(arr).save(path, format='JPEG', quality=95)
+
+
+def test_compacts_once_and_skips_on_rerun(tmp_path):
+    (tmp_path / 'debug').mkdir()
+    noisy_jpeg(tmp_path / 'a.jpg')
+    noisy_jpeg(tmp_path / 'debug' / 'b.jpg')
+    before = os.path.getsize(tmp_path / 'a.jpg')
+
+    first = compact(str(tmp_path), workers=1, min_age=0)
+    assert first['processed'] == 1 and first['statuses'] == {'compacted': 1}
+    assert first['bytes_saved'] == before - os.path.getsize(tmp_path / 'a.jpg') > 0
+    with Image.open(tmp_path / 'a.jpg') as img:
+        assert max(img.size) == 1024
+    # the debug folder is left alone
+    with Image.open(tmp_path / 'debug' / 'b.jpg') as img:
+        assert img.size == (1600, 1200)
+
+    second = compact(str(tmp_path), workers=1, min_age=0)
+    assert second['processed'] == 0 and second['skipped_in_manifest'] == 1
+
+
+def test_recent_uploads_wait_and_hard_links_keep_original(tmp_path):
+    noisy_jpeg(tmp_path / 'new.jpg')
+    assert compact(str(tmp_path), workers=1, min_age=3600)['skipped_too_new'] == 1
+
+    (tmp_path / 'debug').mkdir()
+    os.link(tmp_path / 'new.jpg', tmp_path / 'debug' / 'new.jpg')
+    original = (tmp_path / 'debug' / 'new.jpg').read_bytes()
+    compact(str(tmp_path), workers=2, min_age=0)
+    assert (tmp_path / 'debug' / 'new.jpg').read_bytes() == original
+    assert os.path.getsize(tmp_path / 'new.jpg') < len(original)
+
+
+def test_upload_store_is_never_reencoded(tmp_path):
+    store = tmp_path / 'store' / 'ab'
+    store.mkdir(parents=True)
+    (tmp_path / 'store' / 'index.sqlite3').write_bytes(b'')
+    noisy_jpeg(store / ('ab' * 32 + '.jpg'))
+    noisy_jpeg(tmp_path / 'legacy.jpg')
+    before = (store / ('ab' * 32 + '.jpg')).read_bytes()
+
+    summary = compact(str(tmp_path), workers=1, min_age=0)
+    assert summary['processed'] == 1
+    assert (store / ('ab' * 32 + '.jpg')).read_bytes() == before
+    assert compact(str(tmp_path / 'store'), workers=1, min_age=0)['processed'] == 0
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+
+from debug_analysis import analyze, log_paths, parse_time
+
+
+def entry(ts, endpoint, top, prob, uncertain=False, filename='leaf.jpg'):
+    raw = np.full(10, (1.0 - prob) / 9)
+    raw[top] = prob
+    return {'ts': ts, 'endpoint': endpoint, 'filename': filename, 'prediction': 'x',
+            'confidence': round(prob * 100, 2), 'uncertain': uncertain, 'raw_predictions': raw.tolist()}
+
+
+def write_log(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        for e in entries:
+            f.write((e if isinstance(e, str) else json.dumps(e)) + '\n')
+
+
+def test_aggregates_across_chunks(tmp_path):
+    log = tmp_path / 'debug_logs.jsonl'
+    write_log(log, [
+        entry(100, 'api/predict', 1, 0.9),
+        entry(200, 'api/predict', 1, 0.5, uncertain=True, filename='b.jpg'),
+        'not json',
+        entry(300, 'web/upload', 9, 0.8),
+        {'endpoint': 'web/upload', 'filename': 'old.jpg', 'prediction': 'Healthy', 'confidence': 70.0},
+    ])
+    s = analyze([str(log)], chunk_lines=2).summary()
+    assert s['entries'] == 4 and s['malformed_lines'] == 1
+    assert s['entries_without_raw_predictions'] == 1
+    assert s['uncertain'] == 1 and s['uncertain_rate'] == 0.25
+    assert s['top1_classes']['Early_blight'] == 2 and s['top1_classes']['Healthy'] == 1
+    assert sum(s['confidence_histogram']['counts']) == 4
+    assert s['endpoints']['api/predict']['entries'] == 2
+    assert s['endpoints']['api/predict']['uncertain_rate'] == 0.5
+    assert s['endpoints']['web/upload']['top1_classes'] == {'Healthy': 1}
+    assert s['files'][0] == {'filename': 'leaf.jpg', 'entries': 2, 'uncertain': 0}
+    assert (s['first_ts'], s['last_ts']) == (100, 300)
+
+
+def test_time_and_endpoint_filters(tmp_path):
+    log = tmp_path / 'debug_logs.jsonl'
+    write_log(log, [entry(100, 'api/predict', 1, 0.9), entry(200, 'api/predict', 2, 0.9),
+                    entry(300, 'web/upload', 3, 0.9)])
+    s = analyze([str(log)], since=150, endpoints={'api/predict'}).summary()
+    assert s['entries'] == 1 and s['top1_classes']['Late_blight'] == 1
+    s = analyze([str(log)], until=300).summary()
+    assert s['entries'] == 2
+
+
+def test_rotated_logs_and_relative_times(tmp_path):
+    log = tmp_path / 'debug_logs.jsonl'
+    write_log(tmp_path / 'debug_logs.20240101-000000-1.jsonl', [entry(1, 'api/predict', 0, 0.9)])
+    write_log(log, [entry(2, 'api/predict', 0, 0.9)])
+    assert len(log_paths(str(log))) == 1
+    assert log_paths(str(log), rotated=True)[-1] == str(log)
+    assert analyze(log_paths(str(log), rotated=True)).summary()['entries'] == 2
+    assert parse_time('2h', now=10000) == 10000 - 7200
+    assert parse_time('1700000000') == 1700000000.0
+
+
+def test_margin_uses_top_two_even_with_top_k_1(tmp_path):
+    log = tmp_path / 'debug_logs.jsonl'
+    write_log(log, [entry(100, 'api/predict', 1, 0.55)])
+    for top_k in (1, 3):
+        s = analyze([str(log)], top_k=top_k).summary()
+        assert s['mean_top1_top2_margin'] == round(0.55 - 0.45 / 9, 4)
+    assert s['mean_top3_mass'] == round(0.55 + 2 * 0.45 / 9, 4)
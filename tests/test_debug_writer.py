@@ -0,0 +1,86 @@
+import json
+import os
+import time
+
+from conftest import make_image_bytes
+from debug_writer import DebugWriter
+from test_api_predict import post_image
+
+
+def test_entries_are_batched_and_uploads_hard_linked(tmp_path):
+    src = tmp_path / 'leaf.jpg'
+    src.write_bytes(b'jpeg bytes')
+    debug = tmp_path / 'debug'
+    debug.mkdir()
+    w = DebugWriter(str(debug / 'debug_logs.jsonl'), str(debug), flush_interval=0.05)
+    for i in range(5):
+        assert w.submit({'filename': 'leaf.jpg', 'n': i}, src_path=str(src))
+    assert w.flush()
+
+    lines = (debug / 'debug_logs.jsonl').read_text().splitlines()
+    assert [json.loads(line)['n'] for line in lines] == list(range(5))
+    assert os.path.samefile(src, debug / 'leaf.jpg')
+    stats = w.stats()
+    assert stats['written'] == 5 and stats['dropped'] == 0
+    assert stats['flushes'] < 5
+
+
+def test_log_rotates_by_size(tmp_path):
+    w = DebugWriter(str(tmp_path / 'debug_logs.jsonl'), str(tmp_path), flush_interval=0, max_bytes=100)
+    for i in range(3):
+        w.submit({'filename': 'x.jpg', 'pad': 'x' * 80, 'n': i})
+        w.flush()
+    rotated = [p for p in os.listdir(tmp_path) if p.startswith('debug_logs.') and p != 'debug_logs.jsonl']
+    assert len(rotated) == 2
+    assert w.stats()['rotations'] == 2
+
+
+def test_prediction_is_logged_in_background(app_module, classifier):
+    client = app_module.app.test_client()
+    post_image(client, make_image_bytes())
+    assert app_module.debug_writer.flush()
+    with open(app_module.DEBUG_LOG, encoding='utf-8') as f:
+        entry = json.loads(f.readline())
+    assert entry['endpoint'] == 'api/predict'
+    assert entry['filename'] == 'leaf.jpg'
+    assert len(entry['raw_predictions']) == 10
+    assert os.path.exists(app_module.upload_store.path(entry['upload_id']))
+    assert not os.path.exists(os.path.join(app_module.DEBUG_DIR, 'leaf.jpg'))
+
+
+def test_rotated_logs_are_pruned_by_count_and_age(tmp_path):
+    pruned = []
+    w = DebugWriter(str(tmp_path / 'debug_logs.jsonl'), str(tmp_path), flush_interval=0, max_bytes=100,
+                    keep_rotated=2, retention_s=3600, on_prune=lambda path: pruned.append(open(path).read()))
+    for i in range(4):
+        w.submit({'pad': 'x' * 80, 'n': i})
+        w.flush()
+    rotated = w.rotated_logs()
+    assert len(rotated) == 2 and w.stats()['pruned'] == 1
+    assert json.loads(pruned[0])['n'] == 0
+
+    old = time.time() - 7200
+    os.utime(rotated[0], (old, old))
+    assert w.prune() == 1
+    assert w.rotated_logs() == rotated[1:]
+    assert [json.loads(text)['n'] for text in pruned] == [0, 1]
+    assert os.path.exists(tmp_path / 'debug_logs.jsonl')
+    assert not [p for p in os.listdir(tmp_path) if p.endswith('.pruning')]
+
+
+def test_losing_a_rotation_race_keeps_the_batch(tmp_path, monkeypatch):
+    log = tmp_path / 'debug_logs.jsonl'
+    w = DebugWriter(str(log), str(tmp_path), flush_interval=0, max_bytes=5)
+    w.submit({'n': 0})
+    assert w.flush()
+    replace = os.replace
+
+    def rotated_by_another_worker(src, dst):
+        replace(src, str(tmp_path / 'debug_logs.other.jsonl'))
+        return replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', rotated_by_another_worker)
+    w.submit({'n': 1})
+    assert w.flush()
+    assert [json.loads(line)['n'] for line in log.read_text().splitlines()] == [1]
+    assert w.stats()['errors'] == 0 and w.stats()['rotations'] == 0
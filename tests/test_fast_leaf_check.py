@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+
+from leaf_check import fast_leaf_check, green_proportion
+
+THRESHOLDS = {'GREEN_H_MIN': 25, 'GREEN_H_MAX': 100, 'S_MIN': 40, 'V_MIN': 40, 'GREEN_PROP_THRESH': 0.03}
+
+
+def banded(green_rows, height=3000, width=4000):
+    arr = np.full((height, width, 3), (120, 90, 200), dtype='uint8')
+    arr[:green_rows] = (40, 150, 40)
+    return Image.fromarray(arr)
+
+
+def exact(image):
+    return green_proportion(np.asarray(image.convert('HSV')), THRESHOLDS) >= THRESHOLDS['GREEN_PROP_THRESH']
+
+
+def test_decisions_match_exact_path_near_and_far_from_threshold():
+    for rows in (0, 30, 60, 80, 120, 1500, 3000):
+        img = banded(rows)
+        assert fast_leaf_check(img, THRESHOLDS)[0] == exact(img), rows
+
+
+def test_clearly_green_image_exits_early():
+    is_leaf, prop, seen = fast_leaf_check(banded(3000), THRESHOLDS, max_side=256)
+    assert is_leaf and prop == 1.0
+    assert seen < 256 * 192
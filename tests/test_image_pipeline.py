@@ -0,0 +1,21 @@
+import numpy as np
+
+from conftest import make_image_bytes
+from image_pipeline import ImagePipeline
+
+
+def test_jpeg_is_draft_decoded_to_working_size():
+    p = ImagePipeline(make_image_bytes((4000, 3000)), max_side=1024)
+    assert p.original_size == (4000, 3000)
+    assert max(p.image.size) == 1024
+    assert p.detector_tensor().shape == (1, 128, 128, 3)
+    assert p.classifier_tensor().shape == (1, 224, 224, 3)
+    assert p.classifier_tensor().dtype == np.float32
+    assert p.hsv_array().shape == (p.image.size[1], p.image.size[0], 3)
+
+
+def test_small_png_is_kept_at_native_size():
+    p = ImagePipeline(make_image_bytes((300, 200), fmt='PNG'))
+    assert p.format == 'PNG'
+    assert p.image.size == (300, 200)
+    assert float(p.classifier_tensor().max()) <= 1.0
@@ -0,0 +1,91 @@
+import io
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from conftest import FakeModel, make_image_bytes
+from inference_server import InferenceServer, RemoteModel
+
+
+@pytest.fixture
+def server(tmp_path):
+    row = np.full(10, 0.01, dtype='float32')
+    row[1] = 0.91
+    models = {'model': FakeModel(row)}
+    srv = InferenceServer(str(tmp_path / 'infer.sock'), models, {'model': ['keras', 'fake']}, max_wait_ms=1)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_remote_model_predicts_single_rows_and_batches(server):
+    remote = RemoteModel(server.server_address, 'model')
+    assert remote.identity == ['keras', 'fake']
+    out = remote.predict(np.zeros((1, 224, 224, 3), dtype='float32'))
+    assert out.shape == (1, 10) and np.argmax(out[0]) == 1
+    assert remote.predict(np.zeros((3, 224, 224, 3), dtype='float32')).shape == (3, 10)
+    # the single row went through the server's micro-batcher, the batch of three did not
+    assert server.models['model'].calls == [(1, 224, 224, 3), (3, 224, 224, 3)]
+    assert remote.stats()['model']['requests'] == 1
+    with pytest.raises(LookupError):
+        RemoteModel(server.server_address, 'leaf_detector')
+
+
+def test_concurrent_workers_share_batches(server):
+    remote = RemoteModel(server.server_address, 'model')
+    server.batchers['model'].max_wait = 0.05
+    outs = []
+    threads = [threading.Thread(target=lambda: outs.append(remote.predict(np.zeros((1, 8, 8, 3)))))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(outs) == 4
+    assert len(server.models['model'].calls) < 4
+
+
+def test_app_remote_backend_predicts_through_server(app_module, server, monkeypatch):
+    monkeypatch.setattr(app_module, 'INFERENCE_BACKEND', 'remote')
+    monkeypatch.setattr(app_module, 'INFERENCE_SOCKET', server.server_address)
+    client = app_module.app.test_client()
+    resp = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes()), 'leaf.jpg')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 200
+    assert resp.get_json()['prediction'] == 'Early_blight'
+    assert app_module.model_identity()[2] == ['keras', 'fake']
+    assert client.get('/api/inference-server').get_json()['model']['requests'] == 1
+
+
+def test_dropped_connection_is_reopened_but_timeouts_are_not_retried(server):
+    remote = RemoteModel(server.server_address, 'model', timeout=0.2)
+    remote._local.conn.shutdown(socket.SHUT_RDWR)  # as if the server had restarted
+    assert remote.predict(np.zeros((1, 8, 8, 3))).shape == (1, 10)
+
+    class Slow(FakeModel):
+        def predict(self, batch, **kwargs):
+            time.sleep(0.4)
+            return super().predict(batch)
+
+    server.models['model'] = slow = Slow(np.zeros(10))
+    with pytest.raises(socket.timeout):
+        remote.predict(np.zeros((3, 8, 8, 3)))
+    time.sleep(0.5)
+    assert len(slow.calls) == 1
+    assert remote.predict(np.zeros((1, 8, 8, 3))).shape == (1, 10)
+
+
+def test_missing_remote_detector_is_not_asked_for_again(app_module, server, monkeypatch):
+    monkeypatch.setattr(app_module, 'INFERENCE_SOCKET', server.server_address)
+    monkeypatch.setattr(app_module, '_remote_missing', set())
+    opened = []
+    monkeypatch.setattr(app_module, 'RemoteModel', lambda *a, **kw: opened.append(a) or RemoteModel(*a, **kw))
+    assert app_module.load_remote('leaf_detector') is None
+    assert app_module.load_remote('leaf_detector') is None
+    assert app_module.load_remote('model') is not None
+    assert [a[1] for a in opened] == ['leaf_detector', 'model']
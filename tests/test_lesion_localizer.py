@@ -0,0 +1,77 @@
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from conftest import make_image_bytes
+from lesion_localizer import localize_lesions, nms, summed_area_table, window_scores
+from test_api_predict import post_image
+
+
+def leaf_with_spots(size=(800, 600), spots=((100, 120, 60), (500, 350, 90))):
+    arr = np.zeros((size[1], size[0], 3), dtype='uint8')
+    arr[:] = (50, 150, 45)
+    for x, y, r in spots:
+        arr[y:y + r, x:x + r] = (60, 30, 10)
+    return Image.fromarray(arr)
+
+
+def test_window_scores_match_brute_force():
+    rs = np.random.RandomState(0)
+    mask = rs.rand(50, 70) > 0.7
+    scores, xs, ys = window_scores(summed_area_table(mask), 12, 9, 5)
+    for iy, y in enumerate(ys):
+        for ix, x in enumerate(xs):
+            assert np.isclose(scores[iy, ix], mask[y:y + 9, x:x + 12].mean())
+
+
+def test_nms_drops_overlapping_boxes():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [20, 20, 30, 30]], dtype='float64')
+    assert nms(boxes, np.array([0.9, 0.8, 0.5]), iou_thresh=0.3) == [0, 2]
+
+
+def test_finds_dark_spots_in_original_coordinates():
+    img = leaf_with_spots()
+    boxes = localize_lesions(img, max_side=400)
+    assert boxes and all(b['source'] == 'dark' for b in boxes)
+    centers = [(b['x'] + b['w'] / 2, b['y'] + b['h'] / 2) for b in boxes]
+    for cx, cy in ((130, 150), (545, 395)):
+        assert any(abs(cx - x) < 60 and abs(cy - y) < 60 for x, y in centers)
+
+
+def test_full_resolution_photo_is_fast():
+    img = leaf_with_spots(size=(4000, 3000), spots=((1000, 800, 300),))
+    localize_lesions(img)
+    t0 = time.perf_counter()
+    localize_lesions(img)
+    assert time.perf_counter() - t0 < 0.5
+
+
+def test_api_predict_returns_lesions_on_request(app_module, classifier):
+    client = app_module.app.test_client()
+    assert 'lesions' not in post_image(client, make_image_bytes()).get_json()
+    resp = client.post('/api/predict?lesions=1', data={'file': (io.BytesIO(make_image_bytes((1600, 1200))), 'leaf.jpg')},
+                       content_type='multipart/form-data')
+    lesions = resp.get_json()['lesions']
+    assert isinstance(lesions, list)
+    for b in lesions:
+        assert 0 <= b['x'] < 1600 and 0 <= b['y'] < 1200
+
+
+def test_multi_crop_inference_is_one_batched_call(app_module, classifier, monkeypatch):
+    monkeypatch.setattr(app_module, 'INFERENCE_CROPS', 3)
+    buf = io.BytesIO()
+    leaf_with_spots(size=(1600, 1200), spots=((300, 300, 120), (1000, 700, 150))).save(buf, format='JPEG')
+    resp = post_image(app_module.app.test_client(), buf.getvalue())
+    data = resp.get_json()
+    assert data['prediction'] == 'Early_blight'
+    assert 1 <= data['crops'] <= 3
+    assert classifier.calls == [(1 + data['crops'], 224, 224, 3)]
+
+
+def test_crop_rows_are_aggregated(app_module, monkeypatch):
+    rows = np.array([[0.6, 0.4], [0.2, 0.8], [0.4, 0.6]])
+    assert np.allclose(app_module.aggregate_crops(rows), [0.4, 0.6])
+    monkeypatch.setattr(app_module, 'CROP_AGGREGATE', 'max')
+    assert np.allclose(app_module.aggregate_crops(rows), [0.2, 0.8])
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from benchmarks.load_test import LoadGenerator, Workload, load_log_traffic, parse_weights, summarize
+from conftest import make_image_bytes
+
+
+@pytest.fixture
+def server(app_module, classifier):
+    srv = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{srv.server_port}'
+    srv.shutdown()
+
+
+def test_parse_weights():
+    assert parse_weights('api_predict=3,preview') == [('api_predict', 3.0), ('preview', 1.0)]
+    assert parse_weights('640x480*2') == [('640x480', 2.0)]
+    with pytest.raises(ValueError):
+        parse_weights('bogus=1', allowed=('api_predict',))
+
+
+def test_uploads_are_made_unique_and_previews_wait_for_an_upload():
+    workload = Workload([('preview', 1)], [('leaf.jpg', b'jpeg', 1)])
+    first, second = workload.next(), workload.next()
+    assert first[0] == 'api_predict' and first[2] != second[2]
+    workload.remember('abc')
+    assert workload.next() == ('preview', 'abc', None)
+
+
+def test_open_loop_step_reports_per_endpoint(server):
+    leaf, sofa = make_image_bytes(), make_image_bytes(color=(200, 30, 200))
+    workload = Workload([('api_predict', 2), ('upload', 1), ('preview', 1)],
+                        [('leaf.jpg', leaf, 3), ('sofa.jpg', sofa, 1)], seed=1)
+    results, not_sent, elapsed = LoadGenerator(server, workload, concurrency=4).run(rate=20, duration=1.0)
+    assert not_sent == 0 and len(results) == 20
+    report = summarize(results, elapsed, 1.0)
+    assert report['all']['requests'] == 20
+    assert set(report) - {'all'} <= {'api_predict', 'upload', 'preview'}
+    assert report['api_predict']['status'].get('200', 0) > 0
+    # sofa uploads are rejected: 400 from the API, an error page from the upload form
+    assert 0 < report['all']['error_rate'] < 1
+    assert report['all']['p50_ms'] <= report['all']['p99_ms']
+
+
+def test_recorded_traffic_is_replayed_from_the_debug_log(app_module, server):
+    leaf = make_image_bytes()
+    workload = Workload([('upload', 1)], [('leaf.jpg', leaf, 1)], unique=False)
+    LoadGenerator(server, workload).warm_up(2)
+    app_module.debug_writer.flush()
+
+    traffic = load_log_traffic(app_module.DEBUG_LOG, app_module.upload_store.root, app_module.DEBUG_DIR)
+    assert [(endpoint, name) for endpoint, name, _ in traffic] == [('upload', 'leaf.jpg')] * 2
+    assert traffic[0][2] == open(app_module.upload_store.path(app_module.upload_digest(leaf)), 'rb').read()
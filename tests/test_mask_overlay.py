@@ -0,0 +1,51 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from conftest import make_image_bytes
+from mask_overlay import render_mask_overlay, rle_decode, rle_encode
+from test_api_predict import post_image
+
+THRESHOLDS = {'GREEN_H_MIN': 25, 'GREEN_H_MAX': 100, 'S_MIN': 40, 'V_MIN': 40}
+
+
+def test_vectorized_blend_matches_alpha_composite():
+    img = Image.new('RGB', (64, 32), (200, 30, 30))
+    img.paste((40, 160, 40), (0, 0, 32, 32))
+    out = np.asarray(render_mask_overlay(img, THRESHOLDS, max_side=64)).astype(int)
+
+    overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    overlay.paste(Image.new('RGBA', (32, 32), (0, 255, 0, 120)), (0, 0))
+    expected = np.asarray(Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')).astype(int)
+    assert np.abs(out - expected).max() <= 1
+
+
+def test_rle_round_trip():
+    mask = np.random.RandomState(1).rand(17, 23) > 0.6
+    mask[0, 0] = True
+    assert (rle_decode(rle_encode(mask)) == mask).all()
+
+
+def test_mask_is_deferred_and_served_with_etag(app_module, classifier):
+    client = app_module.app.test_client()
+    data = post_image(client, make_image_bytes((1600, 1200))).get_json()
+    assert data['mask'] is None
+    assert data['mask_url'] == '/mask/' + data['upload_id']
+
+    resp = client.get(data['mask_url'])
+    assert resp.status_code == 200 and resp.mimetype == 'image/png'
+    assert max(Image.open(io.BytesIO(resp.data)).size) == app_module.MASK_MAX_SIDE
+    etag = resp.headers['ETag']
+    assert client.get(data['mask_url'], headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/admin/api', json={'GREEN_H_MIN': 30})
+    assert client.get(data['mask_url']).headers['ETag'] != etag
+
+
+def test_mask_rle_opt_in(app_module, classifier):
+    client = app_module.app.test_client()
+    resp = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes()), 'leaf.jpg'), 'mask': 'rle'},
+                       content_type='multipart/form-data')
+    rle = resp.get_json()['mask_rle']
+    assert rle_decode(rle).all()
@@ -0,0 +1,74 @@
+import json
+
+from conftest import make_image_bytes
+from metrics import Metrics, mark_process_dead
+from test_api_predict import post_image
+
+
+def make_metrics(collect_dir=None):
+    m = Metrics(collect_dir=collect_dir)
+    m.counter('requests_total', 'Requests.')
+    m.gauge('queue_depth', 'Queue depth.')
+    m.histogram('stage_seconds', 'Stage latency.', buckets=(0.01, 0.1))
+    return m
+
+
+def test_render_prometheus_text():
+    m = make_metrics()
+    m.inc('requests_total', status=200)
+    m.inc('requests_total', status=200)
+    m.set('queue_depth', 3)
+    for value in (0.005, 0.05, 5.0):
+        m.observe('stage_seconds', value, stage='decode')
+
+    text = m.render()
+    assert '# TYPE tomato_requests_total counter' in text
+    assert 'tomato_requests_total{status="200"} 2' in text
+    assert 'tomato_queue_depth 3' in text
+    assert 'tomato_stage_seconds_bucket{stage="decode",le="0.01"} 1' in text
+    assert 'tomato_stage_seconds_bucket{stage="decode",le="0.1"} 2' in text
+    assert 'tomato_stage_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 'tomato_stage_seconds_count{stage="decode"} 3' in text
+
+
+def test_snapshots_from_other_workers_are_merged(tmp_path):
+    m = make_metrics(str(tmp_path))
+    m.inc('requests_total', status=200)
+    m.set('queue_depth', 2)
+    m.observe('stage_seconds', 0.05, stage='decode')
+    # A second worker's snapshot, as its flush thread would have written it
+    other = {'pid': 99999,
+             'counters': [['tomato_requests_total', [['status', '200']], 4]],
+             'gauges': [['tomato_queue_depth', [], 5.0]],
+             'hists': [['tomato_stage_seconds', [['stage', 'decode']], [1, 0, 0], 0.002, 1]]}
+    (tmp_path / 'metrics_99999.json').write_text(json.dumps(other))
+
+    text = m.render()
+    assert 'tomato_requests_total{status="200"} 5' in text
+    assert 'tomato_queue_depth 7' in text
+    assert 'tomato_stage_seconds_count{stage="decode"} 2' in text
+
+    # An exited worker keeps its counters but not its gauges
+    mark_process_dead(str(tmp_path), 99999)
+    text = m.render()
+    assert 'tomato_requests_total{status="200"} 5' in text
+    assert 'tomato_queue_depth 2' in text
+
+
+def test_metrics_endpoint_reports_stages_and_rejections(app_module, classifier):
+    client = app_module.app.test_client()
+    assert post_image(client, make_image_bytes()).status_code == 200
+    assert post_image(client, make_image_bytes(color=(200, 30, 200)), name='sofa.jpg').status_code == 400
+    assert post_image(client, b'text', name='notes.txt').status_code == 400
+
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+    assert 'tomato_stage_seconds_count{stage="inference"} 1' in text
+    assert 'tomato_stage_seconds_count{stage="decode"} 2' in text
+    assert 'tomato_rejections_total{reason="not_leaf"} 1' in text
+    assert 'tomato_rejections_total{reason="invalid_type"} 1' in text
+    assert 'tomato_predictions_total{endpoint="api/predict",uncertain="false"} 1' in text
+    assert 'tomato_requests_total{endpoint="api_predict",status="200"} 1' in text
+    assert 'tomato_model_loaded{model="model"} 1' in text
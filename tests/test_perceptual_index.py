@@ -0,0 +1,162 @@
+import io
+import json
+import random
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from conftest import make_image_bytes
+from perceptual_index import MultiIndexHash, PerceptualIndex, build, dhash, hamming, is_distinctive
+
+
+def leaf_image(seed=0, size=(800, 600)):
+    rng = random.Random(seed)
+    img = Image.new('RGB', size, (40, 150, 40))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y, r = rng.randrange(size[0]), rng.randrange(size[1]), rng.randrange(20, 120)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(rng.randrange(60, 140), rng.randrange(40, 90), 20))
+    return img
+
+
+def recompress(img, scale=0.5, quality=35):
+    small = img.resize((int(img.width * scale), int(img.height * scale)))
+    buf = io.BytesIO()
+    small.save(buf, format='JPEG', quality=quality)
+    return Image.open(io.BytesIO(buf.getvalue())).convert('RGB')
+
+
+def test_dhash_survives_recompression_but_separates_different_leaves():
+    original = leaf_image(1)
+    assert hamming(dhash(original), dhash(recompress(original))) <= 4
+    assert hamming(dhash(original), dhash(leaf_image(2))) > 12
+
+
+def test_multi_index_search_matches_brute_force():
+    rng = np.random.default_rng(0)
+    hashes = [int(x) for x in rng.integers(0, 2 ** 63, 2000, dtype='int64')]
+    index = MultiIndexHash(max_distance=6)
+    for i, h in enumerate(hashes):
+        index.add(h, i)
+    for q in hashes[:50]:
+        q ^= 0b1011 << 20  # three bits away from a stored hash
+        expected = sorted((hamming(q, h), i) for i, h in enumerate(hashes) if hamming(q, h) <= 6)
+        assert index.search(q) == expected
+
+
+def test_workers_see_each_others_entries_and_context_is_respected(tmp_path):
+    path = str(tmp_path / 'phash.jsonl')
+    a, b = PerceptualIndex(path), PerceptualIndex(path)
+    h = dhash(leaf_image(3))
+    a.add(h, 'ctx1', {'prediction': 'Early_blight'}, upload_id='u1')
+    distance, record = b.lookup(h ^ 1, 'ctx1')
+    assert distance == 1 and record['upload_id'] == 'u1'
+    assert b.lookup(h, 'ctx2') is None
+
+
+def test_clusters_group_recompressed_copies(tmp_path):
+    index = PerceptualIndex(str(tmp_path / 'phash.jsonl'))
+    for seed in (4, 5):
+        img = leaf_image(seed)
+        for n, copy in enumerate((img, recompress(img), recompress(img, 0.3, 50))):
+            index.add(dhash(copy), 'ctx', {}, filename=f'{seed}-{n}.jpg')
+    index.add(dhash(leaf_image(6)), 'ctx', {}, filename='single.jpg')
+    groups = index.clusters()
+    assert sorted(sorted(r['filename'] for r in g) for g in groups) == [
+        ['4-0.jpg', '4-1.jpg', '4-2.jpg'], ['5-0.jpg', '5-1.jpg', '5-2.jpg']]
+
+
+def test_api_predict_reuses_result_for_near_duplicate(app_module, classifier, monkeypatch):
+    monkeypatch.setattr(app_module, 'PHASH_ENABLED', True)
+    client = app_module.app.test_client()
+    original = leaf_image(7)
+    payloads = []
+    for img in (original, recompress(original)):
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG')
+        payloads.append(buf.getvalue())
+    first = client.post('/api/predict', data={'file': (io.BytesIO(payloads[0]), 'a.jpg')},
+                        content_type='multipart/form-data').get_json()
+    second = client.post('/api/predict', data={'file': (io.BytesIO(payloads[1]), 'b.jpg')},
+                         content_type='multipart/form-data').get_json()
+    assert 'near_duplicate' not in first
+    assert second['prediction'] == first['prediction']
+    assert second['near_duplicate']['upload_id'] == first['upload_id']
+    assert len(classifier.calls) == 1
+
+
+def test_build_only_indexes_predictions_from_the_current_model(app_module, classifier, tmp_path):
+    client = app_module.app.test_client()
+    for seed in (8, 9):
+        buf = io.BytesIO()
+        leaf_image(seed).save(buf, format='JPEG')
+        client.post('/api/predict', data={'file': (io.BytesIO(buf.getvalue()), f'{seed}.jpg')},
+                    content_type='multipart/form-data')
+    assert app_module.debug_writer.flush()
+    with open(app_module.DEBUG_LOG, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f]
+    with open(app_module.DEBUG_LOG, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({**entries[0], 'context': 'older-model'}) + '\n')
+        f.write(json.dumps({k: v for k, v in entries[1].items() if k not in ('model', 'context')}) + '\n')
+
+    path = str(tmp_path / 'phash.jsonl')
+    summary = build(path, app_module.DEBUG_LOG, app_module.upload_store, app_module.DEBUG_DIR,
+                    app_module.phash_context())
+    assert summary == {'entries': 2, 'missing_images': 0, 'other_context': 2}
+    assert entries[0]['model'] == app_module.model_identity()
+
+
+def test_lookups_are_not_blocked_while_clustering(tmp_path, monkeypatch):
+    index = PerceptualIndex(str(tmp_path / 'phash.jsonl'))
+    h = dhash(leaf_image(10))
+    index.add(h, 'ctx', {'prediction': 'Early_blight'})
+    index.add(h ^ 1, 'ctx', {'prediction': 'Early_blight'})
+    search, looked_up = MultiIndexHash.search, []
+
+    def search_during_lookup(self, q, max_distance=None):
+        if threading.current_thread() is main and not looked_up:
+            worker = threading.Thread(target=lambda: looked_up.append(index.lookup(h, 'ctx')))
+            worker.start()
+            worker.join(2)
+            looked_up.append(not worker.is_alive())
+        return search(self, q, max_distance)
+
+    main = threading.current_thread()
+    monkeypatch.setattr(MultiIndexHash, 'search', search_during_lookup)
+    assert len(index.clusters()) == 1
+    assert looked_up[0][0] == 0 and looked_up[1] is True
+
+
+def test_index_is_compacted_to_the_newest_entries_and_workers_reload(tmp_path):
+    path = str(tmp_path / 'phash.jsonl')
+    a, b = PerceptualIndex(path, max_entries=4), PerceptualIndex(path, max_entries=4)
+    hashes = [dhash(leaf_image(seed)) for seed in range(20, 26)]
+    for n, h in enumerate(hashes[:5]):
+        a.add(h, 'ctx', {'n': n})
+    assert len(b) == 0 and b.lookup(hashes[0], 'ctx')[1]['result'] == {'n': 0}
+    a.add(hashes[5], 'ctx', {'n': 5})  # 6 > 4 + 4 // 4: rewrite with the newest 4
+    assert len(a) == 4 and a.stats()['compactions'] == 1
+    assert len(open(path).readlines()) == 4
+    assert b.lookup(hashes[0], 'ctx') is None
+    assert b.lookup(hashes[5], 'ctx')[1]['result'] == {'n': 5} and len(b) == 4
+
+    memory = PerceptualIndex(max_entries=2)
+    for n, h in enumerate(hashes[:3]):
+        memory.add(h, 'ctx', {'n': n})
+    assert len(memory) == 2 and memory.lookup(hashes[0], 'ctx') is None
+
+
+def test_flat_non_leaf_never_matches_a_flat_leaf(app_module, classifier, monkeypatch):
+    monkeypatch.setattr(app_module, 'PHASH_ENABLED', True)
+    client = app_module.app.test_client()
+    leaf = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes(color=(40, 160, 40))), 'leaf.jpg')},
+                       content_type='multipart/form-data')
+    assert leaf.status_code == 200
+    sofa = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes(color=(200, 40, 200))), 'sofa.jpg')},
+                       content_type='multipart/form-data')
+    assert sofa.status_code == 400
+    # flat images carry no gradients: nothing was indexed for the leaf either
+    assert len(app_module.phash_index) == 0
+    assert not is_distinctive(dhash(Image.new('RGB', (64, 64), (40, 160, 40))))
+    assert is_distinctive(dhash(leaf_image(11)))
@@ -0,0 +1,63 @@
+import io
+import json
+import zipfile
+
+from conftest import make_image_bytes
+
+
+def read_lines(resp):
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines() if line]
+
+
+def test_batch_streams_one_line_per_image_and_isolates_errors(app_module, classifier, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_PREDICT_CHUNK', 2)
+    client = app_module.app.test_client()
+    files = [
+        (io.BytesIO(make_image_bytes()), 'a.jpg'),
+        (io.BytesIO(make_image_bytes(color=(200, 30, 200))), 'not_leaf.jpg'),
+        (io.BytesIO(b'not an image'), 'broken.jpg'),
+        (io.BytesIO(make_image_bytes(color=(30, 150, 60))), 'b.jpg'),
+    ]
+    resp = client.post('/api/predict/batch', data={'files': files}, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = read_lines(resp)
+    assert [line['filename'] for line in lines] == ['a.jpg', 'not_leaf.jpg', 'broken.jpg', 'b.jpg']
+    assert lines[0]['prediction'] == 'Early_blight'
+    assert 'tomato leaf' in lines[1]['error']
+    assert 'error' in lines[2]
+    assert lines[3]['prediction'] == 'Early_blight'
+    # one forward pass per chunk that contained leaf images
+    assert classifier.calls == [(1, 224, 224, 3), (1, 224, 224, 3)]
+
+
+def test_batch_accepts_zip_archive(app_module, classifier):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for i in range(3):
+            zf.writestr(f'survey/leaf_{i}.jpg', make_image_bytes(color=(40, 150 + i, 40)))
+        zf.writestr('survey/notes.txt', 'skip me')
+    buf.seek(0)
+    client = app_module.app.test_client()
+    resp = client.post('/api/predict/batch', data={'archive': (buf, 'survey.zip')},
+                       content_type='multipart/form-data')
+    lines = read_lines(resp)
+    by_name = {line['filename']: line for line in lines}
+    assert sorted(by_name) == ['leaf_0.jpg', 'leaf_1.jpg', 'leaf_2.jpg', 'notes.txt']
+    assert 'Invalid file type' in by_name['notes.txt']['error']
+    assert classifier.calls == [(3, 224, 224, 3)]
+
+
+def test_files_past_the_cap_get_an_error_line(app_module, classifier, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_MAX_FILES', 2)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('c.jpg', make_image_bytes())
+    buf.seek(0)
+    files = [(io.BytesIO(make_image_bytes()), name) for name in ('a.jpg', 'b.jpg')] + [(buf, 'more.zip')]
+    client = app_module.app.test_client()
+    lines = read_lines(client.post('/api/predict/batch', data={'files': files}, content_type='multipart/form-data'))
+    by_name = {line['filename']: line for line in lines}
+    assert sorted(by_name) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert by_name['a.jpg']['prediction'] == by_name['b.jpg']['prediction'] == 'Early_blight'
+    assert by_name['c.jpg']['error'] == 'Not processed: more than 2 images in one request.'
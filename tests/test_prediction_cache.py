@@ -0,0 +1,43 @@
+from conftest import make_image_bytes
+from prediction_cache import PredictionCache
+from test_api_predict import post_image
+
+
+def test_lru_evicts_least_recently_used():
+    c = PredictionCache(max_entries=2)
+    c.put('a', {'v': 1})
+    c.put('b', {'v': 2})
+    assert c.get('a') == {'v': 1}
+    c.put('c', {'v': 3})
+    assert c.get('b') is None
+    assert c.get('a') == {'v': 1}
+    stats = c.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2 and stats['misses'] == 1
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    key = PredictionCache.make_key(b'img', ['keras'], {'CONF_THRESH': 0.6})
+    PredictionCache(max_entries=4, disk_dir=str(tmp_path)).put(key, {'prediction': 'Healthy'})
+    other = PredictionCache(max_entries=4, disk_dir=str(tmp_path))
+    assert other.get(key) == {'prediction': 'Healthy'}
+    assert other.stats()['disk_hits'] == 1
+
+
+def test_key_depends_on_thresholds():
+    a = PredictionCache.make_key(b'img', ['keras'], {'S_MIN': 40})
+    b = PredictionCache.make_key(b'img', ['keras'], {'S_MIN': 41})
+    assert a != b
+
+
+def test_resent_image_skips_inference_until_thresholds_change(app_module, classifier):
+    client = app_module.app.test_client()
+    data = make_image_bytes()
+    assert post_image(client, data).get_json()['prediction'] == 'Early_blight'
+    assert post_image(client, data, name='again.jpg').get_json()['prediction'] == 'Early_blight'
+    assert len(classifier.calls) == 1
+    assert client.get('/api/cache').get_json()['hits'] == 1
+
+    client.post('/admin/api', json={'S_MIN': 41})
+    post_image(client, data)
+    assert len(classifier.calls) == 2
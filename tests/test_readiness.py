@@ -0,0 +1,19 @@
+from conftest import FakeModel
+
+
+def test_ready_reports_load_state_and_warmup(app_module, classifier, monkeypatch):
+    detector = FakeModel([0.9])
+    monkeypatch.setattr(app_module, 'load_leaf_detector', lambda: detector)
+    client = app_module.app.test_client()
+
+    assert client.get('/ready').status_code == 503
+
+    app_module.warm_up_models()
+    resp = client.get('/ready')
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['ready'] and data['warmed_up']
+    assert data['model']['loaded'] and data['model']['warmup_ms'] is not None
+    assert data['leaf_detector']['loaded']
+    assert classifier.calls == [(1, 224, 224, 3)]
+    assert detector.calls == [(1, 128, 128, 3)]
@@ -0,0 +1,115 @@
+import io
+import json
+import threading
+import time
+
+import numpy as np
+
+from conftest import FakeModel, make_image_bytes
+from shadow_eval import ShadowEvaluator, compare, replay
+
+LABELS = ['a', 'b', 'c']
+
+
+def row(top, p=0.9):
+    r = np.full(3, (1 - p) / 2, dtype='float32')
+    r[top] = p
+    return r
+
+
+def evaluator(candidate, **kwargs):
+    kwargs.setdefault('cpu_share', 1.0)
+    return ShadowEvaluator(lambda: candidate, lambda rows: rows.mean(axis=0), LABELS, 0.6, **kwargs)
+
+
+def test_compare_reports_agreement_deltas_and_uncertain_flips():
+    record = compare(row(0, 0.9), row(1, 0.5), LABELS, 0.6)
+    assert (record['primary'], record['candidate'], record['agree']) == ('a', 'b', False)
+    assert record['confidence_delta'] == -40.0
+    assert record['primary_class_delta'] == -65.0
+    assert (record['primary_uncertain'], record['candidate_uncertain']) == (False, True)
+
+
+def test_records_are_logged_and_summarized(tmp_path):
+    log = tmp_path / 'shadow.jsonl'
+    shadow = evaluator(FakeModel(row(1)), log_path=str(log))
+    x = np.zeros((1, 4), dtype='float32')
+    shadow.submit(x, row(1), primary_ms=5.0, upload_id='u1')
+    shadow.submit(x, row(0), primary_ms=7.0, upload_id='u2')
+    assert shadow.flush()
+
+    stats = shadow.stats()
+    assert (stats['submitted'], stats['compared'], stats['agreement']) == (2, 2, 0.5)
+    assert stats['top_disagreements'] == [{'primary': 'a', 'candidate': 'b', 'count': 1}]
+    assert stats['primary_ms']['p50'] == 6.0
+    records = [json.loads(line) for line in open(log)]
+    assert [r['upload_id'] for r in records] == ['u1', 'u2']
+
+
+def test_full_queue_drops_instead_of_blocking():
+    release = threading.Event()
+
+    class Slow(FakeModel):
+        def predict(self, batch, **kwargs):
+            release.wait(5)
+            return super().predict(batch)
+
+    shadow = evaluator(Slow(row(0)), max_queue=1)
+    x = np.zeros((1, 4), dtype='float32')
+    t0 = time.perf_counter()
+    results = [shadow.submit(x, row(0)) for _ in range(5)]
+    assert time.perf_counter() - t0 < 0.5
+    release.set()
+    assert results.count(False) >= 3
+    assert shadow.flush()
+    assert shadow.stats()['dropped'] == results.count(False)
+
+
+def test_cpu_share_throttles_the_shadow_thread():
+    class Busy(FakeModel):
+        def predict(self, batch, **kwargs):
+            time.sleep(0.02)
+            return super().predict(batch)
+
+    shadow = evaluator(Busy(row(0)), cpu_share=0.5)
+    x = np.zeros((1, 4), dtype='float32')
+    for _ in range(3):
+        shadow.submit(x, row(0))
+    assert shadow.flush()
+    # each ~20 ms prediction is followed by as long a rest
+    assert shadow.stats()['throttled_s'] >= 0.03
+
+
+def test_missing_candidate_disables_sampling():
+    shadow = ShadowEvaluator(lambda: None, lambda rows: rows[0], LABELS, 0.6, sample_rate=1.0)
+    shadow.submit(np.zeros((1, 4)), row(0))
+    assert shadow.flush()
+    assert shadow.stats()['errors'] == 1
+    assert shadow.load_error and not shadow.should_sample()
+
+
+def test_live_predictions_are_shadowed_and_replayed(app_module, classifier, monkeypatch, tmp_path):
+    candidate_row = np.full(10, 0.01, dtype='float32')
+    candidate_row[2] = 0.91
+    candidate = FakeModel(candidate_row)
+    shadow = ShadowEvaluator(lambda: candidate, app_module.aggregate_crops, app_module.class_labels,
+                             app_module.CONF_THRESH, log_path=str(tmp_path / 'shadow.jsonl'),
+                             sample_rate=1.0, cpu_share=1.0)
+    monkeypatch.setattr(app_module, 'shadow_evaluator', shadow)
+
+    client = app_module.app.test_client()
+    resp = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes()), 'leaf.jpg')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 200
+    assert shadow.flush()
+    stats = client.get('/api/shadow').get_json()
+    assert stats['enabled'] and stats['compared'] == 1 and stats['agreement'] == 0.0
+    assert stats['top_disagreements'][0] == {'primary': 'Early_blight', 'candidate': 'Late_blight', 'count': 1}
+    record = json.loads(open(tmp_path / 'shadow.jsonl').readline())
+    assert record['upload_id'] == resp.get_json()['upload_id']
+    assert record['endpoint'] == '/api/predict'
+
+    app_module.debug_writer.flush()
+    report = replay(app_module, candidate, app_module.DEBUG_LOG, app_module.upload_store)
+    assert report.summary()['compared'] == 1
+    assert report.summary()['top_disagreements'][0]['candidate'] == 'Late_blight'
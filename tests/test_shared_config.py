@@ -0,0 +1,89 @@
+import json
+import os
+import select
+
+import pytest
+
+from conftest import make_image_bytes
+from shared_config import SharedConfig
+from test_api_predict import post_image
+
+DEFAULTS = {'S_MIN': 40, 'GREEN_PROP_THRESH': 0.03}
+
+
+def test_update_is_seen_by_other_workers_via_generation(tmp_path, monkeypatch):
+    path = str(tmp_path / 'config.json')
+    worker_a = SharedConfig(path, DEFAULTS)
+    worker_b = SharedConfig(path, DEFAULTS)
+    assert worker_b.current() == (0, DEFAULTS)
+
+    loads = []
+    original = worker_b._load
+    monkeypatch.setattr(worker_b, '_load', lambda: loads.append(1) or original())
+    for _ in range(3):
+        worker_b.current()
+    assert loads == []  # unchanged generation: no file read
+
+    snapshot = worker_a.update({'S_MIN': '45', 'unknown': 1})
+    assert snapshot == (1, {'S_MIN': 45, 'GREEN_PROP_THRESH': 0.03})
+    assert worker_b.current() == snapshot
+    worker_b.current()
+    assert loads == [1]
+    assert json.loads((tmp_path / 'config.json').read_text())['config_version'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_file_lock_excludes_a_forked_worker(tmp_path):
+    cfg = SharedConfig(str(tmp_path / 'config.json'), DEFAULTS)
+    go_r, go_w = os.pipe()
+    done_r, done_w = os.pipe()
+    pid = os.fork()  # a gunicorn worker forked after the app was imported
+    if pid == 0:
+        try:
+            os.read(go_r, 1)
+            with cfg._file_lock():
+                os.write(done_w, b'x')
+        finally:
+            os._exit(0)
+    with cfg._file_lock():
+        os.write(go_w, b'x')
+        # the child must wait while the parent holds the lock
+        assert select.select([done_r], [], [], 0.3)[0] == []
+    assert select.select([done_r], [], [], 5)[0] == [done_r]
+    os.waitpid(pid, 0)
+    for fd in (go_r, go_w, done_r, done_w):
+        os.close(fd)
+
+
+def test_invalid_update_changes_nothing(tmp_path):
+    cfg = SharedConfig(str(tmp_path / 'config.json'), DEFAULTS)
+    cfg.update({'S_MIN': 41})
+    with pytest.raises(ValueError):
+        cfg.update({'S_MIN': 'forty'})
+    assert cfg.current() == (1, {'S_MIN': 41, 'GREEN_PROP_THRESH': 0.03})
+
+
+def test_version_survives_a_lost_generation_file(tmp_path):
+    path = str(tmp_path / 'config.json')
+    SharedConfig(path, DEFAULTS).update({'S_MIN': 41})
+    (tmp_path / 'config.json.gen').unlink()
+    cfg = SharedConfig(path, DEFAULTS)
+    assert cfg.current().version == 1
+    assert cfg.update({'S_MIN': 42}).version == 2
+
+
+def test_responses_report_config_version(app_module, classifier):
+    client = app_module.app.test_client()
+    resp = post_image(client, make_image_bytes())
+    assert resp.get_json()['config_version'] == 0
+    assert resp.headers['X-Config-Version'] == '0'
+
+    saved = client.post('/admin/api', json={'S_MIN': 41}).get_json()
+    assert saved['config_version'] == 1 and saved['S_MIN'] == 41
+    # Another worker's view of the same file picks the change up
+    other = app_module.SharedConfig(app_module.shared_config.path, app_module.shared_config.defaults)
+    assert other.current().values['S_MIN'] == 41
+
+    resp = post_image(client, make_image_bytes())
+    assert resp.get_json()['config_version'] == 1
+    assert client.get('/admin/api').get_json()['config_version'] == 1
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from tflite_backend import TFLiteModel
+
+tf = pytest.importorskip('tensorflow')
+
+
+def _tiny_tflite():
+    inputs = tf.keras.Input(shape=(8, 8, 3))
+    x = tf.keras.layers.GlobalAveragePooling2D()(inputs)
+    outputs = tf.keras.layers.Dense(4, activation='softmax')(x)
+    model = tf.keras.Model(inputs, outputs)
+    return model, tf.lite.TFLiteConverter.from_keras_model(model).convert()
+
+
+def test_tflite_model_matches_keras_for_single_and_batched_inputs():
+    keras_model, content = _tiny_tflite()
+    m = TFLiteModel(model_content=content, num_threads=2, pool_size=2)
+    batch = np.random.RandomState(0).rand(5, 8, 8, 3).astype('float32')
+
+    expected = keras_model.predict(batch, verbose=0)
+    np.testing.assert_allclose(m.predict(batch[:1]), expected[:1], atol=1e-5)
+    np.testing.assert_allclose(m.predict(batch), expected, atol=1e-5)
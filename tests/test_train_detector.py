@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'leaf_detector'))
+
+import train_detector  # noqa: E402
+
+
+def make_split(root, counts):
+    for cls, color in (('leaf', (40, 160, 40)), ('nonleaf', (200, 30, 200))):
+        os.makedirs(os.path.join(root, cls))
+        for i in range(counts):
+            Image.new('RGB', (96 + i, 80), color).save(os.path.join(root, cls, f'{i}.jpg'))
+
+
+def stub_backbone():
+    from tensorflow.keras import layers, models
+    inputs = layers.Input(shape=(128, 128, 3))
+    x = layers.Conv2D(8, 3, strides=4, activation='relu')(inputs)
+    return models.Model(inputs, layers.GlobalAveragePooling2D()(x), name='stub')
+
+
+def test_features_are_cached_per_view_and_reused(tmp_path):
+    make_split(str(tmp_path / 'train'), 3)
+    paths, labels = train_detector.list_images(str(tmp_path / 'train'))
+    assert labels.tolist() == [0, 0, 0, 1, 1, 1]  # nonleaf first, leaf is the positive class
+    backbone = stub_backbone()
+    cache = str(tmp_path / 'cache' / 'train_features.npy')
+    augs = train_detector.AUGMENTATIONS[:3]
+    feats = train_detector.extract_features(paths, backbone, cache, augmentations=augs, batch_size=4)
+    assert isinstance(feats, np.memmap) and feats.shape == (3 * 6, 8) and feats.dtype == np.float16
+    # the flipped view of a uniform image embeds like the original
+    np.testing.assert_allclose(feats[:6], feats[6:12], atol=1e-2)
+    mtime = os.stat(cache).st_mtime_ns
+    again = train_detector.extract_features(paths, None, cache, augmentations=augs)
+    assert os.stat(cache).st_mtime_ns == mtime
+    np.testing.assert_array_equal(again, feats)
+
+
+def test_cached_training_saves_a_full_image_model(tmp_path):
+    make_split(str(tmp_path / 'train'), 4)
+    make_split(str(tmp_path / 'val'), 2)
+    out = str(tmp_path / 'leaf_detector.h5')
+    model = train_detector.train_cached(str(tmp_path / 'train'), str(tmp_path / 'val'), epochs=2, batch_size=8,
+                                        augmentations=2, cache_dir=str(tmp_path / 'cache'),
+                                        backbone=stub_backbone(), save_path=out)
+    assert os.path.exists(out)
+    assert model.predict(np.zeros((2, 128, 128, 3), dtype='float32'), verbose=0).shape == (2, 1)
@@ -0,0 +1,79 @@
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+from conftest import make_image_bytes
+from upload_check import check_image_header
+
+
+def png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def png_header(width, height):
+    """A PNG signature, IHDR and an empty IDAT: enough for a header-only check, no pixel data."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', ihdr) + png_chunk(b'IDAT', b'')
+
+
+def test_valid_image_passes_and_stream_is_rewound():
+    stream = io.BytesIO(make_image_bytes((640, 480)))
+    header, reason = check_image_header(stream)
+    assert reason is None
+    assert header == ('JPEG', 640, 480)
+    assert stream.tell() == 0
+
+
+def test_bad_uploads_are_rejected_by_reason():
+    gif = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(gif, format='GIF')
+    assert check_image_header(b'')[1] == 'empty'
+    assert check_image_header(b'not an image at all')[1] == 'corrupt'
+    assert check_image_header(gif.getvalue())[1] == 'unsupported_format'
+    assert check_image_header(png_header(12000, 100))[1] == 'too_large_dimensions'
+    assert check_image_header(png_header(8000, 6000))[1] == 'too_many_pixels'
+    # past twice PIL's own bomb limit Image.open raises; that is still a clean rejection
+    assert check_image_header(png_header(20000, 10000), max_side=50000)[1] == 'too_many_pixels'
+
+
+def test_api_rejects_from_header_before_inference(app_module, classifier):
+    client = app_module.app.test_client()
+    for payload, name in ((b'\xff\xd8\xff garbage', 'broken.jpg'), (png_header(8000, 6000), 'huge.png')):
+        resp = client.post('/api/predict', data={'file': (io.BytesIO(payload), name)},
+                           content_type='multipart/form-data')
+        assert resp.status_code == 400
+    assert 'megapixels' in resp.get_json()['error']
+    assert classifier.calls == []
+    text = app_module.metrics.render()
+    assert 'tomato_rejections_total{reason="corrupt"} 1' in text
+    assert 'tomato_rejections_total{reason="too_many_pixels"} 1' in text
+
+
+def test_uploads_are_spooled_in_memory(app_module):
+    seen = {}
+
+    @app_module.app.route('/_spool_probe', methods=['POST'])
+    def _spool_probe():
+        seen['rolled'] = app_module.request.files['file'].stream._rolled
+        return 'ok'
+
+    data = b'x' * (2 * 1024 * 1024)
+    client = app_module.app.test_client()
+    client.post('/_spool_probe', data={'file': (io.BytesIO(data), 'big.jpg')}, content_type='multipart/form-data')
+    assert seen == {'rolled': False}
+
+    # the bulk endpoint spills large bodies to disk as werkzeug does by default
+    with app_module.app.test_request_context('/api/predict/batch', method='POST', content_type='multipart/form-data',
+                                             data={'files': (io.BytesIO(data), 'big.jpg')}):
+        assert app_module.request.files['files'].stream._rolled
+
+
+def test_oversized_request_is_counted(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    client = app_module.app.test_client()
+    resp = client.post('/api/predict', data={'file': (io.BytesIO(b'x' * 4096), 'a.jpg')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 413
+    assert 'tomato_rejections_total{reason="too_large_request"} 1' in app_module.metrics.render()
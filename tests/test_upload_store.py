@@ -0,0 +1,139 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+from conftest import make_image_bytes
+from upload_store import UploadStore, find_upload_images, is_digest, logged_upload_path, upload_digest
+
+
+def test_identical_uploads_are_stored_once_and_refcounted(tmp_path):
+    store = UploadStore(str(tmp_path / 'store'))
+    data = make_image_bytes((640, 480))
+    first = store.put(data)
+    second = store.put(data)
+    assert first.created and not second.created
+    assert first.digest == second.digest == upload_digest(data)
+    assert is_digest(first.digest)
+    assert first.path == os.path.join(str(tmp_path / 'store'), first.digest[:2], first.digest[2:4],
+                                      first.digest + '.jpg')
+    stats = store.stats()
+    assert stats['uploads'] == 1 and stats['references'] == 2
+
+
+def test_large_and_png_uploads_are_normalized_to_jpeg(tmp_path):
+    store = UploadStore(str(tmp_path / 'store'), max_side=256)
+    big = store.put(make_image_bytes((2000, 1500)))
+    png = store.put(make_image_bytes((300, 200), fmt='PNG'))
+    with Image.open(big.path) as img:
+        assert img.format == 'JPEG' and max(img.size) == 256
+    with Image.open(png.path) as img:
+        assert img.format == 'JPEG' and img.size == (256, 171)
+    assert store.get(big.digest)['width'] == 256
+
+
+def test_small_jpeg_is_kept_as_is_when_reencoding_does_not_help(tmp_path):
+    store = UploadStore(str(tmp_path / 'store'), quality=100)
+    buf = io.BytesIO()
+    noise = np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype='uint8')
+    Image.fromarray(noise).save(buf, format='JPEG', quality=30)
+    stored = store.put(buf.getvalue())
+    with open(stored.path, 'rb') as f:
+        assert f.read() == buf.getvalue()
+
+
+def test_release_deletes_file_and_masks_at_zero_refs(tmp_path):
+    store = UploadStore(str(tmp_path / 'store'))
+    data = make_image_bytes()
+    stored = store.put(data)
+    store.put(data)
+    mask = os.path.join(os.path.dirname(stored.path), stored.digest + '_mask_abc.png')
+    open(mask, 'wb').close()
+    assert store.release(stored.digest) == 1
+    assert os.path.exists(stored.path)
+    assert store.release(stored.digest) == 0
+    assert not os.path.exists(stored.path) and not os.path.exists(mask)
+    assert store.get(stored.digest) is None
+
+
+def test_predict_references_upload_by_hash(app_module, classifier):
+    client = app_module.app.test_client()
+    data = make_image_bytes((2000, 1500))
+    for name in ('a.jpg', 'b.jpg'):
+        resp = client.post('/api/predict', data={'file': (io.BytesIO(data), name)},
+                           content_type='multipart/form-data')
+        assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['upload_id'] == upload_digest(data)
+    assert app_module.upload_store.stats()['references'] == 2
+    assert client.get(body['image_url']).status_code == 200
+    assert client.get(f"/preview/{body['upload_id']}").status_code == 200
+    assert client.get(body['mask_url']).status_code == 200
+    assert client.get('/uploads/' + '0' * 64).status_code == 404
+
+
+def test_logged_uploads_resolve_through_the_store_and_legacy_debug_folder(tmp_path):
+    store = UploadStore(str(tmp_path / 'store'))
+    stored = store.put(make_image_bytes())
+    store.put(make_image_bytes(color=(10, 200, 10)))
+    debug = tmp_path / 'debug'
+    debug.mkdir()
+    (debug / 'old.jpg').write_bytes(make_image_bytes())
+    (debug / 'old_mask_abc.png').write_bytes(b'')
+
+    assert logged_upload_path({'upload_id': stored.digest, 'filename': 'leaf.jpg'}, store, str(debug)) == stored.path
+    assert logged_upload_path({'filename': 'old.jpg'}, store, str(debug)) == str(debug / 'old.jpg')
+    assert len(find_upload_images(store.root)) == 2 and stored.path in find_upload_images(store.root)
+    assert find_upload_images(str(debug)) == [str(debug / 'old.jpg')]
+
+
+def test_put_normalizes_outside_the_index_lock(tmp_path, monkeypatch):
+    store = UploadStore(str(tmp_path / 'store'))
+    other = UploadStore(store.root)
+    kept = store.put(make_image_bytes(color=(10, 200, 10)))
+    seen = []
+    normalize = UploadStore.normalize
+
+    def slow_normalize(self, data, image=None):
+        # another worker can still take references while this upload is encoded
+        seen.append(other.put(make_image_bytes(color=(10, 200, 10))).digest)
+        return normalize(self, data, image)
+
+    monkeypatch.setattr(UploadStore, 'normalize', slow_normalize)
+    stored = store.put(make_image_bytes())
+    assert stored.created and seen == [kept.digest]
+    assert store.get(kept.digest)['refs'] == 2 and store.get(stored.digest)['refs'] == 1
+
+
+def test_put_rewrites_an_upload_released_while_it_was_being_stored(tmp_path, monkeypatch):
+    store = UploadStore(str(tmp_path / 'store'))
+    data = make_image_bytes()
+    stored = store.put(data)
+    reference = store._reference
+
+    def racing_reference(*args):
+        if os.path.exists(stored.path) and store.get(stored.digest):
+            store.release(stored.digest)
+        return reference(*args)
+
+    monkeypatch.setattr(store, '_reference', racing_reference)
+    again = store.put(data)
+    assert again.created and os.path.exists(again.path) and store.get(again.digest)['refs'] == 1
+
+
+def test_pruned_debug_logs_release_their_uploads(app_module, classifier, monkeypatch):
+    writer = app_module.DebugWriter(app_module.DEBUG_LOG, app_module.DEBUG_DIR, flush_interval=0, max_bytes=1,
+                                    keep_rotated=1, on_prune=app_module.upload_store.release_log)
+    monkeypatch.setattr(app_module, 'debug_writer', writer)
+    client = app_module.app.test_client()
+    ids = []
+    for color in ((10, 200, 10), (20, 180, 20), (30, 160, 30)):
+        resp = client.post('/api/predict', data={'file': (io.BytesIO(make_image_bytes(color=color)), 'leaf.jpg')},
+                           content_type='multipart/form-data')
+        ids.append(resp.get_json()['upload_id'])
+        assert writer.flush()
+    # the third write rotated the second log and pruned the first one
+    store = app_module.upload_store
+    assert store.get(ids[0]) is None and not os.path.exists(store.path(ids[0]))
+    assert store.get(ids[1])['refs'] == 1 and store.get(ids[2])['refs'] == 1
@@ -0,0 +1,112 @@
+import queue
+
+import numpy as np
+
+
+def load_interpreter_class():
+    """Return a TFLite Interpreter class, preferring the slim runtimes over full TensorFlow."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """
+    Keras-style `predict()` over a small pool of TFLite interpreters.
+
+    A single Interpreter is not thread-safe, so each call borrows one from the
+    pool (one per concurrent request thread is enough) and returns it when
+    done. Each interpreter runs its kernels on `num_threads` CPU threads.
+
+    Parameters:
+    - model_path: path to a .tflite file (ignored when model_content is given)
+    - model_content: raw flatbuffer bytes, e.g. read once and shared between workers
+    - num_threads: CPU threads per interpreter
+    - pool_size: number of interpreters available to concurrent callers
+    """
+
+    def __init__(self, model_path=None, model_content=None, num_threads=1, pool_size=1):
+        if model_path is None and model_content is None:
+            raise ValueError('model_path or model_content is required')
+        self.model_path = model_path
+        self.model_content = model_content
+        self.num_threads = max(1, int(num_threads))
+        self.pool_size = max(1, int(pool_size))
+        self._interpreter_class = load_interpreter_class()
+        self._pool = queue.Queue()
+        for _ in range(self.pool_size):
+            self._pool.put(self._new_interpreter())
+
+        probe = self._pool.get()
+        try:
+            inp = probe.get_input_details()[0]
+            self.input_shape = tuple(int(d) for d in inp['shape'])
+            self.input_dtype = inp['dtype']
+        finally:
+            self._pool.put(probe)
+
+    def _new_interpreter(self):
+        if self.model_content is not None:
+            interp = self._interpreter_class(model_content=self.model_content, num_threads=self.num_threads)
+        else:
+            interp = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+        interp.allocate_tensors()
+        return interp
+
+    @staticmethod
+    def _quantize(batch, detail):
+        # Full-integer models expect quantized inputs; float models take the batch as-is
+        if detail['dtype'] == np.float32:
+            return batch.astype('float32')
+        scale, zero_point = detail['quantization']
+        if scale:
+            batch = batch / scale + zero_point
+        info = np.iinfo(detail['dtype'])
+        return np.clip(np.round(batch), info.min, info.max).astype(detail['dtype'])
+
+    @staticmethod
+    def _dequantize(out, detail):
+        if detail['dtype'] == np.float32:
+            return out
+        scale, zero_point = detail['quantization']
+        if not scale:
+            return out.astype('float32')
+        return (out.astype('float32') - zero_point) * scale
+
+    def _invoke(self, interp, batch):
+        inp = interp.get_input_details()[0]
+        if int(inp['shape'][0]) != batch.shape[0]:
+            interp.resize_tensor_input(inp['index'], [batch.shape[0]] + list(batch.shape[1:]))
+            interp.allocate_tensors()
+            inp = interp.get_input_details()[0]
+        interp.set_tensor(inp['index'], self._quantize(batch, inp))
+        interp.invoke()
+        out = interp.get_output_details()[0]
+        return self._dequantize(interp.get_tensor(out['index']), out)
+
+    def predict(self, batch, **kwargs):
+        """Run inference on an (N, H, W, C) float batch and return an (N, outputs) array."""
+        batch = np.asarray(batch, dtype='float32')
+        interp = self._pool.get()
+        try:
+            try:
+                return self._invoke(interp, batch)
+            except (ValueError, RuntimeError):
+                if batch.shape[0] == 1:
+                    raise
+                # Models exported with a fixed batch dimension cannot be resized;
+                # fall back to one invoke per row on a freshly sized interpreter.
+                interp = self._new_interpreter()
+                rows = [self._invoke(interp, batch[i:i + 1]) for i in range(batch.shape[0])]
+                return np.concatenate(rows, axis=0)
+        finally:
+            self._pool.put(interp)
@@ -0,0 +1,67 @@
+import io
+import warnings
+from collections import namedtuple
+
+from PIL import Image
+
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height'])
+
+# Rejection reason -> message shown to the client
+REJECTION_MESSAGES = {
+    'empty': 'The uploaded file is empty.',
+    'corrupt': 'The uploaded file is not a readable image.',
+    'unsupported_format': 'Unsupported image format. Allowed: png,jpg,jpeg',
+    'too_large_dimensions': 'Image is too large: each side must be at most {max_side} pixels.',
+    'too_many_pixels': 'Image is too large: at most {max_megapixels:g} megapixels are accepted.',
+}
+
+
+def check_image_header(fp, allowed_formats=('JPEG', 'PNG'), max_side=10000, max_pixels=40_000_000):
+    """
+    Validate an upload from its header alone, before anything is decoded or written.
+
+    PIL's Image.open only parses the header (JPEG markers up to the frame
+    header, the PNG IHDR chunk), so this costs tens of microseconds whatever
+    the file size and never allocates pixel memory.
+
+    Parameters:
+    - fp: bytes or a seekable binary file (left positioned at the start)
+    - allowed_formats: PIL format names accepted
+    - max_side: largest width or height accepted
+    - max_pixels: largest width x height accepted
+
+    Returns (ImageHeader, None) when the upload is acceptable, otherwise
+    (header or None, reason) with a key of REJECTION_MESSAGES.
+    """
+    if isinstance(fp, (bytes, bytearray, memoryview)):
+        fp = io.BytesIO(fp)
+    start = fp.tell()
+    try:
+        if not fp.read(1):
+            return None, 'empty'
+        fp.seek(start)
+        with warnings.catch_warnings():
+            # PIL warns (and past 2x its own limit, raises) on decompression bombs; we apply our own limit
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(fp) as img:
+                header = ImageHeader(img.format, img.size[0], img.size[1])
+    except Image.DecompressionBombError:
+        return None, 'too_many_pixels'
+    except Exception:
+        return None, 'corrupt'
+    finally:
+        fp.seek(start)
+
+    if header.format not in allowed_formats:
+        return header, 'unsupported_format'
+    if header.width <= 0 or header.height <= 0:
+        return header, 'corrupt'
+    if max(header.width, header.height) > max_side:
+        return header, 'too_large_dimensions'
+    if header.width * header.height > max_pixels:
+        return header, 'too_many_pixels'
+    return header, None
+
+
+def rejection_message(reason, max_side=10000, max_pixels=40_000_000):
+    return REJECTION_MESSAGES[reason].format(max_side=max_side, max_megapixels=max_pixels / 1e6)
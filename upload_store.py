@@ -0,0 +1,251 @@
+"""Content-addressed storage for uploaded images.
+
+    python upload_store.py [--root static/uploads/store]   # print store statistics
+    python upload_store.py --release <hash> [<hash> ...]  # drop references by hash
+    python upload_store.py --release-log <debug_logs.*.jsonl>  # drop the references of a log being deleted
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+StoredUpload = namedtuple('StoredUpload', ['digest', 'path', 'created'])
+
+DEFAULT_ROOT = os.getenv('UPLOAD_STORE_DIR', os.path.join('static', 'uploads', 'store'))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def upload_digest(data):
+    """SHA-256 of the uploaded bytes (the same digest PredictionCache keys on)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_digest(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def logged_upload_path(entry, store, debug_dir):
+    """Image of a debug-log entry: the store copy by upload_id, or by filename in the debug folder
+    for entries logged before uploads moved to the store."""
+    if entry.get('upload_id'):
+        return store.path(entry['upload_id'])
+    return os.path.join(debug_dir, entry.get('filename') or '')
+
+
+def find_upload_images(folder):
+    """Sorted image paths in `folder`: every stored upload when it is an UploadStore root (sharded,
+    mask overlays skipped), otherwise the images directly inside it (e.g. a legacy debug folder)."""
+    if os.path.exists(os.path.join(folder, 'index.sqlite3')):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(folder):
+            paths.extend(os.path.join(dirpath, n) for n in filenames
+                         if n.endswith('.jpg') and is_digest(n[:-4]))
+        return sorted(paths)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, n) for n in os.listdir(folder)
+                  if n.lower().endswith(IMAGE_EXTENSIONS) and '_mask_' not in n)
+
+
+class UploadStore:
+    """
+    Content-addressed, deduplicating store for uploads.
+
+    Every distinct upload is kept once, as <root>/<h[:2]>/<h[2:4]>/<h>.jpg,
+    where h is the SHA-256 of the bytes the client sent. Images are
+    normalized at ingest: shrunk to at most max_side pixels and re-encoded as
+    JPEG at `quality` (a JPEG upload that is already small enough is kept
+    as-is when that is smaller). Storing an image that is already present
+    only bumps its reference count, so a re-upload writes no image data.
+
+    Reference counts live in <root>/index.sqlite3, which every worker
+    process opens; one reference is taken per logged prediction, and
+    release() deletes the file when the last one is dropped. The debug
+    writer calls release_log() on each rotated log it prunes, so uploads
+    live as long as the newest log that mentions them.
+
+    Parameters:
+    - root: directory for the shards and the index
+    - max_side: longest side kept after normalization
+    - quality: JPEG quality used when re-encoding
+    """
+
+    def __init__(self, root, max_side=1024, quality=85):
+        self.root = root
+        self.max_side = int(max_side)
+        self.quality = int(quality)
+        self.index_path = os.path.join(root, 'index.sqlite3')
+        self._local = threading.local()
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS uploads ('
+                         'digest TEXT PRIMARY KEY, bytes INTEGER, original_bytes INTEGER, '
+                         'width INTEGER, height INTEGER, refs INTEGER, created REAL, last_used REAL)')
+
+    def _connect(self):
+        # one connection per thread and process; sqlite connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def relpath(self, digest):
+        return os.path.join(digest[:2], digest[2:4], f'{digest}.jpg')
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relpath(digest))
+
+    def normalize(self, data, image=None):
+        """JPEG bytes for the stored copy of an upload, plus its (width, height)."""
+        if image is None:
+            image = Image.open(io.BytesIO(data))
+            if image.format == 'JPEG':
+                image.draft('RGB', (self.max_side, self.max_side))
+            image = image.convert('RGB')
+        if max(image.size) > self.max_side:
+            image = image.copy()
+            image.thumbnail((self.max_side, self.max_side))
+        buf = io.BytesIO()
+        image.save(buf, format='JPEG', quality=self.quality, optimize=True)
+        encoded = buf.getvalue()
+        if data[:3] == b'\xff\xd8\xff' and len(data) <= len(encoded):
+            with Image.open(io.BytesIO(data)) as original:
+                if max(original.size) <= self.max_side:
+                    return data, original.size
+        return encoded, image.size
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put(self, data, image=None, digest=None):
+        """Store (or re-reference) an upload; returns StoredUpload(digest, path, created).
+
+        `image` may be an already decoded RGB PIL image of `data` (e.g. ImagePipeline.image),
+        so storing a new upload does not decode it again.
+        """
+        digest = digest or upload_digest(data)
+        path = self.path(digest)
+        while True:
+            created, meta = False, (None, None, None)
+            if not os.path.exists(path):
+                # decode/encode and write outside the index lock; racing writers produce the same bytes
+                stored, (width, height) = self.normalize(data, image)
+                self._write(path, stored)
+                created, meta = True, (len(stored), width, height)
+            if self._reference(digest, path, len(data), meta):
+                return StoredUpload(digest, path, created)
+            # released (and deleted) by another process between the write and the transaction
+
+    def _reference(self, digest, path, original_bytes, meta):
+        """Take one reference in a short transaction; False if the file vanished in the meantime."""
+        nbytes, width, height = meta
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not os.path.exists(path):
+                conn.execute('ROLLBACK')
+                return False
+            cur = conn.execute('UPDATE uploads SET refs = refs + 1, last_used = ? WHERE digest = ?',
+                               (now, digest))
+            if cur.rowcount == 0:
+                conn.execute('INSERT INTO uploads VALUES (?, ?, ?, ?, ?, 1, ?, ?)',
+                             (digest, nbytes or os.path.getsize(path), original_bytes, width, height, now, now))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, digest):
+        """Drop one reference; the file (and its mask overlays) are deleted at zero. Returns refs left."""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT refs FROM uploads WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return 0
+            refs = row[0] - 1
+            if refs > 0:
+                conn.execute('UPDATE uploads SET refs = ? WHERE digest = ?', (refs, digest))
+            else:
+                conn.execute('DELETE FROM uploads WHERE digest = ?', (digest,))
+                shard = os.path.dirname(self.path(digest))
+                for name in os.listdir(shard) if os.path.isdir(shard) else ():
+                    if name.startswith(digest):
+                        os.remove(os.path.join(shard, name))
+            conn.execute('COMMIT')
+            return max(refs, 0)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release_log(self, log_path):
+        """Release one reference per entry with an upload_id in a debug JSONL log; returns how many."""
+        released = 0
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    digest = json.loads(line).get('upload_id')
+                except (ValueError, AttributeError):
+                    continue
+                if digest and is_digest(digest):
+                    self.release(digest)
+                    released += 1
+        return released
+
+    def get(self, digest):
+        """Index row for a digest as a dict, or None."""
+        row = self._connect().execute(
+            'SELECT digest, bytes, original_bytes, width, height, refs, created, last_used '
+            'FROM uploads WHERE digest = ?', (digest,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('digest', 'bytes', 'original_bytes', 'width', 'height', 'refs', 'created', 'last_used'), row))
+
+    def stats(self):
+        uploads, refs, stored, received = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(refs), 0), COALESCE(SUM(bytes), 0), '
+            'COALESCE(SUM(original_bytes * refs), 0) FROM uploads').fetchone()
+        return {
+            'root': self.root,
+            'uploads': uploads,
+            'references': refs,
+            'bytes_stored': stored,
+            'bytes_received': received,
+            'bytes_saved': received - stored,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print content-addressed upload store statistics.')
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--release', nargs='+', metavar='HASH', help='drop one reference to each upload')
+    parser.add_argument('--release-log', nargs='+', metavar='LOG',
+                        help='drop the references of every entry in these debug logs (before deleting them)')
+    args = parser.parse_args()
+    store = UploadStore(args.root)
+    for digest in args.release or ():
+        print(digest, 'refs left:', store.release(digest))
+    for log_path in args.release_log or ():
+        print(log_path, 'references released:', store.release_log(log_path))
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()